@@ -0,0 +1,185 @@
+"""
+A small index of targets and snapshot names for the shell completion.
+
+The index is written by the normal commands. Completing reads it without loading the config
+or connecting to any host. Only if the config file changed, the config is loaded again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from collections.abc import Generator, Iterable
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from b4_backup import utils
+from b4_backup.config_schema import BaseConfig, TargetIndex
+
+if TYPE_CHECKING:  # pragma: no cover
+    from b4_backup.main.backup_target_host import BackupTargetHost
+
+log = logging.getLogger("b4_backup.cli")
+
+# Increase, if the format of the index changes
+_INDEX_VERSION = 1
+# Number of snapshot names kept per target
+MAX_SNAPSHOTS = 50
+
+
+def index_path(config_path: Path) -> Path:
+    """
+    Return the location of the completion index of a config file.
+
+    Args:
+        config_path: Path of the config file
+
+    Returns:
+        Path of the index file in the cache directory.
+    """
+    key = hashlib.sha256(str(config_path.expanduser().absolute()).encode()).hexdigest()
+    return utils.CONFIG_CACHE_DIR / f"completion-{key[:32]}.json"
+
+
+@dataclass
+class CompletionIndex:
+    """
+    Targets and recent snapshot names of a config.
+
+    Attributes:
+        path: Location of the index file
+        config: State of the config file the targets were read from. None if no targets are known yet
+        targets: All targets and their parent paths, sorted
+        snapshots: The most recent snapshot names by target, newest first
+    """
+
+    path: Path
+    config: utils.ConfigInput | None = None
+    targets: list[str] = field(default_factory=list)
+    snapshots: dict[str, list[str]] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: Path) -> "CompletionIndex":
+        """
+        Read the index. A missing or unreadable index results in an empty one.
+
+        Args:
+            path: Location of the index file
+
+        Returns:
+            CompletionIndex instance
+        """
+        try:
+            data: dict[str, Any] = json.loads(path.read_text(encoding="utf8"))
+            if data["version"] != _INDEX_VERSION:
+                return cls(path)
+
+            return cls(
+                path=path,
+                config=data["config"] and utils.ConfigInput(**data["config"]),
+                targets=data["targets"],
+                snapshots=data["snapshots"],
+            )
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            log.debug("Ignoring completion index %s: %s", path, exc)
+            return cls(path)
+
+    def save(self) -> None:
+        """Write the index. Errors are ignored, since the index is only a cache."""
+        try:
+            data = json.dumps(
+                {
+                    "version": _INDEX_VERSION,
+                    "config": self.config and self.config.__dict__,
+                    "targets": self.targets,
+                    "snapshots": self.snapshots,
+                }
+            )
+
+            self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_text(data, encoding="utf8")
+            tmp_path.replace(self.path)
+        except (OSError, TypeError, ValueError) as exc:
+            log.debug("Unable to write completion index %s: %s", self.path, exc)
+
+    def outdated(self) -> bool:
+        """
+        Returns:
+            True if the targets are unknown or the config file changed since they were read.
+        """
+        return self.config is None or self.config.changed()
+
+    def update_targets(self, config: BaseConfig) -> None:
+        """
+        Read the targets of a config. Snapshots of targets, which no longer exist, are dropped.
+
+        Args:
+            config: Loaded b4 config
+        """
+        target_index = config.target_index
+
+        try:
+            self.config = utils.ConfigInput.from_path(str(config.config_path))
+        except OSError:
+            # Read the config again on the next completion
+            self.config = None
+
+        self.targets = target_index.prefixes()
+        self.snapshots = {k: v for k, v in self.snapshots.items() if k in target_index.targets}
+
+    def record(self, *hosts: "BackupTargetHost | None") -> None:
+        """
+        Remember the snapshot names present on the hosts of a target.
+
+        Args:
+            hosts: Source and/or destination host of the same target
+        """
+        names: set[str] = set()
+        target_name = None
+        for host in hosts:
+            if host:
+                target_name = host.name
+                names |= set(host.snapshots())
+
+        if target_name:
+            # Snapshot names start with a timestamp
+            self.snapshots[target_name] = sorted(names, reverse=True)[:MAX_SNAPSHOTS]
+
+    def snapshot_names(self, targets: Iterable[str] = ()) -> list[str]:
+        """
+        Return the snapshot names of the selected targets.
+
+        Args:
+            targets: Selected targets or parents of them. If empty, all targets are used
+
+        Returns:
+            The unique snapshot names, newest first.
+        """
+        targets = list(targets)
+        target_names = TargetIndex(self.snapshots).select(targets) if targets else self.snapshots
+        names = {name for target_name in target_names for name in self.snapshots[target_name]}
+
+        return sorted(names, reverse=True)
+
+
+@contextmanager
+def completion_index(config: BaseConfig) -> Generator[CompletionIndex, None, None]:
+    """
+    Open the completion index of a config to record snapshots. It's written at the end.
+
+    Args:
+        config: Loaded b4 config
+
+    Returns:
+        The index with the current targets of the config
+    """
+    index = CompletionIndex.load(index_path(config.config_path))
+    if index.outdated():
+        index.update_targets(config)
+
+    yield index
+
+    index.save()
@@ -1,19 +1,19 @@
 """Contains the base part of the CLI."""
 
-import logging.config
 from pathlib import Path
 
-import omegaconf
-import rich
 import typer
 
 from b4_backup import utils
+from b4_backup.config_schema import BaseConfig
 
 app = typer.Typer(
     pretty_exceptions_enable=False,
     no_args_is_help=True,
 )
 
+_CONFIG_ARGS = "b4_backup.config_args"
+
 
 def _version_callback(value: bool):
     if value:
@@ -43,6 +43,30 @@ def init(
     ),
 ):
     """Backup and restore btrfs subvolumes using btrfs-progs."""
+    # The config is loaded by the commands on first use, so --help doesn't need to read it
+    ctx.obj = None
+    ctx.meta[_CONFIG_ARGS] = (config_path, options)
+
+
+def get_config(ctx: typer.Context) -> BaseConfig:
+    """
+    Return the config selected by the CLI options. It's loaded on first use.
+
+    Args:
+        ctx: Context of the running command
+
+    Returns:
+        Config object
+    """
+    if isinstance(ctx.obj, BaseConfig):
+        return ctx.obj
+
+    import logging.config
+
+    import omegaconf
+    import rich
+
+    config_path, options = ctx.meta[_CONFIG_ARGS]
     try:
         config = utils.load_config(config_path, options)
     except omegaconf.errors.OmegaConfBaseException as exc:
@@ -53,3 +77,4 @@ def init(
     logging.config.dictConfig(config.logging)
 
     ctx.obj = config
+    return config
@@ -1,24 +1,31 @@
 """Contains code for the main part of the CLI."""
 
 import logging
+from typing import TYPE_CHECKING
 
 import typer
-from rich import prompt
 
 from b4_backup import exceptions
-from b4_backup.cli.init import app
+from b4_backup.cli.completion import completion_index
+from b4_backup.cli.init import app, get_config
 from b4_backup.cli.tools import app as tools_app
 from b4_backup.cli.utils import (
     OutputFormat,
+    catalog_snapshots,
+    complete_snapshot,
     complete_target,
     error_handler,
+    open_catalog,
     validate_target,
 )
 from b4_backup.config_schema import BaseConfig, TargetRestoreStrategy
-from b4_backup.main.b4_backup import B4Backup
-from b4_backup.main.backup_target_host import host_generator
 from b4_backup.main.dataclass import ChoiceSelector
 
+# The backup logic and its dependencies (paramiko, arrow) are imported by the commands,
+# so --help, --version and the shell completion start fast
+if TYPE_CHECKING:  # pragma: no cover
+    from b4_backup.main.catalog import SnapshotCatalog
+
 log = logging.getLogger("b4_backup.cli")
 
 app.add_typer(tools_app, name="tools")
@@ -45,28 +52,52 @@ def backup(
         False,
         help="Perform actions on source side only",
     ),
+    pipeline: bool = typer.Option(
+        False,
+        help="Overlap the snapshot creation and cleanup of targets with the transfers of other targets."
+        " src_host_concurrency and dst_host_concurrency limit the transfers per host instead of the targets."
+        " Uses at least 3 threads, even if max_workers is lower",
+    ),
 ):
     """Perform backups on specified targets. If no target is specified, the default targets defined in the config will be used."""
-    config: BaseConfig = ctx.obj
+    from b4_backup.main.b4_backup import B4Backup
+    from b4_backup.main.backup_target_host import (
+        DestinationBackupTargetHost,
+        SourceBackupTargetHost,
+        run_targets,
+    )
+
+    config = get_config(ctx)
     target_choice = ChoiceSelector(target or config.default_targets)
 
     b4_backup = B4Backup(config.timezone)
 
-    with error_handler() as err_handler:
+    with (
+        error_handler() as err_handler,
+        open_catalog(config) as catalog,
+        completion_index(config) as index,
+    ):
         snapshot_name = b4_backup.generate_snapshot_name(name)
 
-        for src_host, dst_host in host_generator(
-            target_choice, config.backup_targets, use_destination=not source_only
-        ):
-            try:
-                if not src_host:
-                    raise exceptions.InvalidConnectionUrlError(  # noqa: TRY301
-                        "Backup requires source to be specified"
-                    )
+        def _backup(
+            src_host: SourceBackupTargetHost | None, dst_host: DestinationBackupTargetHost | None
+        ) -> None:
+            if not src_host:
+                raise exceptions.InvalidConnectionUrlError("Backup requires source to be specified")
 
-                b4_backup.backup(src_host, dst_host, snapshot_name)
-            except Exception as exc:
-                err_handler.add(exc)
+            b4_backup.backup(src_host, dst_host, snapshot_name)
+            index.record(src_host, dst_host)
+
+        run_targets(
+            target_choice,
+            config.backup_targets,
+            _backup,
+            max_workers=config.max_workers,
+            use_destination=not source_only,
+            on_error=err_handler.add,
+            catalog=catalog,
+            pipelined=pipeline,
+        )
 
 
 @app.command(name="list")
@@ -83,21 +114,103 @@ def list_snapshots(
     source: bool = typer.Option(False, help="List snapshots on source host"),
     destination: bool = typer.Option(False, help="List snapshots on destination host"),
     format: OutputFormat = typer.Option(OutputFormat.RICH.value, help="Output format"),
+    cached: bool = typer.Option(
+        False,
+        help="Read the snapshots from the catalog. Only targets unknown to the catalog are read from the hosts."
+        " The catalog is updated by b4 only, so snapshots created or deleted by other tools since the last b4 run are missing",
+    ),
 ):
     """List all snapshots for the specified targets."""
-    config: BaseConfig = ctx.obj
+    from b4_backup.main.backup_target_host import (
+        DestinationBackupTargetHost,
+        SourceBackupTargetHost,
+        run_targets,
+    )
+
+    config = get_config(ctx)
     target_choice = ChoiceSelector(target or config.default_targets)
-    with error_handler():
-        for src_host, dst_host in host_generator(
-            target_choice,
-            config.backup_targets,
-            use_source=source,
-            use_destination=destination,
-        ):
-            if src_host:
-                OutputFormat.output(src_host.snapshots(), "Source", format)
-            if dst_host:
-                OutputFormat.output(dst_host.snapshots(), "Destination", format)
+    if cached and config.catalog_path is None:
+        raise typer.BadParameter("--cached requires a catalog_path in the config")
+
+    with (
+        error_handler() as err_handler,
+        open_catalog(config) as catalog,
+        completion_index(config) as index,
+    ):
+        target_names = target_choice.resolve_target(config.backup_targets)
+        results: dict[str | None, tuple[dict | None, dict | None]] = {}
+        if cached:
+            assert catalog is not None
+            results, target_choice = _cached_snapshots(
+                catalog, config, target_names, source, destination
+            )
+
+        def _list(
+            src_host: SourceBackupTargetHost | None, dst_host: DestinationBackupTargetHost | None
+        ) -> tuple[str | None, tuple[dict | None, dict | None]]:
+            for host in (src_host, dst_host):
+                if host:
+                    host.update_catalog()
+
+            index.record(src_host, dst_host)
+            host = src_host or dst_host
+            return (
+                host and host.name,
+                (src_host and src_host.snapshots(), dst_host and dst_host.snapshots()),
+            )
+
+        # Snapshots are collected first, so the output isn't mixed up by parallel targets
+        results.update(
+            run_targets(
+                target_choice,
+                config.backup_targets,
+                _list,
+                max_workers=config.max_workers,
+                use_source=source,
+                use_destination=destination,
+                on_error=err_handler.add,
+                catalog=catalog,
+            )
+        )
+
+        for target_name in target_names:
+            src_snapshots, dst_snapshots = results.get(target_name, (None, None))
+            if src_snapshots is not None:
+                OutputFormat.output(src_snapshots, "Source", format)
+            if dst_snapshots is not None:
+                OutputFormat.output(dst_snapshots, "Destination", format)
+
+
+def _cached_snapshots(
+    catalog: "SnapshotCatalog",
+    config: BaseConfig,
+    target_names: list[str],
+    source: bool,
+    destination: bool,
+) -> tuple[dict[str | None, tuple[dict | None, dict | None]], ChoiceSelector]:
+    """
+    Read the snapshots of the selected targets from the catalog.
+
+    Returns:
+        The snapshots found in the catalog by target and a selector of the targets unknown to the catalog
+    """
+    results: dict[str | None, tuple[dict | None, dict | None]] = {}
+    uncached_targets = []
+    for target_name in target_names:
+        target_config = config.backup_targets[target_name]
+        src_snapshots = source and catalog_snapshots(
+            catalog, target_name, target_config.source, "source"
+        )
+        dst_snapshots = destination and catalog_snapshots(
+            catalog, target_name, target_config.destination, "destination"
+        )
+
+        if (source and src_snapshots is None) or (destination and dst_snapshots is None):
+            uncached_targets.append(target_name)
+        else:
+            results[target_name] = (src_snapshots or None, dst_snapshots or None)
+
+    return results, ChoiceSelector(uncached_targets)
 
 
 @app.command()
@@ -117,25 +230,52 @@ def clean(
     ),
 ):
     """Apply the targets retention ruleset without performing a backup."""
-    config: BaseConfig = ctx.obj
+    from b4_backup.main.b4_backup import B4Backup
+    from b4_backup.main.backup_target_host import (
+        DestinationBackupTargetHost,
+        SourceBackupTargetHost,
+        run_targets,
+    )
+
+    config = get_config(ctx)
     target_choice = ChoiceSelector(target or config.default_targets)
 
     b4_backup = B4Backup(config.timezone)
 
-    with error_handler():
-        for src_host, dst_host in host_generator(
-            target_choice, config.backup_targets, use_destination=not source_only
-        ):
+    with (
+        error_handler() as err_handler,
+        open_catalog(config) as catalog,
+        completion_index(config) as index,
+    ):
+
+        def _clean(
+            src_host: SourceBackupTargetHost | None, dst_host: DestinationBackupTargetHost | None
+        ) -> None:
             if not src_host:
                 raise exceptions.InvalidConnectionUrlError("Clean requires source to be specified")
 
             b4_backup.clean(src_host, dst_host)
+            index.record(src_host, dst_host)
+
+        run_targets(
+            target_choice,
+            config.backup_targets,
+            _clean,
+            max_workers=config.max_workers,
+            use_destination=not source_only,
+            on_error=err_handler.add,
+            catalog=catalog,
+        )
 
 
 @app.command()
 def delete(
     ctx: typer.Context,
-    snapshot_name: str = typer.Argument(..., help="Name of the snapshot you want to restore"),
+    snapshot_name: str = typer.Argument(
+        ...,
+        help="Name of the snapshot you want to restore",
+        autocompletion=complete_snapshot,
+    ),
     target: list[str] = typer.Option(
         [],
         "-t",
@@ -148,18 +288,31 @@ def delete(
     destination: bool = typer.Option(False, help="Delete from destination host"),
 ):
     """Delete a specific snapshot from the source and/or destination."""
-    config: BaseConfig = ctx.obj
+    from b4_backup.main.b4_backup import B4Backup
+    from b4_backup.main.backup_target_host import host_generator
+
+    config = get_config(ctx)
     target_choice = ChoiceSelector(target or config.default_targets)
     b4_backup = B4Backup(config.timezone)
-    with error_handler():
+    with (
+        error_handler(),
+        open_catalog(config) as catalog,
+        completion_index(config) as index,
+    ):
         for src_host, dst_host in host_generator(
-            target_choice, config.backup_targets, use_source=source, use_destination=destination
+            target_choice,
+            config.backup_targets,
+            use_source=source,
+            use_destination=destination,
+            catalog=catalog,
         ):
             if src_host:
                 b4_backup.delete(src_host, snapshot_name)
             if dst_host:
                 b4_backup.delete(dst_host, snapshot_name)
 
+            index.record(src_host, dst_host)
+
 
 @app.command()
 def delete_all(
@@ -183,7 +336,12 @@ def delete_all(
     destination: bool = typer.Option(False, help="Delete from destination host"),
 ):
     """Delete all local and remote backups of the specified target/retention ruleset combination. Equivalent to an "all: 0" rule."""
-    config: BaseConfig = ctx.obj
+    from rich import prompt
+
+    from b4_backup.main.b4_backup import B4Backup
+    from b4_backup.main.backup_target_host import host_generator
+
+    config = get_config(ctx)
     target_choice = ChoiceSelector(target or config.default_targets)
     retention_names = ChoiceSelector(retention)
 
@@ -197,9 +355,17 @@ def delete_all(
 
     b4_backup = B4Backup(config.timezone)
 
-    with error_handler():
+    with (
+        error_handler(),
+        open_catalog(config) as catalog,
+        completion_index(config) as index,
+    ):
         for src_host, dst_host in host_generator(
-            target_choice, config.backup_targets, use_source=source, use_destination=destination
+            target_choice,
+            config.backup_targets,
+            use_source=source,
+            use_destination=destination,
+            catalog=catalog,
         ):
             if src_host:
                 b4_backup.delete_all(src_host, retention_names)
@@ -207,11 +373,17 @@ def delete_all(
             if dst_host:
                 b4_backup.delete_all(dst_host, retention_names)
 
+            index.record(src_host, dst_host)
+
 
 @app.command()
 def restore(
     ctx: typer.Context,
-    snapshot_name: str = typer.Argument(..., help="Name of the snapshot you want to restore"),
+    snapshot_name: str = typer.Argument(
+        ...,
+        help="Name of the snapshot you want to restore",
+        autocompletion=complete_snapshot,
+    ),
     target: list[str] = typer.Option(
         [],
         "-t",
@@ -233,7 +405,10 @@ def restore(
     Restore one or more targets based on a previously created snapshot.
     You can revert a REPLACE restore by using REPLACE als snapshot name and strategy.
     """
-    config: BaseConfig = ctx.obj
+    from b4_backup.main.b4_backup import B4Backup
+    from b4_backup.main.backup_target_host import host_generator
+
+    config = get_config(ctx)
     target_choice = ChoiceSelector(target or config.default_targets)
 
     b4_backup = B4Backup(config.timezone)
@@ -265,19 +440,43 @@ def sync(
     ),
 ):
     """Send pending snapshots to the destination."""
-    config: BaseConfig = ctx.obj
+    from b4_backup.main.b4_backup import B4Backup
+    from b4_backup.main.backup_target_host import (
+        DestinationBackupTargetHost,
+        SourceBackupTargetHost,
+        run_targets,
+    )
+
+    config = get_config(ctx)
     target_choice = ChoiceSelector(target or config.default_targets)
 
     b4_backup = B4Backup(config.timezone)
 
-    with error_handler():
-        for src_host, dst_host in host_generator(target_choice, config.backup_targets):
+    with (
+        error_handler() as err_handler,
+        open_catalog(config) as catalog,
+        completion_index(config) as index,
+    ):
+
+        def _sync(
+            src_host: SourceBackupTargetHost | None, dst_host: DestinationBackupTargetHost | None
+        ) -> None:
             if not src_host or not dst_host:
                 raise exceptions.InvalidConnectionUrlError(
                     "Sync requires source and destination to be specified"
                 )
 
             b4_backup.sync(src_host, dst_host)
+            index.record(src_host, dst_host)
+
+        run_targets(
+            target_choice,
+            config.backup_targets,
+            _sync,
+            max_workers=config.max_workers,
+            on_error=err_handler.add,
+            catalog=catalog,
+        )
 
 
 # A collection of stuff I would like to improve
@@ -299,7 +498,6 @@ def sync(
 # TODO: rich print_log function
 #   - To optionally print logs like a standard rich.print()
 #   - Will be in a seperate logger. Maybe b4_backup.print
-#   - Subvolume transmission info (Bytes transfered, duration, rate)
 
 # TODO: List snapshots flags
 #   - Show status of snapshot for example: stale, async
@@ -6,16 +6,18 @@ Some parts here may be untested.
 import io
 import json
 import logging
+import time
 
 import rich
 import typer
-from omegaconf import OmegaConf
 from rich.syntax import Syntax
+from rich.table import Table
 
-from b4_backup import config_schema
+from b4_backup import config_schema, exceptions
 from b4_backup.cli import utils
-from b4_backup.main import backup_target_host, dataclass
-from b4_backup.main.b4_backup import B4Backup
+from b4_backup.cli.init import get_config
+from b4_backup.main import dataclass
+from b4_backup.utils import CONSOLE
 
 log = logging.getLogger("b4_backup.cli")
 
@@ -25,11 +27,183 @@ app = typer.Typer(help=__doc__)
 @app.command()
 def dump_config(ctx: typer.Context):
     """Return the fully interpolated configuration. For debugging."""
-    config: config_schema.BaseConfig = ctx.obj
+    from omegaconf import OmegaConf
+
+    config = get_config(ctx)
 
     rich.print(Syntax(OmegaConf.to_yaml(config), "yaml", line_numbers=True))
 
 
+@app.command()
+def simulate_retention(
+    ctx: typer.Context,
+    target: str = typer.Option(
+        config_schema.DEFAULT,
+        "-t",
+        "--target",
+        help="Simulate the retention rules of this target",
+        autocompletion=utils.complete_target,
+    ),
+    name: str = typer.Option("manual", "-n", "--name", help="Name of the retention ruleset"),
+    rule: list[str] = typer.Option(
+        [],
+        "-r",
+        "--rule",
+        help="Simulate this rule (e.g. 1day=1month) instead of the rules of the target",
+    ),
+    interval: str = typer.Option("1hour", help="Time between two snapshots"),
+    duration: str = typer.Option("2years", help="Simulated timespan"),
+    step: str = typer.Option("1day", help="Time between two retention runs"),
+):
+    """Simulate, which snapshots a retention ruleset keeps over time and how long the evaluation takes.
+
+    Snapshots are created every interval and the retention is applied every step with a simulated clock.
+    """
+    import arrow
+
+    config = get_config(ctx)
+    if target not in config.backup_targets:
+        raise typer.BadParameter(f"Unknown target {target}")
+
+    interval_seconds = _fixed_seconds(interval)
+    step_seconds = _fixed_seconds(step)
+    duration_size, duration_magnitude = _parse_timebox(duration)
+    if duration_magnitude in (None, "forever"):
+        raise typer.BadParameter(f"{duration} must be a timespan")
+
+    simulated_rules = _parse_rules(rule)
+
+    end = arrow.utcnow()
+    start = end.shift(**{duration_magnitude: -duration_size})
+
+    with utils.error_handler():
+        if simulated_rules:
+            rulesets = {"Rules": simulated_rules}
+        else:
+            target_config = config.backup_targets[target]
+            rulesets = {
+                title: dataclass.RetentionGroup.from_target(
+                    name, target_config, is_source=is_source
+                ).target_retention
+                for title, is_source in [("Source", True), ("Destination", False)]
+            }
+
+        table = Table(title=f"Retention simulation ({interval} snapshots for {duration})")
+        for column in [
+            "Ruleset",
+            "Rules",
+            "Created",
+            "Kept",
+            "Peak",
+            "Oldest kept",
+            "Runs",
+            "Time",
+        ]:
+            table.add_column(column)
+
+        for title, rules in rulesets.items():
+            result = _simulate_retention(
+                dict(rules), start.int_timestamp, end.int_timestamp, interval_seconds, step_seconds
+            )
+            table.add_row(
+                title,
+                "\n".join(f"{k}: {v}" for k, v in rules.items()),
+                str(result["created"]),
+                str(result["kept"]),
+                str(result["peak"]),
+                str(result["oldest"]),
+                str(result["runs"]),
+                f"{result['evaluation_time']:.3f}s",
+            )
+
+        CONSOLE.print(table)
+
+
+def _parse_timebox(timebox: str, is_interval: bool = False) -> tuple[int, str | None]:
+    from b4_backup.main import retention
+
+    try:
+        return retention.parse_timebox(timebox, is_interval=is_interval)
+    except exceptions.InvalidRetentionRuleError as exc:
+        raise typer.BadParameter(str(exc)) from exc
+
+
+def _parse_rules(rules: list[str]) -> dict[str, str]:
+    result = {}
+    for rule in rules:
+        interval, separator, duration = rule.partition("=")
+        if not separator:
+            raise typer.BadParameter(
+                f"{rule} must look like <interval>=<duration>, e.g. 1day=1month"
+            )
+
+        _parse_timebox(interval, is_interval=True)
+        _parse_timebox(duration)
+        result[interval] = duration
+
+    return result
+
+
+def _fixed_seconds(timebox: str) -> int:
+    from b4_backup.main import retention
+
+    size, magnitude = _parse_timebox(timebox)
+    if magnitude not in retention.UNIT_SECONDS or size <= 0:
+        raise typer.BadParameter(f"{timebox} must be a positive duration of weeks or less")
+
+    return size * retention.UNIT_SECONDS[magnitude]
+
+
+def _simulate_retention(
+    rules: dict[str, str], start: int, end: int, interval: int, step: int
+) -> dict[str, int | float | str | None]:
+    """
+    Create snapshots every interval and apply the retention rules every step.
+
+    Args:
+        rules: Retention rules to simulate
+        start: Timestamp of the first snapshot
+        end: Timestamp to stop the simulation
+        interval: Seconds between two snapshots
+        step: Seconds between two retention runs
+
+    Returns:
+        Statistics of the simulation.
+    """
+    import arrow
+
+    from b4_backup.main import retention
+    from b4_backup.main.b4_backup import B4Backup
+
+    snapshot_timestamps = range(start, end + 1, interval)
+    kept: set[str] = set()
+    peak = 0
+    runs = 0
+    evaluation_time = 0.0
+    index = 0
+
+    for clock in range(start, end + step, step):
+        while index < len(snapshot_timestamps) and snapshot_timestamps[index] <= clock:
+            kept.add(retention.format_timestamp(snapshot_timestamps[index]))
+            index += 1
+
+        peak = max(peak, len(kept))
+
+        evaluation_start = time.perf_counter()
+        kept = B4Backup("UTC", now=arrow.get(clock))._retained_snapshots(kept, rules)
+        evaluation_time += time.perf_counter() - evaluation_start
+        runs += 1
+
+    return {
+        "created": len(snapshot_timestamps),
+        "kept": len(kept),
+        "peak": peak,
+        "oldest": min(kept, default=None),
+        "runs": runs,
+        "evaluation_time": evaluation_time,
+    }
+
+
 @app.command()
 def update_config(  # pragma: no cover
     ctx: typer.Context,
@@ -51,9 +225,12 @@ def update_config(  # pragma: no cover
     """
     from ruamel.yaml import YAML
 
+    from b4_backup.main import backup_target_host
+    from b4_backup.main.b4_backup import B4Backup
+
     yaml = YAML()
 
-    config: config_schema.BaseConfig = ctx.obj
+    config = get_config(ctx)
     b4_backup = B4Backup(config.timezone)
 
     with utils.error_handler():
@@ -6,7 +6,7 @@ from collections.abc import Generator
 from contextlib import contextmanager
 from enum import Enum
 from pathlib import Path, PurePath
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
 import click
 import rich
@@ -14,22 +14,30 @@ import typer
 from rich.table import Table
 
 from b4_backup import utils
-from b4_backup.cli.init import app, init
-from b4_backup.config_schema import DEFAULT, BaseConfig
+from b4_backup.cli.completion import CompletionIndex, index_path
+from b4_backup.cli.init import app, get_config, init
+from b4_backup.config_schema import BaseConfig
 from b4_backup.exceptions import BaseBtrfsBackupError
-from b4_backup.main.dataclass import Snapshot
+from b4_backup.main.dataclass import BackupHostPath, Snapshot
+
+if TYPE_CHECKING:  # pragma: no cover
+    from b4_backup.main.catalog import SnapshotCatalog
 
 log = logging.getLogger("b4_backup.cli")
 
 
 def validate_target(ctx: typer.Context, values: list[str]) -> list[str]:
     """A handler to validate target types."""
-    config: BaseConfig = ctx.obj
+    # Don't load the config while completing. The targets are checked when the command runs
+    if ctx.resilient_parsing:
+        return values
 
-    options = set(config.backup_targets) - {DEFAULT}
+    target_index = get_config(ctx).target_index
     for value in values:
-        if value is not None and not any(PurePath(x).is_relative_to(value) for x in options):
-            raise typer.BadParameter(f"Unknown target. Available targets are: {', '.join(options)}")
+        if value is not None and value not in target_index:
+            raise typer.BadParameter(
+                f"Unknown target. Available targets are: {', '.join(target_index.targets)}"
+            )
 
     return values
 
@@ -90,25 +98,49 @@ def parse_callback_args(app: typer.Typer, args: list[str]) -> dict[str, Any]:
     return parsed_args
 
 
-def complete_target(ctx: typer.Context, incomplete: str) -> Generator[str, None, None]:
-    """A handler to provide autocomplete for target types."""
+def _completion_index(ctx: typer.Context) -> CompletionIndex:
+    """
+    Read the completion index of the config selected on the command line.
+
+    The config is only loaded, if the index is missing or the config file changed since it was written.
+
+    Args:
+        ctx: Context of the command to complete
+
+    Returns:
+        The index with the current targets
+    """
     args = shlex.split(os.getenv("_TYPER_COMPLETE_ARGS", ""))
     parsed_args = parse_callback_args(app, args)
-    init(ctx, **parsed_args)
-    config: BaseConfig = ctx.obj
 
-    options = set()
-    for target in set(config.backup_targets) - {DEFAULT}:
-        options.add(target)
-        options |= {str(x) for x in PurePath(target).parents}
+    index = CompletionIndex.load(index_path(parsed_args["config_path"]))
+    if index.outdated():
+        init(ctx, **parsed_args)
+        index.update_targets(get_config(ctx))
+        index.save()
+
+    return index
+
+
+def complete_target(ctx: typer.Context, incomplete: str) -> Generator[str, None, None]:
+    """A handler to provide autocomplete for target types."""
+    index = _completion_index(ctx)
 
-    options = sorted(options)
     taken_targets = ctx.params.get("target") or []
-    for target in options:
-        if str(target).startswith(incomplete) and target not in taken_targets:
+    for target in index.targets:
+        if target.startswith(incomplete) and target not in taken_targets:
             yield target
 
 
+def complete_snapshot(ctx: typer.Context, incomplete: str) -> Generator[str, None, None]:
+    """A handler to provide autocomplete for snapshot names of the selected targets."""
+    index = _completion_index(ctx)
+
+    for snapshot_name in index.snapshot_names(ctx.params.get("target") or []):
+        if snapshot_name.startswith(incomplete):
+            yield snapshot_name
+
+
 class ErrorHandler:
     """Handles errors during execution."""
 
@@ -153,6 +185,62 @@ def error_handler():
         raise typer.Exit(1) from exc
 
 
+@contextmanager
+def open_catalog(config: BaseConfig) -> Generator["SnapshotCatalog | None", None, None]:
+    """
+    Open the snapshot catalog, if one is configured.
+
+    Args:
+        config: Loaded b4 config
+
+    Returns:
+        The opened catalog or None
+    """
+    if config.catalog_path is None:
+        yield None
+        return
+
+    from b4_backup.main.catalog import SnapshotCatalog
+
+    with SnapshotCatalog.open(config.catalog_path) as catalog:
+        yield catalog
+
+
+def catalog_snapshots(
+    catalog: "SnapshotCatalog", target_name: str, url: str | None, host: str
+) -> dict[str, Snapshot] | None:
+    """
+    Read the snapshots of a target from the catalog without connecting to the host.
+
+    Args:
+        catalog: Snapshot catalog
+        target_name: Name of the target
+        url: Source or destination URL of the target. Only used to describe the paths, no connection is opened
+        host: source or destination
+
+    Returns:
+        The snapshots or None, if the catalog doesn't know the target.
+    """
+    snapshots = catalog.snapshots(target_name, host)
+    if not snapshots:
+        return None
+
+    from b4_backup.main.connection import Connection
+
+    connection = Connection.from_url(url)
+    assert isinstance(connection, Connection)
+    base_path = BackupHostPath(connection.location, connection=connection)
+
+    return {
+        k: Snapshot(
+            name=k,
+            subvolumes=[BackupHostPath(x, connection=connection) for x in v],
+            base_path=base_path,
+        )
+        for k, v in snapshots.items()
+    }
+
+
 class OutputFormat(str, Enum):
     """An enumeration of supported output formats."""
 
@@ -4,18 +4,30 @@ This module contains the config structure and it's default values.
 The config is using the YAML syntax and this file describes the structure of it.
 """
 
+import functools
 import textwrap
+from collections.abc import Iterable
 from dataclasses import dataclass, field
 from enum import Enum
 from pathlib import Path, PurePath
 from typing import Any
 
-import omegaconf
-from omegaconf import II
-
 DEFAULT = "_default"
 
 
+def II(interpolation: str) -> Any:  # noqa: N802
+    """
+    Equivalent of omegaconf.II, so the schema can be imported without importing omegaconf.
+
+    Args:
+        interpolation: Interpolation expression without the surrounding ${}
+
+    Returns:
+        The interpolation string, typed as Any to be used as default value of any field.
+    """
+    return "${" + interpolation + "}"
+
+
 class TargetRestoreStrategy(str, Enum):
     """
     Specifies the restore procedure to be used.
@@ -59,6 +71,19 @@ class SubvolumeFallbackStrategy(str, Enum):
     KEEP = "keep"
 
 
+class SubvolumeUnchangedStrategy(str, Enum):
+    """
+    How to handle a subvolume, which didn't change since its last snapshot.
+
+    Attributes:
+        INCREMENTAL: Snapshot it anyway. It's sent as an incremental based on its last snapshot, which transfers next to nothing
+        SKIP: Leave it out of the new snapshot, as long as the retention keeps a snapshot containing it (dst_retention, or src_retention without a destination). A restore of the new snapshot handles it like a deleted backup subvolume (see fallback_strategy). With the default fallback_strategy DROP, it's missing after the restore. Restore it from an older snapshot instead
+    """
+
+    INCREMENTAL = "incremental"
+    SKIP = "skip"
+
+
 class OnDestinationDirNotFound(str, Enum):
     """
     How to behave, if the destination directory does not exist.
@@ -72,6 +97,36 @@ class OnDestinationDirNotFound(str, Enum):
     FAIL = "fail"
 
 
+class TransferMode(str, Enum):
+    """
+    Where the pipe between btrfs send and btrfs receive is running.
+
+    Attributes:
+        CONTROLLER: On the host running b4. All data passes through this host
+        DIRECT: On the sending host, which streams straight to the receiving host. The sending host needs SSH access to the receiving host. Falls back to CONTROLLER if one of the hosts is the host running b4
+        RELAY: On the host defined in transfer_relay. The relay host needs SSH access to both hosts
+    """
+
+    CONTROLLER = "controller"
+    DIRECT = "direct"
+    RELAY = "relay"
+
+
+class TransferCompression(str, Enum):
+    """
+    Compression of the snapshot stream between source and destination.
+
+    Attributes:
+        NONE: Send the stream uncompressed
+        LZ4: Compress using lz4. Fast, but a lower compression ratio. lz4 needs to be installed on both hosts
+        ZSTD: Compress using zstd. zstd needs to be installed on both hosts
+    """
+
+    NONE = "none"
+    LZ4 = "lz4"
+    ZSTD = "zstd"
+
+
 @dataclass
 class TargetSubvolume:
     """
@@ -80,10 +135,12 @@ class TargetSubvolume:
     Args:
         backup_strategy: How to handle the subvolume during backup
         fallback_strategy: How to handle the subvolume during restore if the backup subvolume is already deleted
+        unchanged_strategy: How to handle the subvolume during backup if it didn't change since its last snapshot
     """
 
     backup_strategy: SubvolumeBackupStrategy = II(f"..{DEFAULT}.backup_strategy")
     fallback_strategy: SubvolumeFallbackStrategy = II(f"..{DEFAULT}.fallback_strategy")
+    unchanged_strategy: SubvolumeUnchangedStrategy = II(f"..{DEFAULT}.unchanged_strategy")
 
 
 @dataclass
@@ -100,6 +157,16 @@ class BackupTarget:
         dst_retention: Retention rules for snapshots located at the destination
         replaced_target_ttl: The minimum time the old replaced subvolume should be kept
         subvolume_rules: Contains rules for how to handle the subvolumes of a target
+        src_host_concurrency: Maximum number of targets processed in parallel on the same source host
+        dst_host_concurrency: Maximum number of targets processed in parallel on the same destination host
+        send_parallelism: Maximum number of subvolumes of a snapshot sent at the same time. Transfers through a persistent SSH session or the remote agent still run one after another
+        transfer_mode: Where the snapshot stream between source and destination is piped through
+        transfer_relay: URL of the host used to pipe snapshot streams, if transfer_mode is RELAY
+        transfer_compression: Compression of the snapshot stream. The stream is compressed on the sending host and decompressed on the receiving host
+        transfer_compression_level: Compression level passed to the compressor. If None, the default level of the compressor is used
+        delete_commit_after: Wait until the deletion of subvolumes is committed to disk (btrfs subvolume delete --commit-after). Slower, but the space is freed once b4 finishes
+        persistent_ssh_session: Run all commands on an SSH host in one long-lived shell instead of opening a new SSH channel per command. Saves a round trip per command on high latency links
+        remote_agent: Start a small python helper on SSH hosts, which handles filesystem queries and commands in batches. Requires python3 on the remote host. Falls back to single commands, if python3 is missing
     """
 
     source: str | None = II(f"..{DEFAULT}.source")
@@ -111,6 +178,130 @@ class BackupTarget:
     dst_retention: dict[str, dict[str, str]] = field(default_factory=dict)
     replaced_target_ttl: str = II(f"..{DEFAULT}.replaced_target_ttl")
     subvolume_rules: dict[str, TargetSubvolume] = II(f"..{DEFAULT}.subvolume_rules")
+    src_host_concurrency: int = II(f"..{DEFAULT}.src_host_concurrency")
+    dst_host_concurrency: int = II(f"..{DEFAULT}.dst_host_concurrency")
+    send_parallelism: int = II(f"..{DEFAULT}.send_parallelism")
+    transfer_mode: TransferMode = II(f"..{DEFAULT}.transfer_mode")
+    transfer_relay: str | None = II(f"..{DEFAULT}.transfer_relay")
+    transfer_compression: TransferCompression = II(f"..{DEFAULT}.transfer_compression")
+    transfer_compression_level: int | None = II(f"..{DEFAULT}.transfer_compression_level")
+    delete_commit_after: bool = II(f"..{DEFAULT}.delete_commit_after")
+    persistent_ssh_session: bool = II(f"..{DEFAULT}.persistent_ssh_session")
+    remote_agent: bool = II(f"..{DEFAULT}.remote_agent")
+
+
+@dataclass(slots=True)
+class _TargetNode:
+    target: str | None = None
+    children: dict[str, "_TargetNode"] = field(default_factory=dict)
+
+
+class TargetIndex:
+    """
+    A prefix trie over the path parts of target names.
+
+    Selecting a prefix like host/pool only walks the parts of the prefix and the targets below it,
+    instead of comparing it to every target.
+
+    Attributes:
+        targets: Target names in the order they were added
+    """
+
+    def __init__(self, targets: Iterable[str]) -> None:
+        """
+        Args:
+            targets: Target names. The default target is skipped.
+        """
+        self.targets: list[str] = []
+        self._position: dict[str, int] = {}
+        self._root = _TargetNode()
+
+        for target in targets:
+            if target == DEFAULT or target in self._position:
+                continue
+
+            self._position[target] = len(self.targets)
+            self.targets.append(target)
+
+            node = self._root
+            for part in PurePath(target).parts:
+                node = node.children.setdefault(part, _TargetNode())
+            node.target = target
+
+    @classmethod
+    @functools.lru_cache(maxsize=8)
+    def _cached(cls, targets: tuple[str, ...]) -> "TargetIndex":
+        return cls(targets)
+
+    @classmethod
+    def of(cls, targets: Iterable[str]) -> "TargetIndex":
+        """
+        Return the index of a set of targets. It's only built once for the same target names.
+
+        Args:
+            targets: Target names, e.g. the backup_targets of a config
+
+        Returns:
+            TargetIndex instance
+        """
+        if isinstance(targets, TargetIndex):
+            return targets
+
+        return cls._cached(tuple(targets))
+
+    def _node(self, selector: str) -> _TargetNode | None:
+        node: _TargetNode | None = self._root
+        for part in PurePath(selector).parts:
+            node = node.children.get(part)
+            if node is None:
+                return None
+
+        return node
+
+    def __contains__(self, selector: str) -> bool:
+        """
+        Returns:
+            True if the selector is a target or a parent of one.
+        """
+        return self._node(selector) is not None
+
+    def select(self, selectors: Iterable[str]) -> list[str]:
+        """
+        Return the targets matching any of the selectors.
+
+        Args:
+            selectors: Target names or parents of them
+
+        Returns:
+            The unique targets in the order they were added to the index.
+        """
+        selected: set[str] = set()
+        for selector in selectors:
+            nodes = [self._node(selector)]
+            while nodes:
+                node = nodes.pop()
+                if node is None:
+                    continue
+
+                if node.target is not None:
+                    selected.add(node.target)
+                nodes += node.children.values()
+
+        return sorted(selected, key=self._position.__getitem__)
+
+    def prefixes(self) -> list[str]:
+        """
+        Returns:
+            All targets and their parents, sorted.
+        """
+        result = []
+        nodes = [(PurePath(), self._root)]
+        while nodes:
+            path, node = nodes.pop()
+            result.append(str(path))
+            nodes += [(path / part, child) for part, child in node.children.items()]
+
+        return sorted(result)
 
 
 @dataclass
@@ -122,6 +313,8 @@ class BaseConfig:
         backup_targets: An object containing all targets to backup
         default_targets: List of default targets to use if not specified
         timezone: Timezone to use
+        max_workers: Maximum number of targets processed in parallel by backup, sync, clean and list
+        catalog_path: Path of a SQLite database, which records the snapshots, transfers and deletions of backup, sync, clean and delete. It's read by list --cached only. Planning a backup or sync always lists the snapshots on the hosts. If None, no catalog is written
         logging: Python logging configuration settings (logging.config.dictConfig).
     """
 
@@ -140,15 +333,28 @@ class BaseConfig:
                     DEFAULT: TargetSubvolume(
                         backup_strategy=SubvolumeBackupStrategy.FULL,
                         fallback_strategy=SubvolumeFallbackStrategy.DROP,
+                        unchanged_strategy=SubvolumeUnchangedStrategy.INCREMENTAL,
                     ),
                     "/": TargetSubvolume(),
                 },
+                src_host_concurrency=1,
+                dst_host_concurrency=1,
+                send_parallelism=1,
+                transfer_mode=TransferMode.CONTROLLER,
+                transfer_relay=None,
+                transfer_compression=TransferCompression.NONE,
+                transfer_compression_level=None,
+                delete_commit_after=False,
+                persistent_ssh_session=False,
+                remote_agent=False,
             )
         }
     )
 
     default_targets: list[str] = field(default_factory=list)
     timezone: str = "utc"
+    max_workers: int = 1
+    catalog_path: Path | None = None
 
     logging: dict[str, Any] = II(
         "oc.create:${from_file:" + str(Path(__file__).parent / "default_logging_config.yml") + "}"
@@ -160,9 +366,10 @@ class BaseConfig:
 
     def __post_init__(self):
         """Used for validation of the values."""
-        options = set(self.backup_targets) - {DEFAULT}
         for target in self.default_targets:
-            if not any(PurePath(x).is_relative_to(target) for x in options):
+            if target not in self.target_index:
+                import omegaconf  # noqa: PLC0415
+
                 raise omegaconf.errors.ValidationError(
                     textwrap.dedent(
                         f"""\
@@ -171,3 +378,11 @@ class BaseConfig:
                             object_type={self.__class__.__name__}"""
                     )
                 )
+
+    @property
+    def target_index(self) -> TargetIndex:
+        """
+        Returns:
+            Prefix index of the backup_targets. It's built once per config.
+        """
+        return TargetIndex.of(self.backup_targets)
@@ -35,6 +35,44 @@ class UnknownProtocolError(InvalidConnectionUrlError):
     """Raised, if an unsupported protocol is used."""
 
 
+class SessionClosedError(BaseBtrfsBackupError):
+    """Raised, if a persistent remote shell session terminated unexpectedly."""
+
+
+class RemoteAgentError(BaseBtrfsBackupError):
+    """Raised, if an operation of the remote helper agent failed."""
+
+
+class AgentUnavailableError(RemoteAgentError):
+    """Raised, if the remote helper agent can't be started or terminated unexpectedly."""
+
+
+class PathOperationError(BaseBtrfsBackupError):
+    """Raised, if a filesystem operation on a local path failed."""
+
+
+class UnreachableHostError(BaseBtrfsBackupError):
+    """Raised, if a host can't be reached from the host running a transfer."""
+
+
+class SubvolumeSendError(BaseBtrfsBackupError):
+    """Raised, if subvolumes of a snapshot sent in parallel failed."""
+
+    def __init__(self, snapshot_name: str, errors: dict[str, Exception]):
+        """
+        Args:
+            snapshot_name: Name of the sent snapshot.
+            errors: Exception by name of the failed subvolume.
+        """
+        self.snapshot_name = snapshot_name
+        self.errors = errors
+
+        super().__init__(
+            f"{len(errors)} subvolumes of snapshot {snapshot_name} failed to send:\n"
+            + "".join(f"=== {name} ===\n{exc}\n" for name, exc in errors.items())
+        )
+
+
 class InvalidRetentionRuleError(BaseBtrfsBackupError):
     """Raised, if the retention rule string is malformed."""
 
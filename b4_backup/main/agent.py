@@ -0,0 +1,168 @@
+import importlib.resources
+import json
+import logging
+import shlex
+import threading
+from collections.abc import Callable, Sequence
+from typing import IO, TYPE_CHECKING, Any
+
+from b4_backup import exceptions
+from b4_backup.main import remote_agent
+
+if TYPE_CHECKING:  # pragma: no cover
+    import paramiko
+
+log = logging.getLogger("b4_backup.connection")
+
+Operation = tuple[Any, ...]
+
+
+class RemoteAgent:
+    """
+    Client for the helper agent running on a remote host.
+
+    The agent answers batches of filesystem operations and processes in a single round trip.
+    See b4_backup.main.remote_agent for the protocol.
+    """
+
+    bootstrap_command = "python3 -c " + shlex.quote(
+        "import sys; exec(sys.stdin.buffer.read(int(sys.stdin.buffer.readline())))"
+    )
+
+    def __init__(
+        self,
+        stdin: IO[bytes],
+        stdout: IO[bytes],
+        on_close: Callable[[], None] | None = None,
+    ) -> None:
+        """
+        Use RemoteAgent.start to start the agent on a host.
+
+        Args:
+            stdin: Stream to the stdin of the bootstrap command
+            stdout: Stream from the stdout of the bootstrap command
+            on_close: Called after closing the streams
+        """
+        self._stdin = stdin
+        self._stdout = stdout
+        self._on_close = on_close
+        self.closed = False
+        # Requests of multiple threads would interleave on the streams otherwise
+        self._lock = threading.Lock()
+
+    @classmethod
+    def start(cls, ssh_client: "paramiko.SSHClient") -> "RemoteAgent":
+        """
+        Start the agent on a remote host.
+
+        Args:
+            ssh_client: Connected SSH client
+
+        Raises:
+            AgentUnavailableError: If the agent couldn't be started, e.g. because python3 is missing
+                or the server doesn't allow more sessions.
+
+        Returns:
+            RemoteAgent instance
+        """
+        import paramiko  # noqa: PLC0415
+
+        transport = ssh_client.get_transport()
+        assert transport, "Not connected"
+
+        try:
+            channel = transport.open_session()
+            channel.exec_command(cls.bootstrap_command)
+        except paramiko.SSHException as exc:
+            raise exceptions.AgentUnavailableError(f"Unable to start the agent: {exc}") from exc
+
+        agent = cls(channel.makefile("wb"), channel.makefile("rb"), on_close=channel.close)
+        try:
+            agent.bootstrap()
+        except exceptions.AgentUnavailableError:
+            agent.close()
+            raise
+
+        return agent
+
+    def bootstrap(self) -> None:
+        """
+        Send the agent source to the bootstrap command and wait until the agent is ready.
+
+        Raises:
+            AgentUnavailableError: If the agent didn't start.
+        """
+        source = importlib.resources.files(remote_agent.__package__).joinpath("remote_agent.py")
+        source_bytes = source.read_bytes()
+
+        self._send(f"{len(source_bytes)}\n".encode() + source_bytes)
+        hello = self._receive()
+
+        if hello != {"agent": "b4", "version": remote_agent.VERSION}:
+            raise exceptions.AgentUnavailableError(f"Unexpected agent greeting: {hello}")
+
+    def request(self, operations: Sequence[Operation]) -> list[Any]:
+        """
+        Run a batch of operations in a single round trip.
+
+        Args:
+            operations: Operations to run. The first item is the operation name, followed by the arguments
+
+        Raises:
+            RemoteAgentError: If an operation failed. The operations are run nonetheless.
+            AgentUnavailableError: If the agent isn't reachable anymore. The agent is closed then.
+
+        Returns:
+            The results of the operations in the same order.
+        """
+        if not operations:
+            return []
+
+        log.debug("Agent request:\n%s", operations)
+        with self._lock:
+            try:
+                self._send(json.dumps({"ops": operations}).encode() + b"\n")
+                results = self._receive()["results"]
+            except exceptions.AgentUnavailableError:
+                # A dead agent can't answer any further requests
+                self.close()
+                raise
+
+        for operation, result in zip(operations, results, strict=True):
+            if "error" in result:
+                raise exceptions.RemoteAgentError(
+                    f"{operation[0]} {operation[1:]} failed: {result['error']}: {result['message']}"
+                )
+
+        return [x["value"] for x in results]
+
+    def close(self) -> None:
+        """Stop the agent."""
+        if self.closed:
+            return
+
+        self.closed = True
+        for stream in (self._stdin, self._stdout):
+            stream.close()
+
+        if self._on_close:
+            self._on_close()
+
+    def _send(self, data: bytes) -> None:
+        import paramiko  # noqa: PLC0415
+
+        try:
+            self._stdin.write(data)
+            self._stdin.flush()
+        except (OSError, paramiko.SSHException) as exc:
+            raise exceptions.AgentUnavailableError(f"The agent is not reachable: {exc}") from exc
+
+    def _receive(self) -> Any:
+        line = self._stdout.readline()
+        if not line:
+            raise exceptions.AgentUnavailableError("The agent terminated")
+
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError as exc:
+            raise exceptions.AgentUnavailableError(f"Invalid agent response: {line!r}") from exc
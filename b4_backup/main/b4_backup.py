@@ -1,6 +1,6 @@
+import bisect
 import logging
-import re
-from collections.abc import Iterable
+from collections.abc import Iterable, Sequence
 from dataclasses import dataclass
 from pathlib import PurePath
 
@@ -12,6 +12,7 @@ from b4_backup.config_schema import (
     SubvolumeFallbackStrategy,
     TargetRestoreStrategy,
 )
+from b4_backup.main import retention as retention_engine
 from b4_backup.main.backup_target_host import (
     BackupTargetHost,
     DestinationBackupTargetHost,
@@ -34,11 +35,12 @@ class B4Backup:
 
     Args:
         timezone: Timezone to use
+        now: Time used for snapshot names and retention decisions. If None, the current time is taken once on first use
     """
 
     timezone: str = BaseConfig.timezone
+    now: arrow.Arrow | None = None
 
-    _size_pattern = re.compile(r"^(?:([0-9]+)(second|minute|hour|day|week|month|year)?s?)$")
     _timestamp_fmt = "YYYY-MM-DD-HH-mm-ss"
 
     def backup(
@@ -59,9 +61,11 @@ class B4Backup:
         """
         log.info("Snapshot name: %s", snapshot_name)
 
-        src_host.create_snapshot(snapshot_name)
+        snapshot = src_host.create_snapshot(
+            snapshot_name, self._retained_after_backup(src_host, dst_host, snapshot_name)
+        )
 
-        if dst_host:
+        if dst_host and snapshot:
             src_host.send_snapshot(dst_host, snapshot_name)
 
         retention_name = ChoiceSelector([self._extract_retention_name(snapshot_name)])
@@ -71,6 +75,37 @@ class B4Backup:
             retention_names=retention_name,
         )
 
+    def _retained_after_backup(
+        self,
+        src_host: SourceBackupTargetHost,
+        dst_host: DestinationBackupTargetHost | None,
+        snapshot_name: str,
+    ) -> set[str]:
+        """
+        Find the snapshots, which are kept by the clean up after a backup.
+
+        The backup lives on the destination. Without a destination, on the source.
+
+        Args:
+            src_host: An active source host instance
+            dst_host: An active destination host instance
+            snapshot_name: The name of the new snapshot
+
+        Returns:
+            Names of the retained snapshots.
+        """
+        host: BackupTargetHost = dst_host or src_host
+        retention_name = self._extract_retention_name(snapshot_name)
+        retention = RetentionGroup.from_target(
+            retention_name=retention_name,
+            target=host.target_config,
+            is_source=dst_host is None,
+        )
+
+        return self._retained_snapshots(
+            [*host.snapshots(), snapshot_name], retention.target_retention, retention_name
+        )
+
     def restore(
         self,
         src_host: SourceBackupTargetHost,
@@ -112,6 +147,8 @@ class B4Backup:
         """
         Send unsended snapshots to the destination and clean them.
 
+        The snapshots are always listed on both hosts. The snapshot catalog isn't used for planning.
+
         Args:
             src_host: An active source host instance
             dst_host: An active destination host instance
@@ -121,11 +158,44 @@ class B4Backup:
         src_snapshots = src_host.snapshots()
         dst_snapshots = dst_host.snapshots()
 
-        for snapshot_name in src_snapshots.keys() - dst_snapshots.keys():
-            src_host.send_snapshot(dst_host, snapshot_name)
+        for snapshot_name, parent_snapshot_name in self._plan_sync(src_snapshots, dst_snapshots):
+            src_host.send_snapshot(
+                dst_host, snapshot_name, parent_snapshot_name=parent_snapshot_name
+            )
 
         self.clean(src_host, dst_host)
 
+    def _plan_sync(
+        self, src_snapshot_names: Iterable[str], dst_snapshot_names: Iterable[str]
+    ) -> list[tuple[str, str | None]]:
+        """
+        Order the missing snapshots from oldest to newest and choose a parent for each of them.
+
+        The parent is the nearest older snapshot present on both hosts at the time of the send,
+        so every send after the first one uses the previous one. If there is no older one, the nearest newer one is used.
+        Snapshot names start with a fixed format timestamp, so sorting by name is sorting by time.
+
+        Returns:
+            A list of (snapshot_name, parent_snapshot_name) in the order to send
+        """
+        dst_snapshot_set = set(dst_snapshot_names)
+        available = sorted(set(src_snapshot_names) & dst_snapshot_set)
+
+        plan: list[tuple[str, str | None]] = []
+        for snapshot_name in sorted(set(src_snapshot_names) - dst_snapshot_set):
+            idx = bisect.bisect_left(available, snapshot_name)
+
+            parent_snapshot_name = None
+            if idx > 0:
+                parent_snapshot_name = available[idx - 1]
+            elif available:
+                parent_snapshot_name = available[idx]
+
+            plan.append((snapshot_name, parent_snapshot_name))
+            available.insert(idx, snapshot_name)
+
+        return plan
+
     def clean(
         self,
         src_host: SourceBackupTargetHost,
@@ -144,6 +214,10 @@ class B4Backup:
         self._clean_replace(src_host)
         self._clean_empty_dirs(src_host, dst_host)
 
+        src_host.update_catalog()
+        if dst_host:
+            dst_host.update_catalog()
+
     def delete(
         self,
         host: BackupTargetHost,
@@ -163,6 +237,7 @@ class B4Backup:
             return
 
         host.delete_snapshot(snapshots[snapshot_name])
+        host.update_catalog()
 
     def delete_all(
         self,
@@ -178,11 +253,12 @@ class B4Backup:
         """
         resolved_retention_names = set(retention_names.resolve_retention_name(host.snapshots()))
 
-        for snapshot_name, snapshot in host.snapshots().items():
-            if self._extract_retention_name(snapshot_name) not in resolved_retention_names:
-                continue
-
-            host.delete_snapshot(snapshot)
+        host.delete_snapshots(
+            (snapshot, None)
+            for snapshot_name, snapshot in host.snapshots().items()
+            if self._extract_retention_name(snapshot_name) in resolved_retention_names
+        )
+        host.update_catalog()
 
     def _restore_replace(
         self,
@@ -227,6 +303,7 @@ class B4Backup:
         self._remove_target(host)
 
         replaced_targets[-1].rename(host.path())  # move
+        host.inventory().rename(replaced_targets[-1], host.path())
 
         self._clean_replace(host)
 
@@ -247,6 +324,7 @@ class B4Backup:
 
         replace_dir.parent.mkdir(parents=True)
         host.path().rename(replace_dir)
+        host.inventory().rename(host.path(), replace_dir)
 
         return replace_dir
 
@@ -260,7 +338,7 @@ class B4Backup:
         Returns:
             Name for a snapshot
         """
-        snapshot_name = arrow.utcnow().to(self.timezone).format(self._timestamp_fmt)
+        snapshot_name = self._now().format(self._timestamp_fmt)
 
         if name:
             snapshot_name += f"_{name}"
@@ -281,6 +359,7 @@ class B4Backup:
         ):
             target_subvolume = host.path(con.location / subvolume_subvol_norm)
             target_subvolume.rmdir()
+            host.inventory().remove(target_subvolume)
 
             target_subvolume.parent.mkdir(parents=True)
             con.run_process(
@@ -292,6 +371,7 @@ class B4Backup:
                     str(target_subvolume),
                 ]
             )
+            host.inventory().add(target_subvolume)
 
         for subvolume_str in host.target_config.subvolume_rules:
             subvolume_path = PurePath(subvolume_str)
@@ -335,6 +415,7 @@ class B4Backup:
 
         if rules.fallback_strategy == SubvolumeFallbackStrategy.KEEP and rt_subvolume:
             rt_subvolume.rename(target_subvolume_path)
+            host.inventory().rename(rt_subvolume, target_subvolume_path)
 
         elif rules.fallback_strategy == SubvolumeFallbackStrategy.NEW or (
             rules.fallback_strategy == SubvolumeFallbackStrategy.KEEP and not rt_subvolume
@@ -342,6 +423,7 @@ class B4Backup:
             host.connection.run_process(
                 ["btrfs", "subvolume", "create", str(target_subvolume_path)]
             )
+            host.inventory().add(target_subvolume_path)
 
     def _clean_target(
         self,
@@ -414,16 +496,21 @@ class B4Backup:
                     retention.obsolete_snapshots,
                 )
 
-        for snapshot_name in sorted(
-            snapshots.keys() - (retained_source_snapshots | retained_destination_snapshots)
-        ):
-            host.delete_snapshot(snapshots[snapshot_name])
-
-        for snapshot_name in sorted(retained_destination_snapshots - retained_source_snapshots):
-            host.delete_snapshot(
+        deletions: list[tuple[Snapshot, list[BackupHostPath] | None]] = [
+            (snapshots[snapshot_name], None)
+            for snapshot_name in sorted(
+                snapshots.keys() - (retained_source_snapshots | retained_destination_snapshots)
+            )
+        ]
+        deletions += [
+            (
                 snapshots[snapshot_name],
-                subvolumes=list(host.source_subvolumes_from_snapshot(snapshots[snapshot_name])),
+                list(host.source_subvolumes_from_snapshot(snapshots[snapshot_name])),
             )
+            for snapshot_name in sorted(retained_destination_snapshots - retained_source_snapshots)
+        ]
+
+        host.delete_snapshots(deletions)
 
     def _filter_snapshots(
         self, snapshots: dict[str, Snapshot], retention_names: Iterable[str]
@@ -446,15 +533,14 @@ class B4Backup:
         if not replaced_targets:
             return
 
-        for i, replaced_target in enumerate(replaced_targets):
-            # I'm doing an off-label use of this function here
-            # to test if the replace is obsolete
-            if i == 0 and self._retained_snapshots(
-                [replaced_target.name], {"all": host.target_config.replaced_target_ttl}
-            ):
-                continue
+        # I'm doing an off-label use of this function here
+        # to test if the replace is obsolete
+        if self._retained_snapshots(
+            [replaced_targets[0].name], {"all": host.target_config.replaced_target_ttl}
+        ):
+            replaced_targets = replaced_targets[1:]
 
-            self._remove_replaced_targets(host, replaced_target)
+        self._remove_replaced_targets(host, replaced_targets)
 
     def _clean_empty_dirs(
         self,
@@ -466,12 +552,16 @@ class B4Backup:
             dst_host.remove_empty_dirs(dst_host.path())
 
     def _remove_replaced_targets(
-        self, host: SourceBackupTargetHost, replaced_target: PurePath
+        self, host: SourceBackupTargetHost, replaced_targets: Sequence[PurePath]
     ) -> None:
-        target_subvolumes = [x for x in host.subvolumes() if x.is_relative_to(replaced_target)]
+        target_subvolumes = [
+            x
+            for x in host.subvolumes()
+            if any(x.is_relative_to(replaced_target) for replaced_target in replaced_targets)
+        ]
 
-        for subvolume in reversed(target_subvolumes):
-            host.connection.run_process(["btrfs", "subvolume", "delete", str(subvolume)])
+        # Nested subvolumes first
+        host.delete_subvolumes(list(reversed(target_subvolumes)))
 
     def _transpose_snapshot_subvolumes(
         self, snapshots: dict[str, Snapshot]
@@ -486,6 +576,12 @@ class B4Backup:
 
         return return_dict
 
+    def _now(self) -> arrow.Arrow:
+        if self.now is None:
+            self.now = arrow.utcnow()
+
+        return self.now.to(self.timezone)
+
     def _retained_snapshots(
         self,
         snapshot_names: Iterable[str],
@@ -495,85 +591,53 @@ class B4Backup:
     ) -> set[str]:
         ignored_snapshots = ignored_snapshots or set()
 
-        snapshot_dates = [
-            arrow.get(x.split("_")[0], self._timestamp_fmt)
-            for x in snapshot_names
-            if not retention_name or x.split("_", maxsplit=1)[1] == retention_name
-        ]
+        timestamps = sorted(
+            {
+                retention_engine.parse_timestamp(x.split("_")[0])
+                for x in snapshot_names
+                if not retention_name or x.split("_", maxsplit=1)[1] == retention_name
+            }
+        )
 
-        remaining_backups: set[arrow.Arrow] = set()
+        now = self._now()
+        remaining_backups: set[int] = set()
         for interval, duration in retention.items():
-            remaining_backups.update(self._apply_retention_rule(interval, duration, snapshot_dates))
+            remaining_backups.update(
+                self._apply_retention_rule(interval, duration, timestamps, now=now)
+            )
 
+        suffix = f"_{retention_name}" if retention_name is not None else ""
         return {
             item
-            for item in {
-                x.format(self._timestamp_fmt) + f"_{retention_name}" * (retention_name is not None)
-                for x in remaining_backups
-            }
+            for item in {retention_engine.format_timestamp(x) + suffix for x in remaining_backups}
             if item not in ignored_snapshots
         }
 
     def _apply_retention_rule(
-        self, interval_str: str, duration_str: str, dates: list[arrow.Arrow]
-    ) -> list[arrow.Arrow]:
-        interval_size, interval_magnitude = self._timebox_str_extract(
+        self,
+        interval_str: str,
+        duration_str: str,
+        timestamps: Sequence[int],
+        now: arrow.Arrow | None = None,
+    ) -> list[int]:
+        interval_size, interval_magnitude = retention_engine.parse_timebox(
             interval_str, is_interval=True
         )
-        duration_size, duration_magnitude = self._timebox_str_extract(
+        duration_size, duration_magnitude = retention_engine.parse_timebox(
             duration_str, is_interval=False
         )
-
-        remaining: list[arrow.Arrow] = []
-        for date in sorted(dates, reverse=True):
-            if duration_magnitude != "forever" and (
-                (
-                    duration_magnitude is not None
-                    and date
-                    < arrow.utcnow().to(self.timezone).shift(**{duration_magnitude: -duration_size})
-                )
-                or (duration_magnitude is None and len(remaining) >= duration_size)
-            ):
-                break
-
-            if not remaining:
-                remaining.append(date)
-                continue
-
-            if interval_magnitude == "all":
-                remaining.append(date)
-            else:
-                assert interval_magnitude is not None
-
-                min_box, max_box = (
-                    remaining[-1]
-                    .shift(**{interval_magnitude: 1 - interval_size})
-                    .span(interval_magnitude, count=interval_size)  # type: ignore
-                )
-                if date < min_box or date >= max_box:
-                    remaining.append(date)
-
-        return remaining
-
-    def _timebox_str_extract(
-        self, timebox_str: str, is_interval: bool = False
-    ) -> tuple[int, str | None]:
-        if is_interval and timebox_str == "all":
-            return 0, "all"
-
-        if not is_interval and timebox_str == "forever":
-            return 0, "forever"
-
-        size_pattern = self._size_pattern.match(timebox_str)
-        if not size_pattern:
-            raise exceptions.InvalidRetentionRuleError(
-                f"Size pattern ({timebox_str}, interval:{is_interval}) is invalid"
+        assert interval_magnitude is not None
+
+        start = 0
+        limit = None
+        if duration_magnitude is None:
+            limit = duration_size
+        elif duration_magnitude != "forever":
+            cutoff = retention_engine.cutoff_timestamp(
+                now or self._now(), duration_size, duration_magnitude
             )
+            start = bisect.bisect_left(timestamps, cutoff)
 
-        size = size_pattern.group(1) or 0
-        magnitude = size_pattern.group(2)
-
-        if magnitude is not None:
-            magnitude += "s"
-
-        return int(size), magnitude
+        return retention_engine.retain(
+            timestamps, interval_size, interval_magnitude, start=start, limit=limit
+        )
@@ -1,24 +1,55 @@
 import contextlib
+import functools
 import logging
+import re
 import shlex
+import threading
+import time
 from abc import ABCMeta, abstractmethod
 from collections import defaultdict
-from collections.abc import Generator, Iterable, Sequence
-from dataclasses import dataclass
-from pathlib import PurePath
+from collections.abc import Callable, Collection, Generator, Hashable, Iterable, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import AbstractContextManager
+from dataclasses import dataclass, field
+from pathlib import PurePath, PurePosixPath
+from typing import TypeVar
 
 from b4_backup import exceptions
 from b4_backup.config_schema import (
     BackupTarget,
     OnDestinationDirNotFound,
     SubvolumeBackupStrategy,
+    SubvolumeUnchangedStrategy,
+    TargetSubvolume,
+    TransferCompression,
+    TransferMode,
 )
+from b4_backup.main.catalog import SnapshotCatalog
 from b4_backup.main.connection import Connection, LocalConnection, SSHConnection
 from b4_backup.main.dataclass import BackupHostPath, ChoiceSelector, Snapshot
-from b4_backup.utils import contains_path
+from b4_backup.main.inventory import SubvolumeInfo, SubvolumeInventory
+from b4_backup.main.transfer import pump
+from b4_backup.utils import PathMatcher
 
 log = logging.getLogger("b4_backup.main")
 
+T = TypeVar("T")
+
+# Maximum number of subvolumes deleted by a single btrfs call
+_DELETE_CHUNK_SIZE = 100
+# Maximum number of clone sources passed to a single btrfs send
+_MAX_CLONE_SOURCES = 8
+# Snapshot creation, transfer and cleanup of a backup
+_PIPELINE_STAGES = 3
+
+_COMPRESSION_COMMANDS: dict[TransferCompression, tuple[str, str]] = {
+    TransferCompression.LZ4: ("lz4 -c -v", "lz4 -d -c"),
+    TransferCompression.ZSTD: ("zstd -c -v -T0", "zstd -d -c"),
+}
+_STAGE_TIME_PATTERN = re.compile(r"^b4-stage (\w+) ([0-9.]+)$", re.MULTILINE)
+# zstd: "/*stdin*\ : 35.89%   (...)", lz4: "Compressed 1024 bytes into 368 bytes ==> 35.94%"
+_COMPRESSION_RATIO_PATTERN = re.compile(r"(?::|==>)\s*([0-9.]+)%")
+
 
 @dataclass
 class BackupTargetHost(metaclass=ABCMeta):
@@ -30,12 +61,18 @@ class BackupTargetHost(metaclass=ABCMeta):
         target_config: The Config object describing this BackupTarget
         snapshot_dir: Path to the snapshots of this target on this host
         connection: Connection object to the host
+        catalog: Snapshot catalog to record changes in. If None, nothing is recorded
+        transfer_slot: Held while sending snapshots from or to this host. Limits the transfers per host in pipelined mode
     """
 
     name: str
     target_config: BackupTarget
     snapshot_dir: BackupHostPath
     connection: Connection
+    catalog: SnapshotCatalog | None = None
+    transfer_slot: AbstractContextManager = field(
+        default_factory=contextlib.nullcontext, repr=False, compare=False
+    )
 
     @classmethod
     def from_source_host(
@@ -43,6 +80,7 @@ class BackupTargetHost(metaclass=ABCMeta):
         target_name: str,
         target_config: BackupTarget,
         connection: Connection,
+        catalog: SnapshotCatalog | None = None,
     ) -> "SourceBackupTargetHost":
         """
         Create an instance for a backup source.
@@ -51,6 +89,7 @@ class BackupTargetHost(metaclass=ABCMeta):
             target_name: Name of the target
             target_config: Target config
             connection: Host connection
+            catalog: Snapshot catalog to record changes in
 
         Returns:
             BackupHost instance
@@ -67,6 +106,7 @@ class BackupTargetHost(metaclass=ABCMeta):
             target_config=target_config,
             snapshot_dir=BackupHostPath(target_snapshot_dir, connection=connection),
             connection=connection,
+            catalog=catalog,
         )
 
     @classmethod
@@ -75,6 +115,7 @@ class BackupTargetHost(metaclass=ABCMeta):
         target_name: str,
         target_config: BackupTarget,
         connection: Connection,
+        catalog: SnapshotCatalog | None = None,
     ) -> "DestinationBackupTargetHost":
         """
         Create an instance for a backup destination.
@@ -83,6 +124,7 @@ class BackupTargetHost(metaclass=ABCMeta):
             target_name: Name of the target
             target_config: Target config
             connection: Host connection
+            catalog: Snapshot catalog to record changes in
 
         Returns:
             BackupHost instance
@@ -94,6 +136,7 @@ class BackupTargetHost(metaclass=ABCMeta):
                 connection.location / "snapshots" / target_name, connection=connection
             ),
             connection=connection,
+            catalog=catalog,
         )
 
         if (
@@ -108,20 +151,11 @@ class BackupTargetHost(metaclass=ABCMeta):
 
     @classmethod
     def _mount_point(cls, connection: Connection) -> BackupHostPath:
-        result = connection.run_process(["mount"])
-
-        possible_paths: list[PurePath] = []
-        for line in result.split("\n"):
-            if line == "":
-                continue
-
-            columns = line.split()
-            path = PurePath(columns[2])
-
-            if columns[4] != "btrfs" or not connection.location.is_relative_to(path):
-                continue
-
-            possible_paths.append(path)
+        possible_paths = [
+            x.path
+            for x in connection.mount_points()
+            if x.fs_type == "btrfs" and connection.location.is_relative_to(x.path)
+        ]
 
         if len(possible_paths) == 0:
             raise exceptions.BtrfsPartitionNotFoundError(
@@ -145,55 +179,38 @@ class BackupTargetHost(metaclass=ABCMeta):
             if it's a source or destination host.
         """
 
+    def inventory(self) -> SubvolumeInventory:
+        """
+        Returns:
+            The subvolume inventory of the filesystem, shared with all other targets on this host.
+        """
+        return SubvolumeInventory.from_connection(self.connection, self.mount_point())
+
     def subvolumes(self) -> list[BackupHostPath]:
         """
         Returns:
             A list of btrfs subvolumes.
         """
-        mount_point = self.mount_point()
-
-        result = self.connection.run_process(["btrfs", "subvolume", "list", str(mount_point)])
-        result = result.replace("top level", "top_level")
+        return self.inventory().subvolumes(self.connection)
 
-        # Format looking like this per line:
-        # ID 256 gen 621187 top_level 5 path my_data
-        return sorted(
-            [
-                mount_point / value
-                for line in result.split("\n")
-                # Iterate two items at a time
-                for key, value in zip(*[iter(line.split())] * 2)  # type: ignore
-                if key == "path"
-            ]
-            + [mount_point]
-        )
-
-    def remove_empty_dirs(
-        self, path: BackupHostPath, _subvolumes: set[BackupHostPath] | None = None
-    ) -> bool:
+    def remove_empty_dirs(self, path: BackupHostPath) -> list[BackupHostPath]:
         """
-        Recursively delete empty directories.
+        Delete empty directories below and including path. Subvolumes are kept.
+
+        Args:
+            path: Directory to clean up
 
         Returns:
-            True if the top dir got deleted.
+            The removed directories.
         """
-        if _subvolumes is None:
-            _subvolumes = set(self.subvolumes())
-
-        empty = True
-        for subpath in path.iterdir():
-            if (
-                subpath in _subvolumes
-                or not subpath.is_dir()
-                or not self.remove_empty_dirs(subpath, _subvolumes=_subvolumes)
-            ):
-                empty = False
+        subvolumes = [x for x in self.subvolumes() if x.is_relative_to(path)]
+        removed = [self.path(x) for x in self.connection.prune_empty_dirs(path, subvolumes)]
 
-        if empty:
-            log.debug("Removing empty dir: %s", path)
-            path.rmdir()
+        for removed_dir in removed:
+            log.debug("Removed empty dir: %s", removed_dir)
+            self.inventory().remove(removed_dir)
 
-        return empty
+        return removed
 
     def _group_subvolumes(
         self, subvolumes: Sequence[BackupHostPath], parent_dir: BackupHostPath
@@ -234,6 +251,26 @@ class BackupTargetHost(metaclass=ABCMeta):
             ).items()
         }
 
+    def update_catalog(self) -> None:
+        """Reconcile the snapshot catalog with the snapshots present on this host."""
+        if self.catalog is None:
+            return
+
+        inventory = self.inventory()
+        self.catalog.reconcile(
+            self.name,
+            self.type,
+            [
+                (
+                    snapshot.name,
+                    str(subvolume),
+                    inventory.info(self.connection, snapshot.base_path / snapshot.name / subvolume),
+                )
+                for snapshot in self.snapshots().values()
+                for subvolume in snapshot.subvolumes
+            ],
+        )
+
     def path(self, path: PurePath | str | None = None) -> BackupHostPath:
         """
         Create a BackupHostPath instance.
@@ -261,20 +298,59 @@ class BackupTargetHost(metaclass=ABCMeta):
             snapshot: Snapshot to delete
             subvolumes: Subvolumes to delete. If None, all subvolumes are deleted
         """
-        if subvolumes is None:
-            subvolumes = snapshot.subvolumes
+        self.delete_snapshots([(snapshot, subvolumes)])
 
-        for subvolume in snapshot.subvolumes:
-            if subvolume not in subvolumes:
-                continue
+    def delete_snapshots(
+        self,
+        deletions: Iterable[tuple[Snapshot, list[BackupHostPath] | None]],
+    ) -> None:
+        """
+        Delete multiple snapshots at once, using as few btrfs calls as possible.
+
+        Args:
+            deletions: Snapshots to delete with the subvolumes to delete. If the subvolumes are None, all subvolumes are deleted
+        """
+        subvolume_dirs = []
+        snapshot_dirs = []
+        for snapshot, selected_subvolumes in deletions:
+            subvolumes = snapshot.subvolumes if selected_subvolumes is None else selected_subvolumes
+
+            for subvolume in snapshot.subvolumes:
+                if subvolume not in subvolumes:
+                    continue
 
-            subvolume_dir = snapshot.base_path / snapshot.name / subvolume
+                log.info("Delete snapshot %s on %s", str(snapshot.name / subvolume), self.type)
+                subvolume_dirs.append(snapshot.base_path / snapshot.name / subvolume)
 
-            log.info("Delete snapshot %s on %s", str(snapshot.name / subvolume), self.type)
-            self.connection.run_process(["btrfs", "subvolume", "delete", str(subvolume_dir)])
+            if subvolumes == snapshot.subvolumes:
+                snapshot_dirs.append(snapshot.base_path / snapshot.name)
 
-        if subvolumes == snapshot.subvolumes:
-            (snapshot.base_path / snapshot.name).rmdir()
+        self.delete_subvolumes(subvolume_dirs)
+        self.connection.rmdirs(snapshot_dirs)
+
+    def delete_subvolumes(self, subvolumes: Sequence[PurePath]) -> None:
+        """
+        Delete subvolumes in bulk. Nested subvolumes need to be listed before their parents.
+
+        Args:
+            subvolumes: Absolute paths of the subvolumes to delete
+        """
+        commit_after = ["--commit-after"] * self.target_config.delete_commit_after
+        commands = [
+            ["btrfs", "subvolume", "delete", *commit_after]
+            + [str(x) for x in subvolumes[i : i + _DELETE_CHUNK_SIZE]]
+            for i in range(0, len(subvolumes), _DELETE_CHUNK_SIZE)
+        ]
+
+        try:
+            self.connection.run_processes(commands)
+        except exceptions.FailedProcessError:
+            # Unknown, which subvolumes got deleted before the failure
+            self.inventory().invalidate()
+            raise
+
+        for subvolume in subvolumes:
+            self.inventory().remove(subvolume)
 
     def _get_nearest_matching_snapshot(
         self,
@@ -298,15 +374,18 @@ class BackupTargetHost(metaclass=ABCMeta):
         parent_snapshot_set = set(parent_snapshot.subvolumes)
         return {x: x in parent_snapshot_set for x in new_snapshot.subvolumes}
 
+    @functools.cached_property
+    def _subvolume_rule_matcher(self) -> PathMatcher[TargetSubvolume]:
+        return PathMatcher((PurePath(k), v) for k, v in self.target_config.subvolume_rules.items())
+
     @classmethod
     def _filter_subvolumes(
-        cls, subvolumes: Iterable[BackupHostPath], search_paths: list[PurePath]
+        cls,
+        subvolumes: Iterable[BackupHostPath],
+        rule_matcher: PathMatcher[T],
+        match: Callable[[T], bool],
     ) -> Generator[BackupHostPath, None, None]:
-        return (
-            x
-            for x in subvolumes
-            if any(contains_path(x, search_path) for search_path in search_paths)
-        )
+        return (x for x in subvolumes if any(match(rule) for rule in rule_matcher.matches(x)))
 
     def source_subvolumes_from_snapshot(
         self, snapshot: Snapshot
@@ -343,13 +422,17 @@ class BackupTargetHost(metaclass=ABCMeta):
         Returns:
             Generator of subvolumes
         """
+        return self._filter_subvolumes_by_rule(
+            subvolumes, lambda rule: rule.backup_strategy in backup_strategies
+        )
+
+    def _filter_subvolumes_by_rule(
+        self,
+        subvolumes: Iterable[BackupHostPath],
+        match: Callable[[TargetSubvolume], bool],
+    ) -> Generator[BackupHostPath, None, None]:
         return self._filter_subvolumes(
-            (self.path("/") / x for x in subvolumes),
-            [
-                PurePath(k)
-                for k, v in self.target_config.subvolume_rules.items()
-                if v.backup_strategy in backup_strategies
-            ],
+            (self.path("/") / x for x in subvolumes), self._subvolume_rule_matcher, match
         )
 
     def _remove_source_subvolumes(self, snapshots: dict[str, Snapshot]) -> None:
@@ -361,8 +444,9 @@ class BackupTargetHost(metaclass=ABCMeta):
         self,
         destination: "BackupTargetHost",
         snapshot_name: str,
-        send_con: LocalConnection = LocalConnection(PurePath()),
+        send_con: Connection | None = None,
         incremental: bool = True,
+        parent_snapshot_name: str | None = None,
     ) -> None:
         """
         Send a snapshot to the destination host.
@@ -370,8 +454,9 @@ class BackupTargetHost(metaclass=ABCMeta):
         Args:
             destination: Destination host
             snapshot_name: snapshot to transmit
-            send_con: Optional connection from where to send from
+            send_con: Optional connection to the host running the transfer pipe. If None, it's chosen by the transfer_mode of the target
             incremental: Only send the difference from the nearest snapshot already sent
+            parent_snapshot_name: Snapshot to use as parent for an incremental send. If None, the nearest snapshot present on both hosts is used
         """
         src_snapshots = self.snapshots()
         dst_snapshots = destination.snapshots()
@@ -386,49 +471,476 @@ class BackupTargetHost(metaclass=ABCMeta):
 
         snapshot = src_snapshots[snapshot_name]
 
-        parent_snapshot_name = None
-        if incremental:
+        if not incremental:
+            parent_snapshot_name = None
+        elif parent_snapshot_name is None:
             parent_snapshot_name = self._get_nearest_matching_snapshot(
                 src_group_names=set(src_snapshots),
                 dst_group_names=set(dst_snapshots),
                 snapshot_name=snapshot_name,
             )
+        elif parent_snapshot_name not in src_snapshots or parent_snapshot_name not in dst_snapshots:
+            raise exceptions.SnapshotNotFoundError(
+                f"The parent snapshot {parent_snapshot_name} does not exist on both hosts."
+            )
 
-        snapshot_parent_mapping = None
+        parent_subvolumes: dict[BackupHostPath, BackupHostPath] = {}
         if parent_snapshot_name:
             log.info("Using incremental send based on snapshot: %s", parent_snapshot_name)
             parent_snapshot = src_snapshots[parent_snapshot_name]
-            snapshot_parent_mapping = self._map_parent_snapshots(snapshot, parent_snapshot)
+            parent_subvolumes = {
+                subvol: self.snapshot_dir / parent_snapshot_name / subvol
+                for subvol, has_parent in self._map_parent_snapshots(
+                    snapshot, parent_snapshot
+                ).items()
+                if has_parent
+            }
+
+        clone_sources: dict[BackupHostPath, list[BackupHostPath]] = {}
+        if incremental:
+            parent_subvolumes |= self._uuid_parent_subvolumes(destination, snapshot, src_snapshots)
+            clone_sources = self._clone_sources(
+                destination,
+                snapshot,
+                [x for x in snapshot.subvolumes if x not in parent_subvolumes],
+                src_snapshots,
+            )
 
         (destination.snapshot_dir / snapshot_name).mkdir(parents=True)
 
-        with send_con:
-            for subvol in snapshot.subvolumes:
-                parent_param = ""
-                if (
-                    parent_snapshot_name
-                    and snapshot_parent_mapping is not None
-                    and snapshot_parent_mapping[subvol] is True
-                ):
-                    parent_param = (
-                        f" -p {shlex.quote(str(self.snapshot_dir / parent_snapshot_name / subvol))}"
-                    )
+        if send_con is None:
+            send_con = self._transfer_connection(destination)
 
-                send_cmd = (
-                    f"{self.connection.exec_prefix}btrfs send{parent_param}"
-                    f" {shlex.quote(str(self.snapshot_dir / snapshot_name / subvol))}"
-                )
-                receive_cmd = (
-                    f"{destination.connection.exec_prefix}btrfs receive"
-                    f" {shlex.quote(str(destination.snapshot_dir / snapshot_name))}"
+        # Source slots are always acquired before destination slots to avoid deadlocks
+        with (
+            self.transfer_slot,
+            destination.transfer_slot,
+            contextlib.nullcontext(send_con) if send_con.connected else send_con,
+        ):
+            self._send_subvolumes(
+                destination,
+                send_con,
+                snapshot_name,
+                [
+                    (subvol, parent_subvolumes.get(subvol), clone_sources.get(subvol, []))
+                    for subvol in snapshot.subvolumes
+                ],
+            )
+
+    def _send_subvolumes(
+        self,
+        destination: "BackupTargetHost",
+        send_con: Connection,
+        snapshot_name: str,
+        subvolumes: list[tuple[BackupHostPath, BackupHostPath | None, list[BackupHostPath]]],
+    ) -> None:
+        """
+        Send the subvolumes of a snapshot, up to send_parallelism at the same time.
+
+        The sends are started in the order of the subvolumes. If sent in parallel,
+        a failed send doesn't stop the others and all failures are reported together afterwards.
+
+        Args:
+            destination: Destination host
+            send_con: Connection to the host running the transfers
+            snapshot_name: Snapshot containing the subvolumes
+            subvolumes: Subvolume, parent and clone sources of each subvolume to send
+
+        Raises:
+            SubvolumeSendError: If subvolumes sent in parallel failed.
+        """
+        parallelism = min(self.target_config.send_parallelism, len(subvolumes))
+        if parallelism <= 1:
+            for subvol, parent, clone_sources in subvolumes:
+                self._send_subvolume(
+                    destination, send_con, snapshot_name, subvol, parent, clone_sources
                 )
-                log.info(
-                    "Sending snapshot: %s from %s to %s",
-                    str(snapshot_name / subvol),
-                    self.type,
-                    destination.type,
+
+            return
+
+        with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="b4-send") as executor:
+            futures = [
+                executor.submit(self._send_subvolume, destination, send_con, snapshot_name, *x)
+                for x in subvolumes
+            ]
+
+        errors: dict[str, Exception] = {}
+        for (subvol, _parent, _clone_sources), future in zip(subvolumes, futures, strict=True):
+            exc = future.exception()
+            if isinstance(exc, Exception):
+                log.error("Sending subvolume %s of snapshot %s failed", subvol, snapshot_name)
+                errors[str(subvol)] = exc
+
+        if errors:
+            raise exceptions.SubvolumeSendError(snapshot_name, errors)
+
+    def _sent_subvolumes(
+        self,
+        destination: "BackupTargetHost",
+        snapshot: Snapshot,
+        src_snapshots: dict[str, Snapshot],
+        src_info: dict[PurePosixPath, SubvolumeInfo],
+    ) -> list[tuple[str, SubvolumeInfo, BackupHostPath]]:
+        """
+        Find the subvolumes of other source snapshots, which are present on the destination.
+
+        A subvolume is present, if its uuid is the received_uuid of a subvolume on the destination,
+        no matter how the subvolume is named there.
+
+        Args:
+            destination: Destination host
+            snapshot: Snapshot to send. Its subvolumes are excluded
+            src_snapshots: All snapshots on the source
+            src_info: Metadata of all subvolumes on the source
+
+        Returns:
+            A list of (snapshot name, metadata, absolute path) of the present subvolumes.
+        """
+        received_uuids = destination.inventory().received_uuids(destination.connection)
+
+        sent_subvolumes = []
+        for other_snapshot in src_snapshots.values():
+            if other_snapshot.name == snapshot.name:
+                continue
+
+            for subvol in other_snapshot.subvolumes:
+                path = other_snapshot.base_path / other_snapshot.name / subvol
+                info = src_info.get(path)
+                if info and info.uuid in received_uuids:
+                    sent_subvolumes.append((other_snapshot.name, info, path))
+
+        return sent_subvolumes
+
+    def _clone_sources(
+        self,
+        destination: "BackupTargetHost",
+        snapshot: Snapshot,
+        subvolumes: list[BackupHostPath],
+        src_snapshots: dict[str, Snapshot],
+    ) -> dict[BackupHostPath, list[BackupHostPath]]:
+        """
+        Choose clone sources (btrfs send -c) for subvolumes without a parent.
+
+        Related subvolumes come first. These are snapshots of the subvolume the origin of the new subvolume was cloned from
+        and snapshots of other clones of it, for example other containers created from the same image.
+        They are followed by the subvolumes of the newest snapshot present on both hosts.
+        The first clone source is sent as parent (btrfs send -p).
+
+        Args:
+            destination: Destination host
+            snapshot: Snapshot to send
+            subvolumes: Subvolumes of the snapshot without a parent
+            src_snapshots: All snapshots on the source
+
+        Returns:
+            The absolute paths of the clone sources by subvolume of the snapshot.
+        """
+        if not subvolumes:
+            return {}
+
+        src_info = self.inventory().infos(self.connection)
+        sent_subvolumes = self._sent_subvolumes(destination, snapshot, src_snapshots, src_info)
+        if not sent_subvolumes:
+            return {}
+
+        newest_snapshot_name = max(x[0] for x in sent_subvolumes)
+        newest_subvolumes = [x[2] for x in sent_subvolumes if x[0] == newest_snapshot_name]
+        info_by_uuid = {x.uuid: x for x in src_info.values() if x.uuid}
+
+        clone_sources: dict[BackupHostPath, list[BackupHostPath]] = {}
+        for subvol in subvolumes:
+            info = src_info.get(snapshot.base_path / snapshot.name / subvol)
+            origin = info and info_by_uuid.get(info.parent_uuid or "")
+
+            related: list[BackupHostPath] = []
+            if origin and origin.parent_uuid:
+                # The origin itself and all its siblings are snapshots (clones) of the same subvolume
+                siblings = {
+                    x.uuid for x in src_info.values() if x.parent_uuid == origin.parent_uuid
+                }
+                related = [
+                    path
+                    for _snapshot_name, sent_info, path in sorted(
+                        sent_subvolumes, key=lambda x: x[0], reverse=True
+                    )
+                    if sent_info.parent_uuid in siblings | {origin.parent_uuid}
+                ]
+
+            clone_sources[subvol] = list(dict.fromkeys(related + newest_subvolumes))[
+                :_MAX_CLONE_SOURCES
+            ]
+            log.debug("Clone sources of %s: %s", subvol, clone_sources[subvol])
+
+        return clone_sources
+
+    def _uuid_parent_subvolumes(
+        self,
+        destination: "BackupTargetHost",
+        snapshot: Snapshot,
+        src_snapshots: dict[str, Snapshot],
+    ) -> dict[BackupHostPath, BackupHostPath]:
+        """
+        Find a parent for each subvolume of a snapshot by the btrfs UUIDs instead of the names.
+
+        Candidates are subvolumes of other source snapshots, which were taken from the same subvolume
+        (same parent_uuid) and were received by the destination (their uuid is a received_uuid there).
+        This way subvolumes moved on the source and snapshots renamed on the destination are still sent incrementally.
+        The candidate with the generation closest to the one of the new subvolume wins.
+
+        Args:
+            destination: Destination host
+            snapshot: Snapshot to send
+            src_snapshots: All snapshots on the source
+
+        Returns:
+            The absolute path of the parent by subvolume of the snapshot. Subvolumes without a match are missing.
+        """
+        src_info = self.inventory().infos(self.connection)
+
+        candidates: dict[str, list[tuple[SubvolumeInfo, BackupHostPath]]] = defaultdict(list)
+        for _snapshot_name, info, path in self._sent_subvolumes(
+            destination, snapshot, src_snapshots, src_info
+        ):
+            if info.parent_uuid:
+                candidates[info.parent_uuid].append((info, path))
+
+        parent_subvolumes: dict[BackupHostPath, BackupHostPath] = {}
+        for subvol in snapshot.subvolumes:
+            info = src_info.get(snapshot.base_path / snapshot.name / subvol)
+            if info is None or info.parent_uuid not in candidates:
+                continue
+
+            generation = info.generation
+            _, parent_subvolumes[subvol] = min(
+                candidates[info.parent_uuid],
+                key=lambda x: (abs(x[0].generation - generation), x[0].generation),
+            )
+            log.debug("Parent of %s: %s", subvol, parent_subvolumes[subvol])
+
+        return parent_subvolumes
+
+    def _send_subvolume(
+        self,
+        destination: "BackupTargetHost",
+        send_con: Connection,
+        snapshot_name: str,
+        subvol: BackupHostPath,
+        parent: BackupHostPath | None,
+        clone_sources: list[BackupHostPath],
+    ) -> None:
+        """
+        Send a single subvolume of a snapshot and record the transfer in the catalog.
+
+        Args:
+            destination: Destination host
+            send_con: Connection to the host running the transfer
+            snapshot_name: Snapshot containing the subvolume
+            subvol: Escaped name of the subvolume inside the snapshot directory
+            parent: Absolute path of the parent subvolume. If None, the first clone source is used or the subvolume is sent in full
+            clone_sources: Absolute paths of subvolumes present on both hosts, which might share data with the subvolume
+        """
+        clone_parent = bool(clone_sources) and not parent
+        if clone_parent:
+            # Without -p, btrfs send looks for a parent among the clone sources, which was taken from the same subvolume.
+            # Those are already used as parents, so it would fail. The best clone source becomes the parent instead
+            parent, *clone_sources = clone_sources
+
+        parent_param = ""
+        if parent:
+            parent_param = f" -p {shlex.quote(str(parent))}"
+
+        parent_param += "".join(f" -c {shlex.quote(str(x))}" for x in clone_sources)
+
+        send_cmd = (
+            f"btrfs send{parent_param}"
+            f" {shlex.quote(str(self.snapshot_dir / snapshot_name / subvol))}"
+        )
+        receive_cmd = f"btrfs receive {shlex.quote(str(destination.snapshot_dir / snapshot_name))}"
+        log.info(
+            "Sending snapshot: %s from %s to %s",
+            str(snapshot_name / subvol),
+            self.type,
+            destination.type,
+        )
+        start = time.monotonic()
+        size = self._transfer_subvolume(destination, send_con, send_cmd, receive_cmd)
+        # Remember what was received. Otherwise the next send of a sync reads all subvolumes of the destination again
+        inventory = self.inventory()
+        info = (
+            inventory.info(self.connection, self.snapshot_dir / snapshot_name / subvol)
+            if inventory.loaded
+            else None
+        )
+        destination.inventory().add(
+            destination.snapshot_dir / snapshot_name / subvol, info and info.uuid
+        )
+
+        if clone_parent and size is not None:
+            log.info("Sent %s based on clone sources as %.2f MB", subvol, size / 1_000_000)
+            # Measuring the full size reads the metadata of the whole subvolume
+            if log.isEnabledFor(logging.DEBUG):
+                self._log_clone_savings(self.snapshot_dir / snapshot_name / subvol, size)
+
+        if self.catalog is not None:
+            self.catalog.add_transfer(
+                self.name,
+                snapshot_name,
+                str(subvol),
+                parent and parent.relative_to(self.snapshot_dir).parts[0],
+                size,
+                time.monotonic() - start,
+            )
+
+    def _transfer_subvolume(
+        self,
+        destination: "BackupTargetHost",
+        send_con: Connection,
+        send_cmd: str,
+        receive_cmd: str,
+    ) -> int | None:
+        """
+        Transfer a subvolume from this host to the destination and log the statistics.
+
+        If the transfer runs on the host running b4, the stream is moved by b4 itself.
+        Otherwise a shell pipeline is started on the host running the transfer.
+
+        Args:
+            destination: Destination host
+            send_con: Connection to the host running the transfer
+            send_cmd: btrfs send command line
+            receive_cmd: btrfs receive command line
+
+        Returns:
+            Number of bytes transferred or None, if the stream didn't pass this process.
+        """
+        send_side, receive_side = self._transfer_commands(
+            destination, send_con, send_cmd, receive_cmd
+        )
+
+        if isinstance(send_con, LocalConnection):
+            stats = pump(["bash", "-c", send_side], ["bash", "-c", receive_side])
+            log.info("Transferred %s", stats)
+            self._log_compression_ratio(stats.send_stderr)
+            return stats.size
+
+        # fd 4 is stdout and fd 6 stderr of the pipeline. Only the timings are written to stdout,
+        # next to a copy of the stderr of the send side, which contains the compression ratio.
+        # fd 5 carries the stream from the send side to the receive side.
+        output = send_con.run_process(
+            [
+                "bash",
+                "-c",
+                "set -o pipefail; exec 4>&1 6>&2;"
+                f" {{ TIMEFORMAT='b4-stage send %R';"
+                f" time {{ {{ {send_side} ; }} 2>&1 >&5 | tee /dev/fd/4 >&6 ; }} ; }} 2>&4 5>&1"
+                f" | {{ TIMEFORMAT='b4-stage receive %R'; time {{ {{ {receive_side} ; }} 2>&6 ; }} ; }} 2>&4",
+            ]
+        )
+
+        stage_times = _STAGE_TIME_PATTERN.findall(output)
+        if stage_times:
+            log.info(
+                "Transfer stages: %s",
+                ", ".join(f"{stage} {float(seconds):.2f}s" for stage, seconds in stage_times),
+            )
+
+        self._log_compression_ratio(output)
+        return None
+
+    def _transfer_commands(
+        self,
+        destination: "BackupTargetHost",
+        send_con: Connection,
+        send_cmd: str,
+        receive_cmd: str,
+    ) -> tuple[str, str]:
+        """
+        Build the command lines of both sides of a transfer, including the compression stages.
+
+        Args:
+            destination: Destination host
+            send_con: Connection to the host running the transfer
+            send_cmd: btrfs send command line
+            receive_cmd: btrfs receive command line
+
+        Returns:
+            The sending and the receiving command line to run on the send_con host.
+        """
+        compression = self.target_config.transfer_compression
+        if compression != TransferCompression.NONE:
+            compress_cmd, decompress_cmd = _COMPRESSION_COMMANDS[compression]
+            if self.target_config.transfer_compression_level is not None:
+                compress_cmd += f" -{self.target_config.transfer_compression_level}"
+
+            send_cmd = f"{send_cmd} | {compress_cmd}"
+            receive_cmd = f"{decompress_cmd} | {receive_cmd}"
+
+        return (
+            self.connection.command_from(send_con, send_cmd),
+            destination.connection.command_from(send_con, receive_cmd),
+        )
+
+    def _log_clone_savings(self, subvolume: BackupHostPath, size: int) -> None:
+        """
+        Log the bytes clone sources saved, compared to the size of a full send. Only used for debugging.
+
+        Args:
+            subvolume: Absolute path of the sent subvolume
+            size: Number of bytes transferred
+        """
+        output = self.connection.run_process(
+            ["btrfs", "filesystem", "du", "-s", "--raw", str(subvolume)]
+        )
+
+        # Format looking like this:
+        #      Total   Exclusive  Set shared  Filename
+        #   52428800           0     52428800  /opt/subvolume
+        total = int(output.strip().split("\n")[-1].split()[0])
+        log.debug("Clone sources saved %.2f MB", max(0, total - size) / 1_000_000)
+
+    @staticmethod
+    def _log_compression_ratio(output: str) -> None:
+        """
+        Log the compression ratio reported by the compressor.
+
+        Args:
+            output: Output of the compressor
+        """
+        ratio = _COMPRESSION_RATIO_PATTERN.search(output)
+        if ratio:
+            log.info("Compression ratio: %s%%", ratio.group(1))
+
+    def _transfer_connection(self, destination: "BackupTargetHost") -> Connection:
+        """
+        Return the connection to the host, which pipes the snapshot stream to the destination.
+
+        Args:
+            destination: Destination host
+
+        Returns:
+            Connection to the host running the transfer pipe.
+        """
+        transfer_mode = self.target_config.transfer_mode
+
+        if transfer_mode == TransferMode.DIRECT and not (
+            isinstance(self.connection, LocalConnection)
+            or isinstance(destination.connection, LocalConnection)
+        ):
+            log.debug("Sending directly from %s to %s", self.type, destination.type)
+            return self.connection
+
+        if transfer_mode == TransferMode.RELAY:
+            if self.target_config.transfer_relay is None:
+                raise exceptions.InvalidConnectionUrlError(
+                    "transfer_relay is required for the transfer_mode relay"
                 )
-                send_con.run_process(["bash", "-c", f"{send_cmd} | {receive_cmd}"])
+
+            # Closed after the send. A pooled SSH client stays open, while other targets use it
+            relay_con = Connection.from_url(self.target_config.transfer_relay)
+            log.debug("Sending from %s to %s via relay", self.type, destination.type)
+            return relay_con
+
+        return LocalConnection(PurePath())
 
 
 @dataclass
@@ -443,15 +955,18 @@ class SourceBackupTargetHost(BackupTargetHost):
         """
         return "source"
 
-    def create_snapshot(self, snapshot_name: str) -> Snapshot:
+    def create_snapshot(
+        self, snapshot_name: str, retained_snapshots: Collection[str] | None = None
+    ) -> Snapshot | None:
         """
         Create a new snapshot for this target with the given name.
 
         Args:
             snapshot_name: Name of the snapshot.
+            retained_snapshots: Snapshots kept by the retention after this backup. An unchanged subvolume is only skipped, if one of them contains it. If None, all snapshots are considered
 
         Returns:
-            Instance of the newly created snapshot.
+            Instance of the newly created snapshot or None, if all subvolumes are unchanged and skipped.
         """
         log.debug("Identify target subvolumes to backup")
 
@@ -474,6 +989,39 @@ class SourceBackupTargetHost(BackupTargetHost):
                 f"The target {self.name} does not contain any btrfs subvolumes"
             )
 
+        unchanged_subvolumes = self._unchanged_subvolumes(src_target_subvolumes)
+        skipped_subvolumes = list(
+            self._filter_subvolumes_by_rule(
+                unchanged_subvolumes,
+                lambda rule: rule.unchanged_strategy == SubvolumeUnchangedStrategy.SKIP,
+            )
+        )
+        if retained_snapshots is not None and skipped_subvolumes:
+            # A skipped subvolume is only contained in older snapshots. Don't skip it, if the retention deletes all of them
+            kept_subvolumes = self._unchanged_subvolumes(skipped_subvolumes, retained_snapshots)
+            for subvolume in skipped_subvolumes:
+                if subvolume not in kept_subvolumes:
+                    log.debug("Last snapshot of %s expires. Snapshot it anyway", subvolume)
+
+            skipped_subvolumes = kept_subvolumes
+
+        if unchanged_subvolumes:
+            log.info(
+                "%s of %s subvolumes unchanged since their last snapshot. Skipped: %s, sent as incremental: %s",
+                len(unchanged_subvolumes),
+                len(src_target_subvolumes),
+                len(skipped_subvolumes),
+                len(unchanged_subvolumes) - len(skipped_subvolumes),
+            )
+
+        for subvolume in skipped_subvolumes:
+            log.debug("Skip unchanged subvolume %s", subvolume)
+            src_target_subvolumes.remove(subvolume)
+
+        if not src_target_subvolumes:
+            log.info("Nothing changed since the last snapshot. No snapshot created")
+            return None
+
         snapshot = Snapshot.from_new(
             name=snapshot_name,
             subvolumes=src_target_subvolumes,
@@ -496,9 +1044,51 @@ class SourceBackupTargetHost(BackupTargetHost):
             self.connection.run_process(
                 ["btrfs", "subvolume", "snapshot", "-r", str(source_path), str(snapshot_path)]
             )
+            self.inventory().add(snapshot_path)
 
         return snapshot
 
+    def _unchanged_subvolumes(
+        self, subvolumes: list[BackupHostPath], snapshot_names: Collection[str] | None = None
+    ) -> list[BackupHostPath]:
+        """
+        Find the subvolumes, which didn't change since their last snapshot of this target.
+
+        A snapshot gets the generation of the transaction it was created in.
+        Any later change to the subvolume raises its generation above it.
+
+        Args:
+            subvolumes: Subvolumes of the target, relative to the target location, starting with /
+            snapshot_names: Only compare with these snapshots. If None, all snapshots of the target are used
+
+        Returns:
+            The unchanged subvolumes.
+        """
+        src_info = self.inventory().infos(self.connection)
+
+        last_snapshot_generation: dict[str, int] = {}
+        for path, info in src_info.items():
+            if (
+                info.parent_uuid
+                and path.is_relative_to(self.snapshot_dir)
+                and (snapshot_names is None or path.parent.name in snapshot_names)
+            ):
+                last_snapshot_generation[info.parent_uuid] = max(
+                    info.generation, last_snapshot_generation.get(info.parent_uuid, 0)
+                )
+
+        unchanged_subvolumes = []
+        for subvolume in subvolumes:
+            info = src_info.get(self.connection.location / subvolume.relative_to("/"))
+            if (
+                info is not None
+                and info.uuid in last_snapshot_generation
+                and info.generation <= last_snapshot_generation[info.uuid]
+            ):
+                unchanged_subvolumes.append(subvolume)
+
+        return unchanged_subvolumes
+
 
 @dataclass
 class DestinationBackupTargetHost(BackupTargetHost):
@@ -545,12 +1135,72 @@ def _mark_keep_open(
             conn.keep_open = True
 
 
+def _target_connections(
+    target_choice: ChoiceSelector,
+    backup_targets: dict[str, BackupTarget],
+    use_source: bool,
+    use_destination: bool,
+) -> list[tuple[str, Connection | contextlib.nullcontext, Connection | contextlib.nullcontext]]:
+    target_names = target_choice.resolve_target(backup_targets)
+    return sorted(
+        (
+            (
+                target_name,
+                Connection.from_url(backup_targets[target_name].source if use_source else None),
+                Connection.from_url(
+                    backup_targets[target_name].destination if use_destination else None
+                ),
+            )
+            for target_name in target_names
+        ),
+        key=_connection_sort_key,
+    )
+
+
+@contextlib.contextmanager
+def _open_target_hosts(
+    target_name: str,
+    target_config: BackupTarget,
+    source: Connection | contextlib.nullcontext,
+    destination: Connection | contextlib.nullcontext,
+    catalog: SnapshotCatalog | None = None,
+) -> Generator[
+    tuple[SourceBackupTargetHost | None, DestinationBackupTargetHost | None], None, None
+]:
+    for con in (source, destination):
+        if isinstance(con, SSHConnection):
+            con.persistent_session = target_config.persistent_ssh_session
+            con.use_remote_agent = target_config.remote_agent
+
+    with source as src_con, destination as dst_con:
+        src_host = None
+        if src_con:
+            src_host = BackupTargetHost.from_source_host(
+                target_name=target_name,
+                target_config=target_config,
+                connection=src_con,
+                catalog=catalog,
+            )
+
+        dst_host = None
+        if dst_con:
+            dst_host = BackupTargetHost.from_destination_host(
+                target_name=target_name,
+                target_config=target_config,
+                connection=dst_con,
+                catalog=catalog,
+            )
+
+        yield src_host, dst_host
+
+
 def host_generator(
     target_choice: ChoiceSelector,
     backup_targets: dict[str, BackupTarget],
     *,
     use_source: bool = True,
     use_destination: bool = True,
+    catalog: SnapshotCatalog | None = None,
 ) -> Generator[
     tuple[SourceBackupTargetHost | None, DestinationBackupTargetHost | None], None, None
 ]:
@@ -562,44 +1212,184 @@ def host_generator(
         backup_targets: A dict containing all targets available
         use_source: If false, the source host will be omitted
         use_destination: If false, the destination host will be omitted
+        catalog: Snapshot catalog passed to the TargetHosts
 
     Returns:
         A tuple containing source and destination TargetHosts
     """
-    target_names = target_choice.resolve_target(backup_targets)
-    target_connections = sorted(
-        (
-            (
-                target_name,
-                Connection.from_url(backup_targets[target_name].source if use_source else None),
-                Connection.from_url(
-                    backup_targets[target_name].destination if use_destination else None
-                ),
-            )
-            for target_name in target_names
-        ),
-        key=_connection_sort_key,
+    target_connections = _target_connections(
+        target_choice, backup_targets, use_source, use_destination
     )
     _mark_keep_open(target_connections)
 
     for target_name, source, destination in target_connections:
         log.info("Backup target: %s", target_name)
 
-        with source as src_con, destination as dst_con:
-            src_host = None
-            if src_con:
-                src_host = BackupTargetHost.from_source_host(
-                    target_name=target_name,
-                    target_config=backup_targets[target_name],
-                    connection=src_con,
-                )
+        with _open_target_hosts(
+            target_name, backup_targets[target_name], source, destination, catalog
+        ) as hosts:
+            yield hosts
 
-            dst_host = None
-            if dst_con:
-                dst_host = BackupTargetHost.from_destination_host(
-                    target_name=target_name,
-                    target_config=backup_targets[target_name],
-                    connection=dst_con,
-                )
 
-            yield src_host, dst_host
+def _host_semaphores(
+    connections: Iterable[tuple[Connection | contextlib.nullcontext, int]],
+) -> dict[Hashable, threading.Semaphore]:
+    # If targets on the same host got different limits, the lowest one wins
+    limits: dict[Hashable, int] = {}
+    for conn, limit in connections:
+        if isinstance(conn, Connection):
+            limits[conn.host_id] = min(limit, limits.get(conn.host_id, limit))
+
+    return {k: threading.Semaphore(max(1, v)) for k, v in limits.items()}
+
+
+def _host_semaphore(
+    semaphores: dict[Hashable, threading.Semaphore], conn: Connection | contextlib.nullcontext
+) -> threading.Semaphore | contextlib.nullcontext:
+    if isinstance(conn, Connection):
+        return semaphores[conn.host_id]
+
+    return contextlib.nullcontext()
+
+
+def run_targets(
+    target_choice: ChoiceSelector,
+    backup_targets: dict[str, BackupTarget],
+    action: Callable[[SourceBackupTargetHost | None, DestinationBackupTargetHost | None], T],
+    *,
+    max_workers: int = 1,
+    use_source: bool = True,
+    use_destination: bool = True,
+    on_error: Callable[[Exception], None] | None = None,
+    catalog: SnapshotCatalog | None = None,
+    pipelined: bool = False,
+) -> list[T]:
+    """
+    Run an action for each of the selected targets, optionally in parallel.
+
+    Targets are processed by up to max_workers threads. The number of targets processed at the same time
+    on one host is limited by src_host_concurrency and dst_host_concurrency of the targets.
+
+    In pipelined mode these limits only apply to the snapshot transfers, so the snapshot creation and cleanup
+    of other targets on the same host overlap with them. At least one thread per stage
+    (snapshot, transfer, cleanup) is used then, even if max_workers is lower.
+
+    Args:
+        target_choice: A ChoiceSelector list of targets to be used
+        backup_targets: A dict containing all targets available
+        action: Function called with the source and destination TargetHosts of each target
+        max_workers: Maximum number of targets processed in parallel
+        use_source: If false, the source host will be omitted
+        use_destination: If false, the destination host will be omitted
+        on_error: Called with the exception, if the action of a target fails. If None, the exception is raised
+        catalog: Snapshot catalog passed to the TargetHosts
+        pipelined: Limit the transfers per host instead of the targets per host
+
+    Returns:
+        The return values of the successful actions in the same order as host_generator
+    """
+
+    def _handle_error(exc: Exception) -> None:
+        if on_error is None:
+            raise exc
+
+        on_error(exc)
+
+    target_connections = _target_connections(
+        target_choice, backup_targets, use_source, use_destination
+    )
+
+    if pipelined and max_workers < _PIPELINE_STAGES:
+        log.warning(
+            "Pipelined mode needs one thread per stage. Using %s threads instead of max_workers %s",
+            _PIPELINE_STAGES,
+            max_workers,
+        )
+        max_workers = _PIPELINE_STAGES
+
+    results: list[T] = []
+    if max_workers <= 1:
+        _mark_keep_open(target_connections)
+
+        for target_name, source, destination in target_connections:
+            log.info("Backup target: %s", target_name)
+
+            try:
+                with _open_target_hosts(
+                    target_name, backup_targets[target_name], source, destination, catalog
+                ) as (src_host, dst_host):
+                    results.append(action(src_host, dst_host))
+            except Exception as exc:
+                _handle_error(exc)
+
+        return results
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="b4") as executor:
+            futures = _submit_targets(
+                executor, target_connections, backup_targets, action, catalog, pipelined
+            )
+
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as exc:
+                    _handle_error(exc)
+    finally:
+        # Pooled SSH clients are shared between the threads, so they are closed after all targets are done
+        SSHConnection.close_pool()
+
+    return results
+
+
+def _submit_targets(
+    executor: ThreadPoolExecutor,
+    target_connections: list[
+        tuple[str, Connection | contextlib.nullcontext, Connection | contextlib.nullcontext]
+    ],
+    backup_targets: dict[str, BackupTarget],
+    action: Callable[[SourceBackupTargetHost | None, DestinationBackupTargetHost | None], T],
+    catalog: SnapshotCatalog | None = None,
+    pipelined: bool = False,
+) -> list[Future[T]]:
+    for _name, source, destination in target_connections:
+        for conn in (source, destination):
+            if isinstance(conn, SSHConnection):
+                conn.keep_open = True
+
+    src_semaphores = _host_semaphores(
+        (source, backup_targets[name].src_host_concurrency)
+        for name, source, _destination in target_connections
+    )
+    dst_semaphores = _host_semaphores(
+        (destination, backup_targets[name].dst_host_concurrency)
+        for name, _source, destination in target_connections
+    )
+
+    def _run(
+        target_name: str,
+        source: Connection | contextlib.nullcontext,
+        destination: Connection | contextlib.nullcontext,
+    ) -> T:
+        src_slot = _host_semaphore(src_semaphores, source)
+        dst_slot = _host_semaphore(dst_semaphores, destination)
+
+        with contextlib.ExitStack() as stack:
+            if not pipelined:
+                # Source semaphores are always acquired before destination semaphores to avoid deadlocks
+                stack.enter_context(src_slot)
+                stack.enter_context(dst_slot)
+
+            log.info("Backup target: %s", target_name)
+
+            with _open_target_hosts(
+                target_name, backup_targets[target_name], source, destination, catalog
+            ) as (src_host, dst_host):
+                if pipelined:
+                    for host, slot in ((src_host, src_slot), (dst_host, dst_slot)):
+                        if host:
+                            host.transfer_slot = slot
+
+                return action(src_host, dst_host)
+
+    return [executor.submit(_run, *x) for x in target_connections]
@@ -0,0 +1,317 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from b4_backup.main.inventory import SubvolumeInfo
+
+log = logging.getLogger("b4_backup.main")
+
+_SCHEMA_VERSION = 1
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS subvolumes (
+    target TEXT NOT NULL,
+    host TEXT NOT NULL,
+    snapshot TEXT NOT NULL,
+    subvolume TEXT NOT NULL,
+    subvolume_id INTEGER,
+    uuid TEXT,
+    parent_uuid TEXT,
+    received_uuid TEXT,
+    generation INTEGER,
+    created_at REAL NOT NULL,
+    deleted_at REAL,
+    PRIMARY KEY (target, host, snapshot, subvolume)
+);
+
+CREATE TABLE IF NOT EXISTS transfers (
+    id INTEGER PRIMARY KEY,
+    target TEXT NOT NULL,
+    snapshot TEXT NOT NULL,
+    subvolume TEXT NOT NULL,
+    parent TEXT,
+    bytes INTEGER,
+    duration REAL NOT NULL,
+    sent_at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS transfers_snapshot ON transfers (target, snapshot);
+"""
+
+
+@dataclass(frozen=True)
+class CatalogSubvolume:
+    """
+    A snapshot subvolume recorded in the catalog.
+
+    Attributes:
+        target: Name of the backup target
+        host: source or destination
+        snapshot: Name of the snapshot
+        subvolume: Escaped name of the subvolume inside the snapshot directory
+        info: Metadata of the subvolume at the time it was recorded
+        created_at: Seconds since the epoch, when b4 first saw the subvolume
+        deleted_at: Seconds since the epoch, when b4 noticed the deletion. None if it still exists
+    """
+
+    target: str
+    host: str
+    snapshot: str
+    subvolume: str
+    info: SubvolumeInfo | None
+    created_at: float
+    deleted_at: float | None = None
+
+
+@dataclass(frozen=True)
+class CatalogTransfer:
+    """
+    A subvolume sent from source to destination.
+
+    Attributes:
+        target: Name of the backup target
+        snapshot: Name of the sent snapshot
+        subvolume: Escaped name of the subvolume inside the snapshot directory
+        parent: Name of the snapshot used as parent or None for a full send
+        size: Number of bytes transferred. None if the stream didn't pass the host running b4
+        duration: Seconds the transfer took
+        sent_at: Seconds since the epoch, when the transfer finished
+    """
+
+    target: str
+    snapshot: str
+    subvolume: str
+    parent: str | None
+    size: int | None
+    duration: float
+    sent_at: float
+
+
+@dataclass
+class SnapshotCatalog:
+    """
+    A local SQLite database recording the snapshots of all targets, their transfers and deletions.
+
+    The hosts stay the source of truth. The catalog is reconciled with them after every change,
+    so it can be read without connecting to the hosts and it keeps the history of deleted snapshots.
+    Only list --cached reads it. Planning of sends and deletions always lists the snapshots on the hosts,
+    because snapshots might be created or deleted by other tools.
+
+    Attributes:
+        path: Location of the database file
+    """
+
+    path: Path
+    _db: sqlite3.Connection = field(repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    @classmethod
+    def open(cls, path: Path) -> "SnapshotCatalog":
+        """
+        Open the catalog. The database is created, if it doesn't exist.
+
+        Args:
+            path: Location of the database file
+
+        Returns:
+            SnapshotCatalog instance
+        """
+        path = path.expanduser()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        log.debug("Opening snapshot catalog %s", path)
+
+        # Targets processed in parallel share the same catalog. Access is serialized by a lock.
+        db = sqlite3.connect(path, check_same_thread=False)
+        with db:
+            db.executescript(_SCHEMA)
+            db.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+
+        return SnapshotCatalog(path=path, _db=db)
+
+    def close(self) -> None:
+        """Close the database."""
+        self._db.close()
+
+    def __enter__(self) -> "SnapshotCatalog":
+        """Entrypoint in a "with" statement."""
+        return self
+
+    def __exit__(self, *args, **kwargs) -> None:
+        """Endpoint in a "with" statement."""
+        self.close()
+
+    def subvolumes(
+        self, target: str, host: str, include_deleted: bool = False
+    ) -> list[CatalogSubvolume]:
+        """
+        Return the recorded subvolumes of a target.
+
+        Args:
+            target: Name of the backup target
+            host: source or destination
+            include_deleted: Also return subvolumes, which were deleted already
+
+        Returns:
+            The subvolumes ordered by snapshot and subvolume name.
+        """
+        query = (
+            "SELECT target, host, snapshot, subvolume, subvolume_id, generation, uuid, parent_uuid,"
+            " received_uuid, created_at, deleted_at FROM subvolumes WHERE target = ? AND host = ?"
+        )
+        if not include_deleted:
+            query += " AND deleted_at IS NULL"
+
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY snapshot, subvolume", (target, host))
+
+            return [
+                CatalogSubvolume(
+                    target=row[0],
+                    host=row[1],
+                    snapshot=row[2],
+                    subvolume=row[3],
+                    info=None if row[4] is None else SubvolumeInfo(*row[4:9]),
+                    created_at=row[9],
+                    deleted_at=row[10],
+                )
+                for row in rows
+            ]
+
+    def snapshots(self, target: str, host: str) -> dict[str, list[str]]:
+        """
+        Return the existing snapshots of a target.
+
+        Args:
+            target: Name of the backup target
+            host: source or destination
+
+        Returns:
+            The escaped subvolume names per snapshot name.
+        """
+        result: dict[str, list[str]] = {}
+        for subvolume in self.subvolumes(target, host):
+            result.setdefault(subvolume.snapshot, []).append(subvolume.subvolume)
+
+        return result
+
+    def reconcile(
+        self,
+        target: str,
+        host: str,
+        subvolumes: Iterable[tuple[str, str, SubvolumeInfo | None]],
+    ) -> None:
+        """
+        Update the catalog to match the subvolumes currently present on a host.
+
+        New subvolumes are added and subvolumes, which are gone, are marked as deleted.
+
+        Args:
+            target: Name of the backup target
+            host: source or destination
+            subvolumes: All (snapshot, subvolume, info) of the target present on the host
+        """
+        now = time.time()
+        present = {(snapshot, subvolume): info for snapshot, subvolume, info in subvolumes}
+
+        with self._lock, self._db:
+            known = set(
+                self._db.execute(
+                    "SELECT snapshot, subvolume FROM subvolumes"
+                    " WHERE target = ? AND host = ? AND deleted_at IS NULL",
+                    (target, host),
+                )
+            )
+
+            deleted = known - present.keys()
+            self._db.executemany(
+                "UPDATE subvolumes SET deleted_at = ?"
+                " WHERE target = ? AND host = ? AND snapshot = ? AND subvolume = ?",
+                [(now, target, host, snapshot, subvolume) for snapshot, subvolume in deleted],
+            )
+
+            # A subvolume with the same name, which was deleted earlier, is replaced
+            self._db.executemany(
+                "INSERT OR REPLACE INTO subvolumes (target, host, snapshot, subvolume, subvolume_id,"
+                " generation, uuid, parent_uuid, received_uuid, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        target,
+                        host,
+                        snapshot,
+                        subvolume,
+                        *(
+                            (None,) * 5
+                            if info is None
+                            else (
+                                info.id,
+                                info.generation,
+                                info.uuid,
+                                info.parent_uuid,
+                                info.received_uuid,
+                            )
+                        ),
+                        now,
+                    )
+                    for (snapshot, subvolume), info in present.items()
+                    if (snapshot, subvolume) not in known
+                ],
+            )
+
+        if deleted:
+            log.debug("Catalog: %s subvolumes of %s deleted on %s", len(deleted), target, host)
+
+    def add_transfer(
+        self,
+        target: str,
+        snapshot: str,
+        subvolume: str,
+        parent: str | None,
+        size: int | None,
+        duration: float,
+    ) -> None:
+        """
+        Record a subvolume sent from source to destination.
+
+        Args:
+            target: Name of the backup target
+            snapshot: Name of the sent snapshot
+            subvolume: Escaped name of the subvolume inside the snapshot directory
+            parent: Name of the snapshot used as parent or None for a full send
+            size: Number of bytes transferred, if known
+            duration: Seconds the transfer took
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO transfers (target, snapshot, subvolume, parent, bytes, duration, sent_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (target, snapshot, subvolume, parent, size, duration, time.time()),
+            )
+
+    def transfers(self, target: str, snapshot: str | None = None) -> list[CatalogTransfer]:
+        """
+        Return the recorded transfers of a target.
+
+        Args:
+            target: Name of the backup target
+            snapshot: Only return the transfers of this snapshot
+
+        Returns:
+            The transfers, oldest first.
+        """
+        query = (
+            "SELECT target, snapshot, subvolume, parent, bytes, duration, sent_at FROM transfers"
+            " WHERE target = ?"
+        )
+        params: tuple[str, ...] = (target,)
+        if snapshot is not None:
+            query += " AND snapshot = ?"
+            params += (snapshot,)
+
+        with self._lock:
+            return [
+                CatalogTransfer(*row) for row in self._db.execute(query + " ORDER BY id", params)
+            ]
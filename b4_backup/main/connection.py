@@ -1,21 +1,62 @@
 from __future__ import annotations
 
 import contextlib
+import errno
+import glob
 import logging
 import re
+import select
 import shlex
 import subprocess
+import threading
+import uuid
 from abc import ABCMeta, abstractmethod
+from collections.abc import Generator, Hashable, Sequence
 from dataclasses import asdict, dataclass
-from pathlib import PurePath
-
-import paramiko
+from pathlib import Path, PurePath
+from stat import S_ISDIR
+from typing import TYPE_CHECKING
 
 from b4_backup import exceptions
+from b4_backup.main.agent import RemoteAgent
+
+if TYPE_CHECKING:  # pragma: no cover
+    # paramiko is slow to import. It's imported when the first SSH connection is opened
+    import paramiko
 
 log = logging.getLogger("b4_backup.connection")
 
 
+@dataclass(frozen=True)
+class MountPoint:
+    """
+    Describes a mounted filesystem on a host.
+
+    Args:
+        path: Location the filesystem is mounted at
+        fs_type: Filesystem type. eg. btrfs
+        source: Mount source. eg. /dev/sda1
+    """
+
+    path: PurePath
+    fs_type: str
+    source: str
+
+
+@dataclass(frozen=True)
+class PathStat:
+    """
+    Describes the type of a path on a host.
+
+    Args:
+        exists: True if the path exists
+        is_dir: True if the path is a directory
+    """
+
+    exists: bool
+    is_dir: bool
+
+
 @dataclass
 class URL:
     """
@@ -83,6 +124,8 @@ class URL:
 class Connection(metaclass=ABCMeta):
     """An abstract connection wrapper to execute commands on machines."""
 
+    _mountinfo_escape_pattern = re.compile(r"\\([0-7]{3})")
+
     def __init__(self, location: PurePath) -> None:
         """
         Args:
@@ -92,6 +135,7 @@ class Connection(metaclass=ABCMeta):
         self.keep_open = False
 
         self.connected: bool = False
+        self._mount_points: list[MountPoint] | None = None
 
     @classmethod
     def from_url(cls, url: str | None) -> Connection | contextlib.nullcontext:
@@ -125,6 +169,51 @@ class Connection(metaclass=ABCMeta):
 
         raise exceptions.UnknownProtocolError
 
+    def mount_points(self) -> list[MountPoint]:
+        """
+        Read the mount table of the host.
+        The table is read once and cached until invalidate_mount_points is called.
+
+        Returns:
+            All mounted filesystems of the host.
+        """
+        if self._mount_points is None:
+            self._mount_points = self._parse_mountinfo(
+                self.run_process(["cat", "/proc/self/mountinfo"])
+            )
+
+        return self._mount_points
+
+    def invalidate_mount_points(self) -> None:
+        """Drop the cached mount table. It will be read again on the next access."""
+        self._mount_points = None
+
+    @classmethod
+    def _parse_mountinfo(cls, mountinfo: str) -> list[MountPoint]:
+        # Format looking like this per line (see proc(5)):
+        # 36 35 98:0 /mnt1 /mnt/parent rw,noatime master:1 - ext3 /dev/root rw,errors=continue
+        mount_points: list[MountPoint] = []
+        for line in mountinfo.split("\n"):
+            if " - " not in line:
+                continue
+
+            mount_fields, fs_fields = line.split(" - ", maxsplit=1)
+            fs_type, source = (fs_fields.split() + [""])[:2]
+
+            mount_points.append(
+                MountPoint(
+                    path=PurePath(cls._unescape_mountinfo(mount_fields.split()[4])),
+                    fs_type=fs_type,
+                    source=cls._unescape_mountinfo(source),
+                )
+            )
+
+        return mount_points
+
+    @classmethod
+    def _unescape_mountinfo(cls, value: str) -> str:
+        return cls._mountinfo_escape_pattern.sub(lambda x: chr(int(x.group(1), 8)), value)
+
     @abstractmethod
     def run_process(self, command: list[str]) -> str:
         """
@@ -136,6 +225,215 @@ class Connection(metaclass=ABCMeta):
             stdout of process.
         """
 
+    def run_processes(self, commands: Sequence[list[str]]) -> list[str]:
+        """
+        Run multiple processes one after another and stop at the first failure.
+        Uses a single round trip, if the remote agent is available.
+
+        Args:
+            commands: List of commands
+
+        Returns:
+            stdout of all processes.
+        """
+        agent = self.remote_agent()
+        if not agent:
+            return [self.run_process(x) for x in commands]
+
+        results = agent.request([("run_all", commands)])[0]
+        for command, result in zip(commands, results, strict=False):
+            if result["returncode"]:
+                raise exceptions.FailedProcessError(command, result["stdout"], result["stderr"])
+
+        return [x["stdout"] for x in results]
+
+    def remote_agent(self) -> RemoteAgent | None:
+        """
+        Returns:
+            The helper agent running on the host, if it's available.
+        """
+        return None
+
+    def stat(self, paths: Sequence[PurePath]) -> list[PathStat]:
+        """
+        Return the type of multiple paths. Uses a single round trip, if the remote agent is available.
+
+        Args:
+            paths: Paths to check
+
+        Returns:
+            The type of each path in the same order.
+        """
+        agent = self.remote_agent()
+        if agent:
+            return [PathStat(**x) for x in agent.request([("stat", str(x)) for x in paths])]
+
+        result = []
+        for path in paths:
+            exists = self.exists(path)
+            result.append(PathStat(exists=exists, is_dir=exists and self.is_dir(path)))
+
+        return result
+
+    def exists(self, path: PurePath) -> bool:
+        """
+        Check if a path exists.
+
+        Args:
+            path: Path to check
+
+        Returns:
+            True if the location exists.
+        """
+        if self.remote_agent():
+            return self.stat([path])[0].exists
+
+        try:
+            result = self.run_process(["ls", "-d", str(path)])
+        except exceptions.FailedProcessError as e:
+            if "No such file or directory" in e.stderr:
+                return False
+
+            raise
+
+        return result.strip() != ""
+
+    def is_dir(self, path: PurePath) -> bool:
+        """
+        Check if a path is a directory.
+
+        Args:
+            path: Path to check
+
+        Returns:
+            True if the location is a directory.
+        """
+        if self.remote_agent():
+            return self.stat([path])[0].is_dir
+
+        result = self.run_process(["ls", "-dl", str(path)])
+        return result.strip()[0] == "d"
+
+    def iterdir(self, path: PurePath) -> list[str]:
+        """
+        List the content of a directory.
+
+        Args:
+            path: Directory to list
+
+        Returns:
+            The sorted names of all items in the directory.
+        """
+        agent = self.remote_agent()
+        if agent:
+            return agent.request([("iterdir", str(path))])[0]
+
+        result = sorted(self.run_process(["ls", str(path)]).strip().split("\n"))
+        if result == [""]:
+            return []
+
+        return result
+
+    def mkdir(self, path: PurePath, parents: bool = False) -> None:
+        """
+        Create a directory.
+
+        Args:
+            path: Directory to create
+            parents: Also creates parent directories and doesn't fail if path exist.
+        """
+        agent = self.remote_agent()
+        if agent:
+            agent.request([("mkdir", str(path), parents)])
+            return
+
+        self.run_process(["mkdir", str(path)] + ["-p"] * parents)
+
+    def rmdir(self, path: PurePath) -> None:
+        """
+        Remove an empty directory. Doesn't fail if the directory doesn't exist.
+
+        Args:
+            path: Directory to remove
+        """
+        self.rmdirs([path])
+
+    def rmdirs(self, paths: Sequence[PurePath]) -> None:
+        """
+        Remove multiple empty directories in one go. Doesn't fail if a directory doesn't exist.
+
+        Args:
+            paths: Directories to remove
+        """
+        if not paths:
+            return
+
+        agent = self.remote_agent()
+        if agent:
+            agent.request([("rmdir", str(x)) for x in paths])
+            return
+
+        try:
+            self.run_process(["rmdir", *[str(x) for x in paths]])
+        except exceptions.FailedProcessError as e:
+            if any("No such file or directory" not in x for x in e.stderr.strip().split("\n")):
+                raise
+
+    def rename(self, path: PurePath, target: PurePath) -> None:
+        """
+        Rename/Move a path to the target location.
+
+        Args:
+            path: Path to move
+            target: The target location to move the object to.
+        """
+        agent = self.remote_agent()
+        if agent:
+            agent.request([("rename", str(path), str(target))])
+            return
+
+        self.run_process(["mv", str(path), str(target)])
+
+    def prune_empty_dirs(self, path: PurePath, exclude: Sequence[PurePath]) -> list[PurePath]:
+        """
+        Remove all empty directories below and including path in one go.
+        Directories which become empty after removing their children are removed as well.
+
+        Args:
+            path: Directory to prune
+            exclude: Directories to keep, even if they are empty, e.g. subvolumes
+
+        Returns:
+            The removed directories, children first.
+        """
+        agent = self.remote_agent()
+        if agent:
+            removed = agent.request([("prune_empty_dirs", str(path), [str(x) for x in exclude])])[0]
+            return [PurePath(x) for x in removed]
+
+        # -xdev doesn't descend into other subvolumes, but still checks them, so they need to be excluded
+        exclude_params = [
+            param
+            for x in exclude
+            for param in ["!", "-path", glob.escape(str(x).replace("\\", "\\\\"))]
+        ]
+        result = self.run_process(
+            [
+                "find",
+                str(path),
+                "-xdev",
+                "-depth",
+                "-type",
+                "d",
+                "-empty",
+                *exclude_params,
+                "-delete",
+                "-print0",
+            ]
+        )
+
+        return [PurePath(x) for x in result.split("\0") if x]
+
     @abstractmethod
     def open(self) -> Connection:
         """
@@ -149,6 +447,12 @@ class Connection(metaclass=ABCMeta):
     def close(self) -> None:
         """Close the connection."""
 
+    def release(self) -> None:  # noqa: B027 (Optional hook)
+        """
+        Release the resources held by this connection object, but keep the connection to the host open.
+        Used instead of close, if keep_open is set.
+        """
+
     @property
     @abstractmethod
     def exec_prefix(self) -> str:
@@ -157,18 +461,64 @@ class Connection(metaclass=ABCMeta):
             Prefix to run commands on the target using local commands.
         """
 
+    @property
+    @abstractmethod
+    def host_id(self) -> tuple[Hashable, ...]:
+        """
+        Returns:
+            A key identifying the host. Connections to the same host share the same key.
+        """
+
+    def exec_prefix_from(self, origin: Connection) -> str:
+        """
+        Return the prefix to run commands on this host, if started from another host.
+
+        Args:
+            origin: Connection to the host the command is started on
+
+        Returns:
+            Prefix to run commands on the target from the origin host.
+        """
+        if origin.host_id == self.host_id:
+            return ""
+
+        return self.exec_prefix
+
+    def command_from(self, origin: Connection, command: str) -> str:
+        """
+        Return a shell command line to run a command on this host, if started from another host.
+
+        Args:
+            origin: Connection to the host the command is started on
+            command: Shell command line. Can contain pipes
+
+        Returns:
+            Shell command line to run on the origin host.
+        """
+        exec_prefix = self.exec_prefix_from(origin)
+        if not exec_prefix:
+            return command
+
+        return f"{exec_prefix}{shlex.quote(command)}"
+
     def __enter__(self) -> Connection:
         """Entrypoint in a "with" statement."""
         return self.open()
 
     def __exit__(self, *args, **kwargs) -> None:
         """Endpoint in a "with" statement."""
-        if not self.keep_open:
+        if self.keep_open:
+            self.release()
+        else:
             self.close()
 
 
 class LocalConnection(Connection):
-    """A connection wrapper to execute commands on the local machine."""
+    """
+    A connection wrapper to execute commands on the local machine.
+
+    Path operations are done with native os calls instead of spawning processes.
+    """
 
     def __init__(self, location: PurePath) -> None:
         """
@@ -204,6 +554,107 @@ class LocalConnection(Connection):
 
         return stdout
 
+    def stat(self, paths: Sequence[PurePath]) -> list[PathStat]:
+        """
+        Return the type of multiple paths.
+
+        Args:
+            paths: Paths to check
+
+        Returns:
+            The type of each path in the same order.
+        """
+        return [self._stat(x) for x in paths]
+
+    def exists(self, path: PurePath) -> bool:
+        """
+        Check if a path exists.
+
+        Args:
+            path: Path to check
+
+        Returns:
+            True if the location exists.
+        """
+        return self._stat(path).exists
+
+    def is_dir(self, path: PurePath) -> bool:
+        """
+        Check if a path is a directory.
+
+        Args:
+            path: Path to check
+
+        Returns:
+            True if the location is a directory.
+        """
+        return self._stat(path).is_dir
+
+    def iterdir(self, path: PurePath) -> list[str]:
+        """
+        List the content of a directory.
+
+        Args:
+            path: Directory to list
+
+        Returns:
+            The sorted names of all items in the directory.
+        """
+        with _path_operation("iterdir", path):
+            return sorted(x.name for x in Path(path).iterdir())
+
+    def mkdir(self, path: PurePath, parents: bool = False) -> None:
+        """
+        Create a directory.
+
+        Args:
+            path: Directory to create
+            parents: Also creates parent directories and doesn't fail if path exist.
+        """
+        with _path_operation("mkdir", path):
+            Path(path).mkdir(parents=parents, exist_ok=parents)
+
+    def rmdirs(self, paths: Sequence[PurePath]) -> None:
+        """
+        Remove multiple empty directories. Doesn't fail if a directory doesn't exist.
+
+        Args:
+            paths: Directories to remove
+        """
+        for path in paths:
+            with _path_operation("rmdir", path), contextlib.suppress(FileNotFoundError):
+                Path(path).rmdir()
+
+    def rename(self, path: PurePath, target: PurePath) -> None:
+        """
+        Rename/Move a path to the target location.
+
+        Args:
+            path: Path to move
+            target: The target location to move the object to.
+        """
+        try:
+            Path(path).rename(target)
+        except OSError as exc:
+            if exc.errno != errno.EXDEV:
+                raise exceptions.PathOperationError(
+                    f"rename of {path} to {target} failed: {exc}"
+                ) from exc
+
+            # Different filesystems or btrfs subvolumes, so mv needs to copy
+            self.run_process(["mv", str(path), str(target)])
+
+    @staticmethod
+    def _stat(path: PurePath) -> PathStat:
+        try:
+            mode = Path(path).lstat().st_mode
+        except FileNotFoundError:
+            return PathStat(exists=False, is_dir=False)
+        except OSError as exc:
+            raise exceptions.PathOperationError(f"stat of {path} failed: {exc}") from exc
+
+        return PathStat(exists=True, is_dir=S_ISDIR(mode))
+
     def open(self) -> Connection:
         """
         Open the connection to the target host.
@@ -230,11 +681,152 @@ class LocalConnection(Connection):
         """
         return ""
 
+    @property
+    def host_id(self) -> tuple[Hashable, ...]:
+        """
+        Returns:
+            A key identifying the host. Connections to the same host share the same key.
+        """
+        return ("local",)
+
+    def exec_prefix_from(self, origin: Connection) -> str:
+        """
+        Return the prefix to run commands on this host, if started from another host.
+
+        Args:
+            origin: Connection to the host the command is started on
+
+        Returns:
+            Prefix to run commands on the target from the origin host.
+        """
+        if origin.host_id != self.host_id:
+            raise exceptions.UnreachableHostError(
+                f"The local location {self.location} can't be reached from {origin.exec_prefix}"
+            )
+
+        return ""
+
+
+@contextlib.contextmanager
+def _path_operation(operation: str, path: PurePath) -> Generator[None, None, None]:
+    try:
+        yield
+    except OSError as exc:
+        raise exceptions.PathOperationError(f"{operation} of {path} failed: {exc}") from exc
+
+
+class ShellSession:
+    """
+    A long-lived shell on a remote host, which runs commands one after another.
+
+    Every command is framed by a unique marker, which also carries the exit code.
+    This way a command costs a single round trip without opening a new SSH channel.
+    """
+
+    buffer_size = 32768
+
+    def __init__(self, channel: paramiko.Channel) -> None:
+        """
+        Use ShellSession.open to start a new session.
+
+        Args:
+            channel: SSH channel running a POSIX shell
+        """
+        self._channel = channel
+        self._marker = f"b4-{uuid.uuid4().hex}"
+        self._counter = 0
+
+    @classmethod
+    def open(cls, ssh_client: paramiko.SSHClient) -> ShellSession:
+        """
+        Start a new shell session.
+
+        Args:
+            ssh_client: Connected SSH client
+
+        Returns:
+            ShellSession instance
+        """
+        transport = ssh_client.get_transport()
+        assert transport, "Not connected"
+
+        channel = transport.open_session()
+        channel.exec_command("sh")
+
+        return cls(channel)
+
+    def run(self, command: str) -> tuple[int, str, str]:
+        """
+        Run a command in the shell and wait for it to finish.
+
+        Args:
+            command: Shell command line
+
+        Raises:
+            SessionClosedError: If the shell terminated before the command finished.
+
+        Returns:
+            exit code, stdout and stderr of the command.
+        """
+        self._counter += 1
+        marker = f"{self._marker}-{self._counter}".encode()
+        stdout_marker = b"\n" + marker + b" "
+        stderr_marker = b"\n" + marker + b"\n"
+
+        # stdin is redirected, so the command can't consume the following commands
+        self._channel.sendall(
+            f"{{ {command}\n}} </dev/null; printf '\\n%s %d\\n' {marker.decode()} \"$?\";"
+            f" printf '\\n%s\\n' {marker.decode()} >&2\n".encode()
+        )
+
+        stdout, stderr = b"", b""
+        exit_code = None
+        while exit_code is None or not stderr.endswith(stderr_marker):
+            if self._channel.recv_ready():
+                stdout += self._channel.recv(self.buffer_size)
+                stdout, exit_code = self._split_exit_code(stdout, stdout_marker, exit_code)
+            elif self._channel.recv_stderr_ready():
+                stderr += self._channel.recv_stderr(self.buffer_size)
+            elif self._channel.exit_status_ready():
+                raise exceptions.SessionClosedError("The remote shell session terminated")
+            else:
+                select.select([self._channel], [], [], 1.0)
+
+        return exit_code, stdout.decode(), stderr.removesuffix(stderr_marker).decode()
+
+    @staticmethod
+    def _split_exit_code(
+        stdout: bytes, stdout_marker: bytes, exit_code: int | None
+    ) -> tuple[bytes, int | None]:
+        if exit_code is not None or not stdout.endswith(b"\n"):
+            return stdout, exit_code
+
+        head, sep, tail = stdout.rpartition(stdout_marker)
+        if not sep or not tail[:-1].isdigit():
+            return stdout, exit_code
+
+        return head, int(tail[:-1])
+
+    @property
+    def closed(self) -> bool:
+        """
+        Returns:
+            True if the shell terminated.
+        """
+        return self._channel.closed or self._channel.exit_status_ready()
+
+    def close(self) -> None:
+        """Terminate the shell."""
+        self._channel.close()
+
 
 class SSHConnection(Connection):
     """A connection wrapper to execute commands on remote machines via SSH."""
 
     ssh_client_pool: dict[tuple[str, int, str], paramiko.SSHClient] = {}
+    # Number of open connection objects using each pooled client
+    _ssh_client_users: dict[tuple[str, int, str], int] = {}
+    _ssh_client_pool_lock = threading.Lock()
 
     def __init__(
         self,
@@ -258,12 +850,23 @@ class SSHConnection(Connection):
         self.port = port
         self.user = user
         self.password = password
+        self.persistent_session = False
+        self.use_remote_agent = False
         self._ssh_client: paramiko.SSHClient | None
+        self._pool_user = False
+        self._session: ShellSession | None = None
+        self._agent: RemoteAgent | None = None
+        self._run_lock = threading.Lock()
+        self._agent_lock = threading.Lock()
 
     def run_process(self, command: list[str]) -> str:
         """
         Run a process without interaction and return the result.
 
+        If use_remote_agent is set, the process is started by the remote agent.
+        If persistent_session is set, the process is started in a long-lived shell.
+        If neither is available, a new SSH channel per process is used instead.
+
         Args:
             command: List of parameters
         Returns:
@@ -271,6 +874,25 @@ class SSHConnection(Connection):
         """
         assert self._ssh_client, "Not connected"
 
+        agent = self.remote_agent()
+        if agent:
+            result = agent.request([("run", command)])[0]
+            if result["returncode"]:
+                raise exceptions.FailedProcessError(command, result["stdout"], result["stderr"])
+
+            return result["stdout"]
+
+        # The shell session runs one command at a time, e.g. for parallel subvolume sends
+        with self._run_lock:
+            session = self._shell_session() if self.persistent_session else None
+            if session:
+                log.debug("Start SSH session process:\n%s", command)
+                exit_code, stdout_str, stderr_str = session.run(shlex.join(command))
+                if exit_code:
+                    raise exceptions.FailedProcessError(command, stdout_str, stderr_str)
+
+                return stdout_str
+
         log.debug("Start SSH process:\n%s", command)
 
         _stdin, stdout, stderr = self._ssh_client.exec_command(shlex.join(command))
@@ -282,6 +904,81 @@ class SSHConnection(Connection):
 
         return stdout_str
 
+    def remote_agent(self) -> RemoteAgent | None:
+        """
+        Start the remote agent on first use, if use_remote_agent is set.
+
+        Returns:
+            The helper agent running on the host, if it's available.
+        """
+        assert self._ssh_client, "Not connected"
+
+        if not self.use_remote_agent:
+            return None
+
+        # Only one agent is started, even if several threads use the connection
+        with self._agent_lock:
+            if self._agent is not None and self._agent.closed:
+                log.debug("Remote agent on %s terminated. Restarting", self.host)
+                self._agent = None
+
+            if self._agent is None:
+                log.debug("Starting remote agent on %s", self.host)
+                try:
+                    self._agent = RemoteAgent.start(self._ssh_client)
+                except exceptions.AgentUnavailableError as exc:
+                    log.warning("Remote agent unavailable on %s. Falling back: %s", self.host, exc)
+                    self.use_remote_agent = False
+
+            return self._agent
+
+    def _shell_session(self) -> ShellSession | None:
+        assert self._ssh_client, "Not connected"
+
+        if self._session is not None and self._session.closed:
+            log.debug("Shell session to %s terminated. Reopening", self.host)
+            self._close_session()
+
+        if self._session is None:
+            log.debug("Opening shell session to %s", self.host)
+            import paramiko  # noqa: PLC0415
+
+            try:
+                self._session = ShellSession.open(self._ssh_client)
+            except paramiko.SSHException as exc:
+                log.warning("Unable to open a shell session to %s: %s", self.host, exc)
+                self.persistent_session = False
+
+        return self._session
+
+    def _close_session(self) -> None:
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def _close_agent(self) -> None:
+        with self._agent_lock:
+            if self._agent is not None:
+                self._agent.close()
+                self._agent = None
+
+    def release(self) -> None:
+        """
+        Close the shell session and remote agent of this connection object, but keep the pooled SSH client open.
+        Each of them holds an SSH channel, which counts against MaxSessions of the server.
+        """
+        with self._run_lock:
+            self._close_session()
+
+        self._close_agent()
+
+        with SSHConnection._ssh_client_pool_lock:
+            if self._pool_user:
+                self._pool_user = False
+                users = SSHConnection._ssh_client_users.pop(self._pool_key, 0) - 1
+                if users > 0:
+                    SSHConnection._ssh_client_users[self._pool_key] = users
+
     def open(self) -> SSHConnection:
         """
         Open the connection to the target host.
@@ -289,20 +986,28 @@ class SSHConnection(Connection):
         Returns:
             Itself
         """
-        ssh_client = SSHConnection.ssh_client_pool.get((self.host, self.port, self.user), None)
-        if not ssh_client:
-            ssh_client = paramiko.SSHClient()
-            ssh_client.load_system_host_keys()
-            ssh_client.set_missing_host_key_policy(paramiko.RejectPolicy())
-
-            log.info("Opening ssh connection to %s@%s:%s", self.user, self.host, self.port)
-            ssh_client.connect(
-                self.host,
-                username=self.user,
-                password=self.password,
-                port=self.port,
+        import paramiko  # noqa: PLC0415
+
+        with SSHConnection._ssh_client_pool_lock:
+            ssh_client = SSHConnection.ssh_client_pool.get(self._pool_key, None)
+            if not ssh_client:
+                ssh_client = paramiko.SSHClient()
+                ssh_client.load_system_host_keys()
+                ssh_client.set_missing_host_key_policy(paramiko.RejectPolicy())
+
+                log.info("Opening ssh connection to %s@%s:%s", self.user, self.host, self.port)
+                ssh_client.connect(
+                    self.host,
+                    username=self.user,
+                    password=self.password,
+                    port=self.port,
+                )
+                SSHConnection.ssh_client_pool[self._pool_key] = ssh_client
+
+            SSHConnection._ssh_client_users[self._pool_key] = (
+                SSHConnection._ssh_client_users.get(self._pool_key, 0) + 1
             )
-            SSHConnection.ssh_client_pool[(self.host, self.port, self.user)] = ssh_client
+            self._pool_user = True
 
         self.connected = True
         self._ssh_client = ssh_client
@@ -310,16 +1015,38 @@ class SSHConnection(Connection):
         return self
 
     def close(self) -> None:
-        """Close the connection."""
+        """Close the connection. The pooled SSH client stays open, while other connections use it."""
         assert self.connected, "Connection already closed"
         assert self._ssh_client
 
-        log.info("Closing ssh connection to %s %s", self.host, self.location)
-        self._ssh_client.close()
-        del SSHConnection.ssh_client_pool[(self.host, self.port, self.user)]
+        self.release()
+
+        with SSHConnection._ssh_client_pool_lock:
+            if self._pool_key in SSHConnection._ssh_client_users:
+                log.debug("SSH connection to %s is still in use", self.host)
+            elif SSHConnection.ssh_client_pool.get(self._pool_key) is self._ssh_client:
+                log.info("Closing ssh connection to %s %s", self.host, self.location)
+                self._ssh_client.close()
+                del SSHConnection.ssh_client_pool[self._pool_key]
+
         self.connected = False
         self._ssh_client = None
 
+    @property
+    def _pool_key(self) -> tuple[str, int, str]:
+        return (self.host, self.port, self.user)
+
+    @classmethod
+    def close_pool(cls) -> None:
+        """Close all pooled ssh connections, including the ones marked with keep_open."""
+        with cls._ssh_client_pool_lock:
+            for (host, port, user), ssh_client in cls.ssh_client_pool.items():
+                log.info("Closing ssh connection to %s@%s:%s", user, host, port)
+                ssh_client.close()
+
+            cls.ssh_client_pool.clear()
+            cls._ssh_client_users.clear()
+
     @property
     def exec_prefix(self) -> str:
         """
@@ -327,3 +1054,11 @@ class SSHConnection(Connection):
             Prefix to run commands on the target using local commands.
         """
         return f"ssh -p {self.port} {self.user}@{self.host} "
+
+    @property
+    def host_id(self) -> tuple[Hashable, ...]:
+        """
+        Returns:
+            A key identifying the host. Connections to the same host share the same key.
+        """
+        return ("ssh", self.host, self.port, self.user)
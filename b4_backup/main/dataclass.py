@@ -4,8 +4,7 @@ from os import PathLike
 from pathlib import PurePath, PurePosixPath
 from typing import TYPE_CHECKING
 
-from b4_backup import exceptions
-from b4_backup.config_schema import DEFAULT, BackupTarget
+from b4_backup.config_schema import DEFAULT, BackupTarget, TargetIndex
 
 if TYPE_CHECKING:  # pragma: no cover
     from b4_backup.main.connection import Connection
@@ -28,26 +27,14 @@ class BackupHostPath(PurePosixPath):
 
     def rmdir(self) -> None:
         """Removes the given empty directory."""
-        try:
-            self.connection.run_process(["rmdir", str(self)])
-        except exceptions.FailedProcessError as e:
-            if "No such file or directory" not in e.stderr:
-                raise
+        self.connection.rmdir(self)
 
     def exists(self) -> bool:
         """
         Returns:
             True if the location exists.
         """
-        try:
-            result = self.connection.run_process(["ls", "-d", str(self)])
-        except exceptions.FailedProcessError as e:
-            if "No such file or directory" in e.stderr:
-                return False
-
-            raise
-
-        return result.strip() != ""
+        return self.connection.exists(self)
 
     def mkdir(self, parents: bool = False) -> None:
         """
@@ -56,7 +43,7 @@ class BackupHostPath(PurePosixPath):
         Args:
             parents: Also creates parent directories and doesn't fail if path exist.
         """
-        self.connection.run_process(["mkdir", str(self)] + ["-p"] * parents)
+        self.connection.mkdir(self, parents=parents)
 
     def rename(self, target: PurePath) -> None:
         """
@@ -65,24 +52,18 @@ class BackupHostPath(PurePosixPath):
         Args:
             target: The target location to move the object to.
         """
-        self.connection.run_process(["mv", str(self), str(target)])
+        self.connection.rename(self, target)
 
     def iterdir(self) -> list["BackupHostPath"]:
         """
         Returns:
             A list of Paths containing all items in the current directory.
         """
-        result = sorted(self.connection.run_process(["ls", str(self)]).strip().split("\n"))
-
-        if result == [""]:
-            return []
-
-        return [self / x for x in result]
+        return [self / x for x in self.connection.iterdir(self)]
 
     def is_dir(self) -> bool:
         """Checks if a path is a directory."""
-        result = self.connection.run_process(["ls", "-dl", str(self)])
-        return result.strip()[0] == "d"
+        return self.connection.is_dir(self)
 
 
 @dataclass(frozen=True)
@@ -211,24 +192,17 @@ class ChoiceSelector:
 
     data: list[str] = field(default_factory=list)
 
-    def resolve_target(self, targets: Iterable[str]) -> list[str]:
+    def resolve_target(self, targets: Iterable[str] | TargetIndex) -> list[str]:
         """
         Resolves a target selector and returns a list based on the selection.
 
+        Args:
+            targets: Target names or an index of them
+
         Returns:
-            List of resolved items
+            List of resolved items, in the order of the targets
         """
-        expanded_data: set[str] = set()
-        for item in self.data:
-            if item in targets:
-                expanded_data.add(item)
-                continue
-
-            for target_name in targets:
-                if PurePath(target_name).is_relative_to(item):
-                    expanded_data.add(target_name)
-
-        return list(expanded_data - {"_default"})
+        return TargetIndex.of(targets).select(self.data)
 
     def resolve_retention_name(self, snapshot_names: Iterable[str]) -> list[str]:
         """
@@ -0,0 +1,293 @@
+import logging
+import threading
+from collections.abc import Hashable
+from dataclasses import dataclass, field
+from pathlib import PurePath, PurePosixPath
+from typing import ClassVar
+
+from b4_backup.main.connection import Connection
+from b4_backup.main.dataclass import BackupHostPath
+
+log = logging.getLogger("b4_backup.main")
+
+
+@dataclass(frozen=True)
+class SubvolumeInfo:
+    """
+    Metadata of a btrfs subvolume as reported by btrfs subvolume list.
+
+    Attributes:
+        id: Subvolume ID
+        generation: Generation of the last change inside the subvolume
+        uuid: UUID of the subvolume
+        parent_uuid: UUID of the subvolume this one is a snapshot of
+        received_uuid: UUID of the sent subvolume, if this one was created by btrfs receive
+    """
+
+    id: int
+    generation: int
+    uuid: str | None = None
+    parent_uuid: str | None = None
+    received_uuid: str | None = None
+
+    @classmethod
+    def from_fields(cls, fields: dict[str, str]) -> "SubvolumeInfo":
+        """
+        Create an instance from the key value pairs of a btrfs subvolume list line.
+
+        Args:
+            fields: Key value pairs of the line. "-" means no value
+
+        Returns:
+            SubvolumeInfo instance
+        """
+
+        def _uuid(key: str) -> str | None:
+            value = fields.get(key, "-")
+            return None if value == "-" else value
+
+        return SubvolumeInfo(
+            id=int(fields["ID"]),
+            generation=int(fields["gen"]),
+            uuid=_uuid("uuid"),
+            parent_uuid=_uuid("parent_uuid"),
+            received_uuid=_uuid("received_uuid"),
+        )
+
+
+@dataclass
+class SubvolumeInventory:
+    """
+    A host-wide list of all btrfs subvolumes of a filesystem and their metadata.
+
+    There is only one instance per host and mount point, shared by all targets on it.
+    The list is read once from the host and updated in place, if b4 creates, receives or deletes subvolumes.
+
+    Attributes:
+        mount_point: Mount point of the btrfs filesystem
+    """
+
+    mount_point: PurePosixPath
+    _subvolumes: set[PurePosixPath] | None = field(default=None, repr=False)
+    _sorted_subvolumes: list[PurePosixPath] | None = field(default=None, repr=False)
+    _info: dict[PurePosixPath, SubvolumeInfo] = field(default_factory=dict, repr=False)
+    # received_uuid of subvolumes received by b4, which have no metadata yet
+    _received_uuids: dict[PurePosixPath, str] = field(default_factory=dict, repr=False)
+    _lock: threading.RLock = field(default_factory=threading.RLock, repr=False, compare=False)
+
+    _registry: ClassVar[dict[tuple[Hashable, PurePosixPath], "SubvolumeInventory"]] = {}
+    _registry_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    @classmethod
+    def from_connection(cls, connection: Connection, mount_point: PurePath) -> "SubvolumeInventory":
+        """
+        Return the shared inventory for the host of a connection.
+
+        Args:
+            connection: Connection to the host
+            mount_point: Mount point of the btrfs filesystem
+
+        Returns:
+            SubvolumeInventory instance
+        """
+        mount_point = PurePosixPath(mount_point)
+        key = (connection.host_id, mount_point)
+
+        with cls._registry_lock:
+            if key not in cls._registry:
+                cls._registry[key] = SubvolumeInventory(mount_point=mount_point)
+
+            return cls._registry[key]
+
+    @classmethod
+    def clear_registry(cls) -> None:
+        """Forget all inventories. The next access will read the subvolumes from the hosts again."""
+        cls._registry.clear()
+
+    @property
+    def loaded(self) -> bool:
+        """
+        Returns:
+            True if the subvolumes were already read from the host.
+        """
+        return self._subvolumes is not None
+
+    def subvolumes(self, connection: Connection) -> list[BackupHostPath]:
+        """
+        Return all subvolumes of the filesystem. Reads them from the host on first access.
+
+        Args:
+            connection: Connection to the host. Used for loading and for the returned paths.
+
+        Returns:
+            A sorted list of btrfs subvolumes.
+        """
+        with self._lock:
+            if self._subvolumes is None:
+                self.refresh(connection)
+
+            if self._sorted_subvolumes is None:
+                assert self._subvolumes is not None
+                self._sorted_subvolumes = sorted(self._subvolumes)
+
+            sorted_subvolumes = self._sorted_subvolumes
+
+        return [BackupHostPath(x, connection=connection) for x in sorted_subvolumes]
+
+    def info(self, connection: Connection, path: PurePath) -> SubvolumeInfo | None:
+        """
+        Return the metadata of a subvolume.
+
+        Subvolumes added by b4 have no metadata yet, so they are read from the host again on first access.
+
+        Args:
+            connection: Connection to the host. Used for loading
+            path: Absolute path of the subvolume
+
+        Returns:
+            The metadata or None, if the path is no subvolume or the mount point itself.
+        """
+        path = PurePosixPath(path)
+        with self._lock:
+            if self._subvolumes is None or (
+                path in self._subvolumes and path != self.mount_point and path not in self._info
+            ):
+                self.refresh(connection)
+
+            return self._info.get(path)
+
+    def infos(self, connection: Connection) -> dict[PurePosixPath, SubvolumeInfo]:
+        """
+        Return the metadata of all subvolumes.
+
+        If subvolumes added by b4 have no metadata yet, they are read from the host again.
+
+        Args:
+            connection: Connection to the host. Used for loading
+
+        Returns:
+            The metadata by absolute subvolume path. The mount point itself is not included.
+        """
+        with self._lock:
+            if self._subvolumes is None or len(self._info) < len(self._subvolumes) - 1:
+                self.refresh(connection)
+
+            return dict(self._info)
+
+    def received_uuids(self, connection: Connection) -> set[str]:
+        """
+        Return the received_uuid of all subvolumes created by btrfs receive.
+
+        Unlike infos, subvolumes received by b4 don't cause the list to be read from the host again.
+        Only other subvolumes added by b4 do.
+
+        Args:
+            connection: Connection to the host. Used for loading
+
+        Returns:
+            The received_uuids.
+        """
+        with self._lock:
+            if (
+                self._subvolumes is None
+                or len(self._info) + len(self._received_uuids) < len(self._subvolumes) - 1
+            ):
+                self.refresh(connection)
+
+            return {x.received_uuid for x in self._info.values() if x.received_uuid} | set(
+                self._received_uuids.values()
+            )
+
+    def refresh(self, connection: Connection) -> None:
+        """
+        Read the subvolumes from the host again.
+
+        Args:
+            connection: Connection to the host
+        """
+        log.debug("Reading subvolumes of %s", self.mount_point)
+        with self._lock:
+            result = connection.run_process(
+                ["btrfs", "subvolume", "list", "-q", "-u", "-R", str(self.mount_point)]
+            )
+            result = result.replace("top level", "top_level")
+
+            # Format looking like this per line:
+            # ID 256 gen 621187 top_level 5 parent_uuid - received_uuid - uuid 0b5a... path my_data
+            info: dict[PurePosixPath, SubvolumeInfo] = {}
+            for line in result.split("\n"):
+                # Iterate two items at a time
+                fields = dict(zip(*[iter(line.split())] * 2))  # type: ignore
+                if "path" in fields:
+                    info[self.mount_point / fields["path"]] = SubvolumeInfo.from_fields(fields)
+
+            self._set(set(info) | {self.mount_point})
+            self._info = info
+
+    def invalidate(self) -> None:
+        """Drop the list of subvolumes. It will be read again on the next access."""
+        self._set(None)
+
+    def add(self, path: PurePath, received_uuid: str | None = None) -> None:
+        """
+        Register a subvolume created by b4.
+
+        Args:
+            path: Absolute path of the new subvolume
+            received_uuid: UUID of the sent subvolume, if the new one was created by btrfs receive
+        """
+        with self._lock:
+            if self._subvolumes is None:
+                return
+
+            self._subvolumes.add(PurePosixPath(path))
+            self._sorted_subvolumes = None
+            if received_uuid:
+                self._received_uuids[PurePosixPath(path)] = received_uuid
+
+    def remove(self, path: PurePath) -> None:
+        """
+        Unregister a subvolume deleted by b4.
+
+        Args:
+            path: Absolute path of the deleted subvolume
+        """
+        with self._lock:
+            if self._subvolumes is None:
+                return
+
+            self._subvolumes.discard(PurePosixPath(path))
+            self._info.pop(PurePosixPath(path), None)
+            self._received_uuids.pop(PurePosixPath(path), None)
+            self._sorted_subvolumes = None
+
+    def rename(self, source: PurePath, target: PurePath) -> None:
+        """
+        Move all subvolumes located at or below source to target.
+
+        Args:
+            source: Old location
+            target: New location
+        """
+        source = PurePosixPath(source)
+        target = PurePosixPath(target)
+
+        with self._lock:
+            if self._subvolumes is None:
+                return
+
+            def _move(path: PurePosixPath) -> PurePosixPath:
+                return target / path.relative_to(source) if path.is_relative_to(source) else path
+
+            info = {_move(k): v for k, v in self._info.items()}
+            received_uuids = {_move(k): v for k, v in self._received_uuids.items()}
+            self._set({_move(x) for x in self._subvolumes})
+            self._info = info
+            self._received_uuids = received_uuids
+
+    def _set(self, subvolumes: set[PurePosixPath] | None) -> None:
+        with self._lock:
+            self._subvolumes = subvolumes
+            self._sorted_subvolumes = None
+            self._info = {}
+            self._received_uuids = {}
@@ -0,0 +1,143 @@
+"""
+Helper agent executed on remote hosts.
+
+The source of this module is streamed to the remote host and executed by the python interpreter there.
+It must only use the standard library and stay compatible with old python3 versions.
+
+The agent answers one JSON request per line with one JSON response per line:
+
+- Request: {"ops": [["stat", "/opt"], ["run", ["btrfs", "subvolume", "list", "/opt"]]]}
+- Response: {"results": [{"value": {"exists": true, "is_dir": true}}, {"error": "OSError", "message": "..."}]}
+"""
+
+import contextlib
+import json
+import stat
+import subprocess
+import sys
+from pathlib import Path
+
+VERSION = 1
+
+
+def _stat(path):
+    try:
+        mode = Path(path).lstat().st_mode
+    except FileNotFoundError:
+        return {"exists": False, "is_dir": False}
+
+    return {"exists": True, "is_dir": stat.S_ISDIR(mode)}
+
+
+def _iterdir(path):
+    return sorted(x.name for x in Path(path).iterdir())
+
+
+def _mkdir(path, parents=False):
+    Path(path).mkdir(parents=parents, exist_ok=parents)
+
+
+def _rmdir(path):
+    with contextlib.suppress(FileNotFoundError):
+        Path(path).rmdir()
+
+
+def _prune_empty_dirs(path, exclude):
+    exclude = {Path(x) for x in exclude}
+    removed = []
+
+    def prune(directory, device):
+        empty = True
+        for entry in directory.iterdir():
+            if (
+                entry in exclude
+                or not entry.is_dir()
+                or entry.is_symlink()
+                or entry.lstat().st_dev != device
+                or not prune(entry, device)
+            ):
+                empty = False
+
+        if empty:
+            directory.rmdir()
+            removed.append(str(directory))
+
+        return empty
+
+    path = Path(path)
+    if path not in exclude:
+        prune(path, path.lstat().st_dev)
+
+    return removed
+
+
+def _rename(path, target):
+    Path(path).rename(target)
+
+
+def _run(command):
+    process = subprocess.Popen(  # noqa: S603
+        command,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    stdout, stderr = process.communicate()
+    return {
+        "returncode": process.returncode,
+        "stdout": stdout.decode(errors="replace"),
+        "stderr": stderr.decode(errors="replace"),
+    }
+
+
+def _run_all(commands):
+    results = []
+    for command in commands:
+        results.append(_run(command))
+        if results[-1]["returncode"]:
+            break
+
+    return results
+
+
+OPERATIONS = {
+    "stat": _stat,
+    "iterdir": _iterdir,
+    "mkdir": _mkdir,
+    "rmdir": _rmdir,
+    "rename": _rename,
+    "prune_empty_dirs": _prune_empty_dirs,
+    "run": _run,
+    "run_all": _run_all,
+}
+
+
+def _execute(operation):
+    try:
+        return {"value": OPERATIONS[operation[0]](*operation[1:])}
+    except Exception as exc:  # noqa: BLE001
+        return {"error": type(exc).__name__, "message": str(exc)}
+
+
+def _write(stdout, message):
+    stdout.write(json.dumps(message).encode() + b"\n")
+    stdout.flush()
+
+
+def main(stdin, stdout):
+    """
+    Answer requests until stdin is closed.
+
+    Args:
+        stdin: Binary stream to read the requests from
+        stdout: Binary stream to write the responses to
+    """
+    _write(stdout, {"agent": "b4", "version": VERSION})
+
+    for line in stdin:
+        request = json.loads(line.decode())
+        _write(stdout, {"results": [_execute(x) for x in request["ops"]]})
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main(sys.stdin.buffer, sys.stdout.buffer)
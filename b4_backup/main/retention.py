@@ -0,0 +1,181 @@
+"""
+Retention calculations on integer unix timestamps.
+
+Snapshot timestamps are handled as seconds since the epoch in a sorted list,
+so a retention rule can jump from one retained snapshot to the next using a binary search
+instead of comparing every snapshot with arrow objects.
+"""
+
+import bisect
+import calendar
+import re
+import time
+from collections.abc import Sequence
+from datetime import datetime
+
+import arrow
+
+from b4_backup import exceptions
+
+_TIMEBOX_PATTERN = re.compile(r"^(?:([0-9]+)(second|minute|hour|day|week|month|year)?s?)$")
+_TIMESTAMP_PATTERN = re.compile(r"^(\d{4})-(\d{2})-(\d{2})-(\d{2})-(\d{2})-(\d{2})$")
+_TIMESTAMP_FORMAT = "%Y-%m-%d-%H-%M-%S"
+
+# Length of all units with a fixed length in seconds
+UNIT_SECONDS = {
+    "seconds": 1,
+    "minutes": 60,
+    "hours": 60 * 60,
+    "days": 24 * 60 * 60,
+    "weeks": 7 * 24 * 60 * 60,
+}
+
+# 1970-01-05 is the first monday after the epoch. Weeks start on mondays.
+_WEEK_OFFSET = 4 * UNIT_SECONDS["days"]
+
+
+def parse_timebox(timebox: str, is_interval: bool = False) -> tuple[int, str | None]:
+    """
+    Parse the interval or the duration of a retention rule.
+
+    Args:
+        timebox: Interval like 1day or all. Duration like 1month, forever or a number of snapshots
+        is_interval: Parse an interval instead of a duration
+
+    Raises:
+        InvalidRetentionRuleError: If the timebox is malformed
+
+    Returns:
+        Number of units and the unit, e.g. (1, "days"). The unit is None for a number of snapshots.
+    """
+    if is_interval and timebox == "all":
+        return 0, "all"
+
+    if not is_interval and timebox == "forever":
+        return 0, "forever"
+
+    match = _TIMEBOX_PATTERN.match(timebox)
+    if not match:
+        raise exceptions.InvalidRetentionRuleError(
+            f"Size pattern ({timebox}, interval:{is_interval}) is invalid"
+        )
+
+    size = match.group(1) or 0
+    magnitude = match.group(2)
+
+    if magnitude is not None:
+        magnitude += "s"
+
+    return int(size), magnitude
+
+
+def parse_timestamp(timestamp: str) -> int:
+    """
+    Parse the timestamp of a snapshot name.
+
+    Args:
+        timestamp: Timestamp in the format YYYY-MM-DD-HH-mm-ss, interpreted as UTC
+
+    Raises:
+        ValueError: If the timestamp is malformed
+
+    Returns:
+        Seconds since the epoch.
+    """
+    match = _TIMESTAMP_PATTERN.match(timestamp)
+    if not match:
+        raise ValueError(f"Invalid snapshot timestamp: {timestamp}")
+
+    # The datetime constructor rejects impossible dates like february 30th
+    return calendar.timegm(datetime(*map(int, match.groups())).timetuple())  # noqa: DTZ001
+
+
+def format_timestamp(timestamp: int) -> str:
+    """
+    Format a timestamp for a snapshot name.
+
+    Args:
+        timestamp: Seconds since the epoch
+
+    Returns:
+        Timestamp in the format YYYY-MM-DD-HH-mm-ss.
+    """
+    return time.strftime(_TIMESTAMP_FORMAT, time.gmtime(timestamp))
+
+
+def cutoff_timestamp(now: arrow.Arrow, size: int, magnitude: str) -> int:
+    """
+    Calculate the oldest timestamp still covered by a duration.
+
+    Args:
+        now: Current time in the target timezone
+        size: Number of units
+        magnitude: Unit of the duration, e.g. days
+
+    Returns:
+        The smallest timestamp, which isn't older than the duration.
+    """
+    cutoff = now.shift(**{magnitude: -size})
+    return calendar.timegm(cutoff.utctimetuple()) + (cutoff.microsecond > 0)
+
+
+def interval_start(timestamp: int, size: int, magnitude: str) -> int:
+    """
+    Calculate the start of the interval ending with the unit containing the timestamp.
+
+    Args:
+        timestamp: Seconds since the epoch
+        size: Number of units in the interval
+        magnitude: Unit of the interval, e.g. days
+
+    Returns:
+        The first timestamp of the interval.
+    """
+    if magnitude in UNIT_SECONDS:
+        unit = UNIT_SECONDS[magnitude]
+        offset = _WEEK_OFFSET if magnitude == "weeks" else 0
+        return ((timestamp - offset) // unit - size + 1) * unit + offset
+
+    date = time.gmtime(timestamp)
+    if magnitude == "months":
+        month = date.tm_year * 12 + date.tm_mon - 1 - size + 1
+        return calendar.timegm((month // 12, month % 12 + 1, 1, 0, 0, 0))
+
+    assert magnitude == "years", f"Unknown interval magnitude: {magnitude}"
+    return calendar.timegm((date.tm_year - size + 1, 1, 1, 0, 0, 0))
+
+
+def retain(
+    timestamps: Sequence[int],
+    interval_size: int,
+    interval_magnitude: str,
+    start: int = 0,
+    limit: int | None = None,
+) -> list[int]:
+    """
+    Select one timestamp per interval, starting with the newest.
+
+    Args:
+        timestamps: Sorted timestamps to select from
+        interval_size: Number of units in an interval
+        interval_magnitude: Unit of the interval or "all" to keep everything
+        start: Index of the oldest timestamp to consider
+        limit: Maximum number of timestamps to select
+
+    Returns:
+        The selected timestamps, newest first.
+    """
+    if limit is None:
+        limit = len(timestamps)
+
+    if interval_magnitude == "all":
+        return list(reversed(timestamps[max(start, len(timestamps) - limit) :]))
+
+    remaining: list[int] = []
+    index = len(timestamps) - 1
+    while index >= start and len(remaining) < limit:
+        remaining.append(timestamps[index])
+        boundary = interval_start(timestamps[index], interval_size, interval_magnitude)
+        index = bisect.bisect_left(timestamps, boundary, start, index) - 1
+
+    return remaining
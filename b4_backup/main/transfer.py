@@ -0,0 +1,182 @@
+import contextlib
+import fcntl
+import logging
+import os
+import subprocess
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import IO
+
+from b4_backup import exceptions
+
+log = logging.getLogger("b4_backup.main")
+
+BUFFER_SIZE = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class TransferStats:
+    """
+    Statistics of a stream transferred between two processes.
+
+    Attributes:
+        size: Number of bytes transferred
+        duration: Seconds from the start of both processes until both exited
+        send_duration: Seconds until the sending process exited
+        receive_duration: Seconds until the receiving process exited
+        send_stderr: stderr of the sending process
+        receive_stderr: stdout and stderr of the receiving process
+    """
+
+    size: int
+    duration: float
+    send_duration: float
+    receive_duration: float
+    send_stderr: str = ""
+    receive_stderr: str = ""
+
+    @property
+    def rate(self) -> float:
+        """
+        Returns:
+            Transfer rate in MB/s.
+        """
+        if self.duration <= 0:
+            return 0.0
+
+        return self.size / self.duration / 1_000_000
+
+    def __str__(self) -> str:
+        """
+        Returns:
+            A human readable summary of the transfer.
+        """
+        return (
+            f"{self.size / 1_000_000:.2f} MB in {self.duration:.2f}s ({self.rate:.2f} MB/s,"
+            f" send {self.send_duration:.2f}s, receive {self.receive_duration:.2f}s)"
+        )
+
+
+def pump(
+    send_command: list[str], receive_command: list[str], buffer_size: int = BUFFER_SIZE
+) -> TransferStats:
+    """
+    Spawn a sending and a receiving process and move the stream between them.
+
+    Args:
+        send_command: Command writing the stream to stdout
+        receive_command: Command reading the stream from stdin
+        buffer_size: Size of the pipe buffers and the chunks moved at once
+
+    Raises:
+        FailedProcessError: If one of the processes failed. The exception contains the command of the failed side.
+
+    Returns:
+        Statistics of the transfer.
+    """
+    log.debug("Start transfer:\n%s\n%s", send_command, receive_command)
+
+    with tempfile.TemporaryFile() as send_log, tempfile.TemporaryFile() as receive_log:
+        start = time.monotonic()
+        with (
+            subprocess.Popen(  # noqa: S603
+                send_command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=send_log
+            ) as sender,
+            subprocess.Popen(  # noqa: S603
+                receive_command, stdin=subprocess.PIPE, stdout=receive_log, stderr=receive_log
+            ) as receiver,
+        ):
+            assert sender.stdout is not None
+            assert receiver.stdin is not None
+
+            for pipe in (sender.stdout, receiver.stdin):
+                _set_pipe_size(pipe, buffer_size)
+
+            size, complete = _copy(sender.stdout.fileno(), receiver.stdin.fileno(), buffer_size)
+            if not complete:
+                # The receiver stopped reading, so the sender would block forever
+                sender.kill()
+
+            sender.stdout.close()
+            sender.wait()
+            send_duration = time.monotonic() - start
+
+            with contextlib.suppress(BrokenPipeError):
+                receiver.stdin.close()
+
+            receiver.wait()
+            receive_duration = time.monotonic() - start
+
+        stats = TransferStats(
+            size=size,
+            duration=max(send_duration, receive_duration),
+            send_duration=send_duration,
+            receive_duration=receive_duration,
+            send_stderr=_read_log(send_log),
+            receive_stderr=_read_log(receive_log),
+        )
+
+    if sender.returncode and complete:
+        raise exceptions.FailedProcessError(send_command, stderr=stats.send_stderr)
+
+    if receiver.returncode:
+        raise exceptions.FailedProcessError(receive_command, stderr=stats.receive_stderr)
+
+    if sender.returncode:
+        raise exceptions.FailedProcessError(send_command, stderr=stats.send_stderr)
+
+    return stats
+
+
+def _copy(src_fd: int, dst_fd: int, buffer_size: int) -> tuple[int, bool]:
+    """
+    Move data between two file descriptors until the source is exhausted.
+
+    Uses os.splice if available, so the data stays in the kernel.
+
+    Args:
+        src_fd: File descriptor to read from
+        dst_fd: File descriptor to write to
+        buffer_size: Maximum number of bytes moved at once
+
+    Returns:
+        Number of bytes moved and if the source was completely consumed.
+    """
+    size = 0
+    try:
+        if hasattr(os, "splice"):
+            while chunk_size := os.splice(src_fd, dst_fd, buffer_size):
+                size += chunk_size
+
+            return size, True
+
+        while chunk := os.read(src_fd, buffer_size):
+            view = memoryview(chunk)
+            while view:
+                written = os.write(dst_fd, view)
+                view = view[written:]
+                size += written
+    except BrokenPipeError:
+        return size, False
+
+    return size, True
+
+
+def _set_pipe_size(pipe: IO[bytes], size: int) -> None:
+    """
+    Try to enlarge the kernel buffer of a pipe. Silently does nothing if it is not possible.
+
+    Args:
+        pipe: Pipe to change
+        size: Requested buffer size in bytes
+    """
+    try:
+        fcntl.fcntl(pipe.fileno(), fcntl.F_SETPIPE_SZ, size)
+    except OSError:
+        log.debug("Unable to set the pipe size to %s", size)
+
+
+def _read_log(file: IO[bytes]) -> str:
+    file.seek(0)
+    return file.read().decode(errors="replace")
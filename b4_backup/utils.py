@@ -1,19 +1,34 @@
 """A collection of Helper functions."""
 
+import hashlib
+import json
 import logging
 import os
+import pickle
+from collections import deque
+from collections.abc import Iterable
+from dataclasses import dataclass
 from pathlib import Path, PurePath
+from typing import TYPE_CHECKING, Generic, TypeVar
 
-from omegaconf import OmegaConf, SCMode
 from rich.console import Console
-from rich.logging import RichHandler
 from rich.theme import Theme
 
+from b4_backup import config_schema
 from b4_backup.config_schema import DEFAULT, BaseConfig
 
+if TYPE_CHECKING:  # pragma: no cover
+    from rich.logging import RichHandler
+
 log = logging.getLogger("b4_backup.utils")
 
+T = TypeVar("T")
+
 DEFAULT_CONFIG = Path(os.getenv("B4_BACKUP_CONFIG", str(BaseConfig.config_path)))
+CONFIG_CACHE_DIR = Path(os.getenv("XDG_CACHE_HOME", "~/.cache")).expanduser() / "b4_backup"
+
+# Increase, if the format of the cache entries changes
+_CONFIG_CACHE_VERSION = 1
 
 DEFAULT_THEME = Theme(
     {
@@ -28,8 +43,10 @@ CONSOLE = Console(theme=DEFAULT_THEME)
 
 
 # Dynamically imported by logging.config.dictConfig
-def rich_handler() -> RichHandler:
+def rich_handler() -> "RichHandler":
     """Used in the logging config to use a customized RichHandler."""
+    from rich.logging import RichHandler  # noqa: PLC0415
+
     return RichHandler(console=CONSOLE)
 
 
@@ -59,6 +76,70 @@ def resolve_from_file(path: str) -> str:
     return Path(path).read_text(encoding="utf8").strip()
 
 
+@dataclass(frozen=True)
+class ConfigInput:
+    """
+    A file the resolved config depends on.
+
+    Args:
+        path: Path as referenced by the config
+        absolute_path: Absolute path of the file at the time it was read
+        mtime_ns: Modification time of the file
+        size: Size of the file in bytes
+        digest: SHA-256 of the file content
+    """
+
+    path: str
+    absolute_path: str
+    mtime_ns: int
+    size: int
+    digest: str
+
+    @classmethod
+    def from_path(cls, path: str) -> "ConfigInput":
+        """
+        Describe the current state of a file.
+
+        Args:
+            path: Path as referenced by the config
+
+        Returns:
+            ConfigInput instance
+        """
+        file = Path(path)
+        stat = file.stat()
+
+        return cls(
+            path=path,
+            absolute_path=str(file.absolute()),
+            mtime_ns=stat.st_mtime_ns,
+            size=stat.st_size,
+            digest=hashlib.sha256(file.read_bytes()).hexdigest(),
+        )
+
+    def changed(self) -> bool:
+        """
+        Check if the file changed since it was read.
+
+        The content is only hashed, if the modification time or size differ.
+
+        Returns:
+            True if the file was modified, removed or a relative path points to another file now.
+        """
+        file = Path(self.path)
+        if str(file.absolute()) != self.absolute_path:
+            return True
+
+        try:
+            stat = file.stat()
+            if (stat.st_mtime_ns, stat.st_size) == (self.mtime_ns, self.size):
+                return False
+
+            return hashlib.sha256(file.read_bytes()).hexdigest() != self.digest
+        except OSError:
+            return True
+
+
 def _copy_from_default_retention(config: BaseConfig):
     for target in config.backup_targets.values():
         for (
@@ -82,6 +163,10 @@ def load_config(
     """
     Reads the config file and returns a config dataclass.
 
+    The resolved config is cached in CONFIG_CACHE_DIR. The cache entry is used as long as
+    the config file, the files read by from_file and the config schema are unchanged.
+    Configs reading environment variables (oc.env) aren't cached.
+
     Args:
         config_path: Path of the config file
         overrides:
@@ -97,8 +182,89 @@ def load_config(
     config_path.parent.mkdir(exist_ok=True, parents=True)
     _ = config_path.exists() or config_path.touch()
 
-    if not OmegaConf.has_resolver("from_file"):
-        OmegaConf.register_new_resolver("from_file", resolve_from_file)
+    cache_path = _config_cache_path(config_path, overrides)
+    config = _read_config_cache(cache_path)
+    if config is not None:
+        return config
+
+    config, from_file_inputs = _load_config(config_path, overrides)
+    inputs = [str(config_path), config_schema.__file__, *from_file_inputs]
+
+    if not any("oc.env" in x for x in overrides):
+        _write_config_cache(cache_path, config, inputs)
+
+    return config
+
+
+def _config_cache_path(config_path: Path, overrides: list[str]) -> Path:
+    key = json.dumps([str(config_path.absolute()), overrides])
+    return CONFIG_CACHE_DIR / f"config-{hashlib.sha256(key.encode()).hexdigest()[:32]}.pickle"
+
+
+def _read_config_cache(cache_path: Path) -> BaseConfig | None:
+    try:
+        with cache_path.open("rb") as file:
+            # Unpickling runs code. With sudo -E the cache dir might belong to another user
+            stat = os.fstat(file.fileno())
+            if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+                log.warning(
+                    "Ignoring config cache %s, since it's not owned by the current user"
+                    " or writable by others",
+                    cache_path,
+                )
+                return None
+
+            entry = pickle.loads(file.read())  # noqa: S301
+    except FileNotFoundError:
+        return None
+    except Exception as exc:  # e.g. unpickling classes, which changed since the cache was written
+        log.debug("Ignoring unreadable config cache %s: %s", cache_path, exc)
+        return None
+
+    if entry.get("version") != _CONFIG_CACHE_VERSION or any(x.changed() for x in entry["inputs"]):
+        log.debug("Config cache %s is outdated", cache_path)
+        return None
+
+    return entry["config"]
+
+
+def _write_config_cache(cache_path: Path, config: BaseConfig, inputs: list[str]) -> None:
+    try:
+        config_inputs = [ConfigInput.from_path(x) for x in dict.fromkeys(inputs)]
+
+        # Environment variables aren't tracked, so configs depending on them can't be cached
+        if any(
+            "oc.env" in Path(x.path).read_text(encoding="utf8", errors="replace")
+            for x in config_inputs
+        ):
+            return
+
+        cache_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        with os.fdopen(
+            os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb"
+        ) as file:
+            pickle.dump(
+                {"version": _CONFIG_CACHE_VERSION, "inputs": config_inputs, "config": config}, file
+            )
+
+        tmp_path.replace(cache_path)
+    except OSError as exc:
+        log.debug("Unable to write config cache %s: %s", cache_path, exc)
+
+
+def _load_config(config_path: Path, overrides: list[str]) -> tuple[BaseConfig, list[str]]:
+    from omegaconf import OmegaConf, SCMode  # noqa: PLC0415
+
+    from_file_inputs: list[str] = []
+
+    def _resolve_from_file(path: str) -> str:
+        from_file_inputs.append(path)
+        return resolve_from_file(path)
+
+    # Registered on each load to collect the files read by this load
+    OmegaConf.register_new_resolver("from_file", _resolve_from_file, replace=True)
+    if not OmegaConf.has_resolver("parent_dir"):
         OmegaConf.register_new_resolver("parent_dir", resolve_parent_dir)
 
     base_conf = OmegaConf.merge(
@@ -121,7 +287,7 @@ def load_config(
     # That's why I do a shallow update here manually
     _copy_from_default_retention(base_conf_instance)
 
-    return base_conf_instance
+    return base_conf_instance, from_file_inputs
 
 
 def contains_path(path: PurePath, sub_path: PurePath) -> bool:
@@ -135,7 +301,74 @@ def contains_path(path: PurePath, sub_path: PurePath) -> bool:
     Returns:
         True if path contains subpath
     """
-    return any(
-        slice == sub_path.parts
-        for slice in zip(*[path.parts[i:] for i in range(len(sub_path.parts))])
-    )
+    return bool(PathMatcher([(sub_path, True)]).matches(path))
+
+
+class PathMatcher(Generic[T]):
+    """
+    Finds all patterns contained in a path, like contains_path, in a single pass over its parts.
+
+    The patterns are compiled into an Aho-Corasick automaton, which uses path parts as symbols.
+    """
+
+    def __init__(self, patterns: Iterable[tuple[PurePath, T]]) -> None:
+        """
+        Args:
+            patterns: Pairs of a pattern path and the value returned if a path contains it.
+        """
+        self._transitions: list[dict[str, int]] = [{}]
+        self._fallbacks: list[int] = [0]
+        self._values: list[list[T]] = [[]]
+
+        for pattern, value in patterns:
+            state = 0
+            for part in pattern.parts:
+                if part not in self._transitions[state]:
+                    self._transitions[state][part] = len(self._transitions)
+                    self._transitions.append({})
+                    self._fallbacks.append(0)
+                    self._values.append([])
+
+                state = self._transitions[state][part]
+
+            # Like contains_path, an empty pattern doesn't match anything
+            if state:
+                self._values[state].append(value)
+
+        self._link_fallbacks()
+
+    def _link_fallbacks(self) -> None:
+        # Breadth first, so the fallback of a state is always complete before it's used
+        queue = deque(self._transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for part, next_state in self._transitions[state].items():
+                queue.append(next_state)
+
+                fallback = self._step(self._fallbacks[state], part)
+                self._fallbacks[next_state] = fallback
+                self._values[next_state] = self._values[next_state] + self._values[fallback]
+
+    def _step(self, state: int, part: str) -> int:
+        while state and part not in self._transitions[state]:
+            state = self._fallbacks[state]
+
+        return self._transitions[state].get(part, 0)
+
+    def matches(self, path: PurePath) -> list[T]:
+        """
+        Return the values of all patterns contained in a path.
+
+        Args:
+            path: Path to check
+
+        Returns:
+            Values of the matching patterns. A value is repeated, if its pattern occurs multiple times.
+        """
+        result: list[T] = []
+        state = 0
+        for part in path.parts:
+            state = self._step(state, part)
+            result += self._values[state]
+
+        return result
@@ -10,7 +10,10 @@ from b4_backup.config_schema import (
     OnDestinationDirNotFound,
     SubvolumeBackupStrategy,
     SubvolumeFallbackStrategy,
+    SubvolumeUnchangedStrategy,
     TargetRestoreStrategy,
+    TransferCompression,
+    TransferMode,
 )
 
 
@@ -26,7 +29,10 @@ yaml.add_representer(pathlib.PosixPath, _path_representer)
 yaml.add_representer(TargetRestoreStrategy, _enum_representer)
 yaml.add_representer(SubvolumeFallbackStrategy, _enum_representer)
 yaml.add_representer(SubvolumeBackupStrategy, _enum_representer)
+yaml.add_representer(SubvolumeUnchangedStrategy, _enum_representer)
 yaml.add_representer(OnDestinationDirNotFound, _enum_representer)
+yaml.add_representer(TransferCompression, _enum_representer)
+yaml.add_representer(TransferMode, _enum_representer)
 
 base_conf = OmegaConf.merge(
     OmegaConf.structured(BaseConfig),
@@ -12,7 +12,16 @@ import pytest
 from b4_backup import utils
 from b4_backup.config_schema import BaseConfig
 from b4_backup.main.backup_target_host import BackupTargetHost
-from b4_backup.main.connection import LocalConnection
+from b4_backup.main.connection import Connection, LocalConnection
+from b4_backup.main.inventory import SubvolumeInventory
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _config_cache_dir() -> Generator[None, None, None]:
+    """Keep the config cache of the tests away from the cache of the user."""
+    with tempfile.TemporaryDirectory() as tmp_dir, pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(utils, "CONFIG_CACHE_DIR", Path(tmp_dir))
+        yield
 
 
 @pytest.fixture(scope="session")
@@ -49,6 +58,26 @@ def volume(config_path: Path) -> Generator[Path, None, None]:
     os.system(f"/code/tests/create_btrfs_volume.sh umount {volume_file} {mount_point}")
 
 
+@pytest.fixture(autouse=True)
+def _clear_subvolume_inventory() -> Generator[None, None, None]:
+    """Make sure no subvolume inventory is shared between tests."""
+    yield
+    SubvolumeInventory.clear_registry()
+
+
+def _process_path_operations(
+    connection: LocalConnection, monkeypatch: pytest.MonkeyPatch
+) -> LocalConnection:
+    """
+    Run the path operations of a local connection as processes instead of native calls.
+    This way tests can check the commands without touching the local filesystem.
+    """
+    for name in ["stat", "exists", "is_dir", "iterdir", "mkdir", "rmdirs", "rename"]:
+        monkeypatch.setattr(connection, name, getattr(Connection, name).__get__(connection))
+
+    return connection
+
+
 @pytest.fixture
 def src_host(config: BaseConfig, monkeypatch: pytest.MonkeyPatch):
     monkeypatch.setattr(BackupTargetHost, "_mount_point", MagicMock(return_value=Path("/opt")))
@@ -57,15 +86,15 @@ def src_host(config: BaseConfig, monkeypatch: pytest.MonkeyPatch):
     return BackupTargetHost.from_source_host(
         target_name=target_name,
         target_config=config.backup_targets[target_name],
-        connection=LocalConnection(Path("/home")),
+        connection=_process_path_operations(LocalConnection(Path("/home")), monkeypatch),
     )
 
 
 @pytest.fixture
-def dst_host(config: BaseConfig):
+def dst_host(config: BaseConfig, monkeypatch: pytest.MonkeyPatch):
     target_name = "localhost/home"
     return BackupTargetHost.from_destination_host(
         target_name=target_name,
         target_config=config.backup_targets[target_name],
-        connection=LocalConnection(Path("/opt/b4")),
+        connection=_process_path_operations(LocalConnection(Path("/opt/b4")), monkeypatch),
     )
@@ -0,0 +1,185 @@
+import dataclasses
+import json
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+
+from b4_backup import utils
+from b4_backup.cli import completion
+from b4_backup.cli.completion import CompletionIndex
+from b4_backup.config_schema import BaseConfig
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        None,
+        "no json",
+        json.dumps({"version": 0, "config": None, "targets": ["old"], "snapshots": {}}),
+        json.dumps({"version": 1}),
+    ],
+)
+def test_load__invalid(tmp_path: Path, content: str | None):
+    # Arrange
+    path = tmp_path / "index.json"
+    if content is not None:
+        path.write_text(content)
+
+    # Act
+    result = CompletionIndex.load(path)
+
+    # Assert
+    assert result == CompletionIndex(path)
+    assert result.outdated()
+
+
+def test_save(tmp_path: Path, config_path: Path):
+    # Arrange
+    index = CompletionIndex(
+        tmp_path / "cache" / "index.json",
+        config=utils.ConfigInput.from_path(str(config_path)),
+        targets=["localhost", "localhost/home"],
+        snapshots={"localhost/home": ["2023-08-02-00-00-00_manual"]},
+    )
+
+    # Act
+    index.save()
+
+    # Assert
+    result = CompletionIndex.load(index.path)
+    assert result == index
+    assert not result.outdated()
+    assert list(index.path.parent.iterdir()) == [index.path]
+
+
+def test_save__not_writable(tmp_path: Path):
+    # Arrange
+    (tmp_path / "cache").write_text("")
+    index = CompletionIndex(tmp_path / "cache" / "index.json")
+
+    # Act
+    index.save()
+
+    # Assert
+    assert not index.path.exists()
+
+
+def test_update_targets(config: BaseConfig):
+    # Arrange
+    index = CompletionIndex(
+        Path("index.json"),
+        snapshots={
+            "localhost/home": ["2023-08-02-00-00-00_manual"],
+            "localhost/removed": ["2023-08-01-00-00-00_manual"],
+        },
+    )
+
+    # Act
+    index.update_targets(config)
+
+    # Assert
+    assert index.config == utils.ConfigInput.from_path(str(config.config_path))
+    assert index.targets == [".", "localhost", "localhost/home", "localhost/mnt", "localhost/root"]
+    assert index.snapshots == {"localhost/home": ["2023-08-02-00-00-00_manual"]}
+
+
+def test_update_targets__config_missing(config: BaseConfig, tmp_path: Path):
+    # Arrange
+    config = dataclasses.replace(config, config_path=tmp_path / "missing.yml")
+    index = CompletionIndex(Path("index.json"))
+
+    # Act
+    index.update_targets(config)
+
+    # Assert
+    assert index.config is None
+    assert index.outdated()
+    assert "localhost/home" in index.targets
+
+
+def test_record(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    monkeypatch.setattr(completion, "MAX_SNAPSHOTS", 2)
+    src_host = MagicMock()
+    src_host.name = "localhost/home"
+    src_host.snapshots.return_value = {
+        "2023-08-01-00-00-00_manual": None,
+        "2023-08-03-00-00-00_manual": None,
+    }
+    dst_host = MagicMock()
+    dst_host.name = "localhost/home"
+    dst_host.snapshots.return_value = {
+        "2023-08-02-00-00-00_manual": None,
+        "2023-08-03-00-00-00_manual": None,
+    }
+    index = CompletionIndex(Path("index.json"))
+
+    # Act
+    index.record(src_host, dst_host)
+    index.record(None, None)
+
+    # Assert
+    assert index.snapshots == {
+        "localhost/home": ["2023-08-03-00-00-00_manual", "2023-08-02-00-00-00_manual"]
+    }
+
+
+@pytest.mark.parametrize(
+    ("targets", "expected"),
+    [
+        (
+            [],
+            [
+                "2023-08-03-00-00-00_manual",
+                "2023-08-02-00-00-00_manual",
+                "2023-08-01-00-00-00_manual",
+            ],
+        ),
+        (["localhost/mnt"], ["2023-08-03-00-00-00_manual"]),
+        (
+            ["localhost"],
+            [
+                "2023-08-03-00-00-00_manual",
+                "2023-08-02-00-00-00_manual",
+                "2023-08-01-00-00-00_manual",
+            ],
+        ),
+        (["other"], []),
+    ],
+)
+def test_snapshot_names(targets: list[str], expected: list[str]):
+    # Arrange
+    index = CompletionIndex(
+        Path("index.json"),
+        snapshots={
+            "localhost/home": ["2023-08-02-00-00-00_manual", "2023-08-01-00-00-00_manual"],
+            "localhost/mnt": ["2023-08-03-00-00-00_manual"],
+            "localhost/root": ["2023-08-02-00-00-00_manual"],
+        },
+    )
+
+    # Act
+    result = index.snapshot_names(targets)
+
+    # Assert
+    assert result == expected
+
+
+def test_completion_index(config: BaseConfig, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    monkeypatch.setattr(utils, "CONFIG_CACHE_DIR", tmp_path)
+    host = MagicMock()
+    host.name = "localhost/home"
+    host.snapshots.return_value = {"2023-08-01-00-00-00_manual": None}
+
+    # Act
+    with completion.completion_index(config) as index:
+        index.record(host)
+
+    # Assert
+    result = CompletionIndex.load(completion.index_path(config.config_path))
+    assert result.path.parent == tmp_path
+    assert result.snapshots == {"localhost/home": ["2023-08-01-00-00-00_manual"]}
+    assert "localhost/home" in result.targets
+    assert not result.outdated()
@@ -1,5 +1,9 @@
 import importlib.metadata
 import shlex
+import subprocess
+import sys
+import time
+from pathlib import Path
 from unittest.mock import MagicMock
 
 import pytest
@@ -9,6 +13,25 @@ from b4_backup.cli.init import app
 
 runner = CliRunner()
 
+# Generous, so slow machines pass as well. Usually it takes a fraction of it
+STARTUP_BUDGET = 2.0
+STARTUP_SCRIPT = """
+import importlib.metadata
+import sys
+
+# The package might not be installed in the test environment
+importlib.metadata.version = lambda _name: "0.0.0"
+
+from b4_backup.cli import app
+
+try:
+    app(sys.argv[1:])
+except SystemExit:
+    pass
+
+print(sorted({"arrow", "omegaconf", "paramiko"} & sys.modules.keys()))
+"""
+
 
 @app.command()
 def command_test():
@@ -54,3 +77,22 @@ def test_command_test():
     print(result.stdout)
     assert result.exit_code == 0
     assert result.stdout == "It works\n"
+
+
+@pytest.mark.parametrize("args", ["--version", "list --help"])
+def test_startup(args: str):
+    # Act
+    start = time.monotonic()
+    result = subprocess.run(  # noqa: S603
+        [sys.executable, "-c", STARTUP_SCRIPT, *shlex.split(args)],
+        cwd=Path(__file__).parents[2],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    elapsed = time.monotonic() - start
+
+    # Assert
+    print(result.stdout)
+    assert result.stdout.splitlines()[-1] == "[]"
+    assert elapsed < STARTUP_BUDGET
@@ -1,19 +1,40 @@
+import dataclasses
 import shlex
+from pathlib import Path
 from unittest.mock import MagicMock
 
 import pytest
+from rich import prompt
 from typer.testing import CliRunner
 
 from b4_backup import utils
-from b4_backup.cli import main
 from b4_backup.cli.init import app
 from b4_backup.cli.utils import OutputFormat
 from b4_backup.config_schema import BaseConfig
+from b4_backup.main import backup_target_host
 from b4_backup.main.b4_backup import B4Backup
+from b4_backup.main.catalog import SnapshotCatalog
 
 runner = CliRunner()
 
 
+def _fake_run_targets(hosts: list[tuple]):
+    def _run_targets(_target_choice, _backup_targets, action, *, on_error=None, **_kwargs):
+        results = []
+        for src_host, dst_host in hosts:
+            try:
+                results.append(action(src_host, dst_host))
+            except Exception as exc:
+                if on_error is None:
+                    raise
+
+                on_error(exc)
+
+        return results
+
+    return _run_targets
+
+
 @pytest.mark.parametrize(
     ("cmd", "extra_args"),
     [
@@ -35,18 +56,23 @@ def test_basic_cmd(
 ):
     # Arrange
     monkeypatch.setattr(utils, "load_config", MagicMock(return_value=config))
+    fake_host = MagicMock()
+    fake_host.name = "localhost/home"
     monkeypatch.setattr(
-        main,
+        backup_target_host,
         "host_generator",
         MagicMock(
             return_value=[
                 (
-                    None if "no-source" in extra_args else MagicMock(),
-                    None if "no-destination" in extra_args else MagicMock(),
+                    None if "no-source" in extra_args else fake_host,
+                    None if "no-destination" in extra_args else fake_host,
                 ),
             ]
         ),
     )
+    monkeypatch.setattr(
+        backup_target_host, "run_targets", _fake_run_targets(backup_target_host.host_generator())
+    )
     fake_cmd = MagicMock()
     monkeypatch.setattr(B4Backup, cmd, fake_cmd)
 
@@ -83,7 +109,7 @@ def test_basic_cmd__host_required(
     # Arrange
     monkeypatch.setattr(utils, "load_config", MagicMock(return_value=config))
     monkeypatch.setattr(
-        main,
+        backup_target_host,
         "host_generator",
         MagicMock(
             return_value=[
@@ -91,6 +117,9 @@ def test_basic_cmd__host_required(
             ]
         ),
     )
+    monkeypatch.setattr(
+        backup_target_host, "run_targets", _fake_run_targets(backup_target_host.host_generator())
+    )
 
     # Act
     result = runner.invoke(
@@ -102,6 +131,25 @@ def test_basic_cmd__host_required(
     assert "requires source" in result.stdout
 
 
+def test_backup__pipeline(
+    config: BaseConfig,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    # Arrange
+    monkeypatch.setattr(utils, "load_config", MagicMock(return_value=config))
+    fake_run_targets = MagicMock(return_value=[])
+    monkeypatch.setattr(backup_target_host, "run_targets", fake_run_targets)
+
+    # Act
+    result = runner.invoke(
+        app, shlex.split("-c tests/config.yml backup --target localhost/home --pipeline")
+    )
+
+    # Assert
+    assert result.exit_code == 0
+    assert fake_run_targets.call_args.kwargs["pipelined"] is True
+
+
 def test_backup__error_group(
     config: BaseConfig,
     monkeypatch: pytest.MonkeyPatch,
@@ -109,7 +157,7 @@ def test_backup__error_group(
     # Arrange
     monkeypatch.setattr(utils, "load_config", MagicMock(return_value=config))
     monkeypatch.setattr(
-        main,
+        backup_target_host,
         "host_generator",
         MagicMock(
             return_value=[
@@ -117,6 +165,9 @@ def test_backup__error_group(
             ]
         ),
     )
+    monkeypatch.setattr(
+        backup_target_host, "run_targets", _fake_run_targets(backup_target_host.host_generator())
+    )
     monkeypatch.setattr(
         B4Backup,
         "backup",
@@ -145,18 +196,23 @@ def test_list_snapshots(
 ):
     # Arrange
     monkeypatch.setattr(utils, "load_config", MagicMock(return_value=config))
+    fake_host = MagicMock()
+    fake_host.name = "localhost/home"
     monkeypatch.setattr(
-        main,
+        backup_target_host,
         "host_generator",
         MagicMock(
             return_value=[
                 (
-                    None if "no-source" in extra_args else MagicMock(),
-                    None if "no-destination" in extra_args else MagicMock(),
+                    None if "no-source" in extra_args else fake_host,
+                    None if "no-destination" in extra_args else fake_host,
                 ),
             ]
         ),
     )
+    monkeypatch.setattr(
+        backup_target_host, "run_targets", _fake_run_targets(backup_target_host.host_generator())
+    )
     fake_output = MagicMock()
     monkeypatch.setattr(OutputFormat, "output", fake_output)
 
@@ -174,13 +230,120 @@ def test_list_snapshots(
     assert result.exit_code == 0
 
 
+@pytest.mark.parametrize(
+    ("extra_args", "expect_cached", "expect_uncached"),
+    [
+        ("--source --no-destination", 1, []),
+        ("--source --destination", 0, ["localhost/home"]),
+    ],
+)
+def test_list_snapshots__cached(
+    config: BaseConfig,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+    extra_args: str,
+    expect_cached: int,
+    expect_uncached: list[str],
+):
+    # Arrange
+    config = dataclasses.replace(config, catalog_path=tmp_path / "b4.sqlite")
+    with SnapshotCatalog.open(config.catalog_path) as catalog:  # type: ignore
+        catalog.reconcile("localhost/home", "source", [("2023-08-01-00-00-00_manual", "!", None)])
+
+    monkeypatch.setattr(utils, "load_config", MagicMock(return_value=config))
+    fake_run_targets = MagicMock(return_value=[])
+    monkeypatch.setattr(backup_target_host, "run_targets", fake_run_targets)
+    fake_output = MagicMock()
+    monkeypatch.setattr(OutputFormat, "output", fake_output)
+
+    # Act
+    result = runner.invoke(
+        app,
+        shlex.split(f"-c tests/config.yml list --target localhost/home --cached {extra_args}"),
+    )
+
+    # Assert
+    assert result.exit_code == 0
+    assert fake_output.call_count == expect_cached
+    assert fake_run_targets.call_args.args[0].data == expect_uncached
+
+
+def test_list_snapshots__cached_order(
+    config: BaseConfig,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+):
+    # Arrange
+    config = dataclasses.replace(config, catalog_path=tmp_path / "b4.sqlite")
+    with SnapshotCatalog.open(config.catalog_path) as catalog:  # type: ignore
+        catalog.reconcile("localhost/mnt", "source", [("2023-08-01-00-00-00_manual", "!", None)])
+
+    monkeypatch.setattr(utils, "load_config", MagicMock(return_value=config))
+    src_host = MagicMock()
+    src_host.name = "localhost/home"
+    src_host.snapshots.return_value = {"2023-08-02-00-00-00_manual": None}
+    monkeypatch.setattr(backup_target_host, "run_targets", _fake_run_targets([(src_host, None)]))
+    fake_output = MagicMock()
+    monkeypatch.setattr(OutputFormat, "output", fake_output)
+
+    # Act
+    result = runner.invoke(
+        app,
+        shlex.split(
+            "-c tests/config.yml list -t localhost/mnt -t localhost/home --cached --source"
+        ),
+    )
+
+    # Assert
+    assert result.exit_code == 0
+    # Ordered like the targets in the config, no matter if read from the catalog or the host
+    assert [list(x.args[0]) for x in fake_output.call_args_list] == [
+        ["2023-08-02-00-00-00_manual"],
+        ["2023-08-01-00-00-00_manual"],
+    ]
+
+
+def test_list_snapshots__cached_without_catalog(
+    config: BaseConfig,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    # Arrange
+    monkeypatch.setattr(utils, "load_config", MagicMock(return_value=config))
+
+    # Act
+    result = runner.invoke(app, shlex.split("-c tests/config.yml list --cached"))
+
+    # Assert
+    assert result.exit_code == 2
+
+
+def test_list_snapshots__update_catalog(
+    config: BaseConfig,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    # Arrange
+    monkeypatch.setattr(utils, "load_config", MagicMock(return_value=config))
+    src_host = MagicMock()
+    monkeypatch.setattr(backup_target_host, "run_targets", _fake_run_targets([(src_host, None)]))
+    monkeypatch.setattr(OutputFormat, "output", MagicMock())
+
+    # Act
+    result = runner.invoke(
+        app, shlex.split("-c tests/config.yml list --target localhost/home --source")
+    )
+
+    # Assert
+    assert result.exit_code == 0
+    src_host.update_catalog.assert_called_once_with()
+
+
 def test_delete_all__abort(
     config: BaseConfig,
     monkeypatch: pytest.MonkeyPatch,
 ):
     # Arrange
     monkeypatch.setattr(utils, "load_config", MagicMock(return_value=config))
-    monkeypatch.setattr(main.prompt.Confirm, "ask", MagicMock(return_value=False))
+    monkeypatch.setattr(prompt.Confirm, "ask", MagicMock(return_value=False))
 
     # Act
     result = runner.invoke(app, shlex.split("-c tests/config.yml delete-all"))
@@ -196,7 +359,7 @@ def test_sync__error(
     # Arrange
     monkeypatch.setattr(utils, "load_config", MagicMock(return_value=config))
     monkeypatch.setattr(
-        main,
+        backup_target_host,
         "host_generator",
         MagicMock(
             return_value=[
@@ -204,6 +367,9 @@ def test_sync__error(
             ]
         ),
     )
+    monkeypatch.setattr(
+        backup_target_host, "run_targets", _fake_run_targets(backup_target_host.host_generator())
+    )
 
     # Act
     result = runner.invoke(app, shlex.split("-c tests/config.yml sync --target localhost/home"))
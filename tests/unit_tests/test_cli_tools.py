@@ -1,10 +1,12 @@
 import shlex
 from unittest.mock import MagicMock
 
+import arrow
 import pytest
 from typer.testing import CliRunner
 
 from b4_backup import utils
+from b4_backup.cli import tools
 from b4_backup.cli.init import app
 from b4_backup.config_schema import BaseConfig
 
@@ -23,3 +25,72 @@ def test_dump_config(
 
     # Assert
     assert result.exit_code == 0
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        "-r all=1day --duration 30days",
+        "-t localhost/home --duration 2weeks --step 1week",
+    ],
+)
+def test_simulate_retention(
+    config: BaseConfig,
+    monkeypatch: pytest.MonkeyPatch,
+    args: str,
+):
+    # Arrange
+    monkeypatch.setattr(utils, "load_config", MagicMock(return_value=config))
+
+    # Act
+    result = runner.invoke(app, shlex.split(f"-c tests/config.yml tools simulate-retention {args}"))
+
+    # Assert
+    assert result.exit_code == 0
+    assert "Retention simulation" in result.stdout
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        "-t unknown",
+        "--interval 1month",
+        "--step 0days",
+        "--duration 100",
+        "--duration xyz",
+        "--duration forever",
+        "-r 1day",
+        "-r all=xyz",
+        "-r xyz=1day",
+    ],
+)
+def test_simulate_retention__invalid(
+    config: BaseConfig,
+    monkeypatch: pytest.MonkeyPatch,
+    args: str,
+):
+    # Arrange
+    monkeypatch.setattr(utils, "load_config", MagicMock(return_value=config))
+
+    # Act
+    result = runner.invoke(app, shlex.split(f"-c tests/config.yml tools simulate-retention {args}"))
+
+    # Assert
+    assert result.exit_code == 2
+    assert "Invalid value" in result.output
+
+
+def test_simulate_retention__statistics():
+    # Arrange
+    start = arrow.get("2023-08-01T00:00:00+00:00").int_timestamp
+    hour = 60 * 60
+
+    # Act
+    result = tools._simulate_retention({"all": "1day"}, start, start + 72 * hour, hour, 24 * hour)
+
+    # Assert
+    assert result["created"] == 73
+    assert result["kept"] == 25
+    assert result["peak"] == 49
+    assert result["oldest"] == "2023-08-03-00-00-00"
+    assert result["runs"] == 4
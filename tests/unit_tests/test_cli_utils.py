@@ -1,3 +1,4 @@
+import dataclasses
 from pathlib import Path, PurePath
 from unittest.mock import MagicMock
 
@@ -7,7 +8,9 @@ from click import Command
 
 from b4_backup import cli, exceptions, utils
 from b4_backup.cli import utils as cli_utils
+from b4_backup.cli.completion import CompletionIndex, index_path
 from b4_backup.config_schema import BaseConfig
+from b4_backup.main.catalog import SnapshotCatalog
 from b4_backup.main.dataclass import Snapshot
 
 
@@ -15,6 +18,7 @@ def test_validate_target__success(config: BaseConfig):
     # Arrange
     mock_ctx = MagicMock()
     mock_ctx.obj = config
+    mock_ctx.resilient_parsing = False
 
     # Act
     result = cli_utils.validate_target(mock_ctx, ["localhost/home"])
@@ -23,6 +27,18 @@ def test_validate_target__success(config: BaseConfig):
     assert result == ["localhost/home"]
 
 
+def test_validate_target__completion():
+    # Arrange
+    mock_ctx = MagicMock()
+    mock_ctx.resilient_parsing = True
+
+    # Act
+    result = cli_utils.validate_target(mock_ctx, ["idontexist"])
+
+    # Assert
+    assert result == ["idontexist"]
+
+
 def test_parse_callback_args():
     # Act
     parsed_args = cli_utils.parse_callback_args(
@@ -56,17 +72,20 @@ def test_validate_target__error(config: BaseConfig):
     # Arrange
     mock_ctx = MagicMock()
     mock_ctx.obj = config
+    mock_ctx.resilient_parsing = False
 
     # Act / Assert
     with pytest.raises(typer.BadParameter):
         cli_utils.validate_target(mock_ctx, ["idontexist"])
 
 
-def test_complete_target(config: BaseConfig, monkeypatch: pytest.MonkeyPatch):
+def test_complete_target(config: BaseConfig, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
     # Arrange
     ctx = typer.Context(Command("b4"))
+    monkeypatch.setattr(utils, "CONFIG_CACHE_DIR", tmp_path)
     monkeypatch.setenv("_TYPER_COMPLETE_ARGS", "b4 -c tests/config.yml backup --target localh")
-    monkeypatch.setattr(utils, "load_config", MagicMock(return_value=config))
+    load_config = MagicMock(return_value=config)
+    monkeypatch.setattr(utils, "load_config", load_config)
 
     # Act
     result = cli_utils.complete_target(ctx, "localh")
@@ -78,6 +97,56 @@ def test_complete_target(config: BaseConfig, monkeypatch: pytest.MonkeyPatch):
         "localhost/mnt",
         "localhost/root",
     ]
+    load_config.assert_called_once()
+    assert CompletionIndex.load(index_path(Path("tests/config.yml"))).targets
+
+
+def test_complete_target__index(
+    config: BaseConfig, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    # Arrange
+    ctx = typer.Context(Command("b4"))
+    ctx.params["target"] = ["localhost/home"]
+    monkeypatch.setattr(utils, "CONFIG_CACHE_DIR", tmp_path)
+    monkeypatch.setenv("_TYPER_COMPLETE_ARGS", f"b4 -c {config.config_path} backup -t localh")
+    load_config = MagicMock()
+    monkeypatch.setattr(utils, "load_config", load_config)
+
+    index = CompletionIndex(index_path(config.config_path))
+    index.update_targets(config)
+    index.save()
+
+    # Act
+    result = cli_utils.complete_target(ctx, "localh")
+
+    # Assert
+    assert list(result) == ["localhost", "localhost/mnt", "localhost/root"]
+    load_config.assert_not_called()
+
+
+def test_complete_snapshot(config: BaseConfig, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    ctx = typer.Context(Command("b4"))
+    ctx.params["target"] = ["localhost/home"]
+    monkeypatch.setattr(utils, "CONFIG_CACHE_DIR", tmp_path)
+    monkeypatch.setenv("_TYPER_COMPLETE_ARGS", f"b4 -c {config.config_path} delete 2023")
+    load_config = MagicMock()
+    monkeypatch.setattr(utils, "load_config", load_config)
+
+    index = CompletionIndex(index_path(config.config_path))
+    index.update_targets(config)
+    index.snapshots = {
+        "localhost/home": ["2023-08-02-00-00-00_manual", "2022-08-01-00-00-00_manual"],
+        "localhost/mnt": ["2023-08-03-00-00-00_manual"],
+    }
+    index.save()
+
+    # Act
+    result = cli_utils.complete_snapshot(ctx, "2023")
+
+    # Assert
+    assert list(result) == ["2023-08-02-00-00-00_manual"]
+    load_config.assert_not_called()
 
 
 class TestErrorHandler:
@@ -120,6 +189,48 @@ def test_error_handler__error(error: Exception):
         raise error
 
 
+def test_open_catalog(config: BaseConfig, tmp_path: Path):
+    # Arrange
+    catalog_config = dataclasses.replace(config, catalog_path=tmp_path / "b4.sqlite")
+
+    # Act
+    with (
+        cli_utils.open_catalog(config) as disabled,
+        cli_utils.open_catalog(catalog_config) as catalog,
+    ):
+        pass
+
+    # Assert
+    assert disabled is None
+    assert catalog is not None
+    assert (tmp_path / "b4.sqlite").exists()
+
+
+def test_catalog_snapshots(tmp_path: Path):
+    # Arrange
+    with SnapshotCatalog.open(tmp_path / "b4.sqlite") as catalog:
+        catalog.reconcile(
+            "example.com/home",
+            "destination",
+            [("alpha_manual", "!", None), ("alpha_manual", "!a", None)],
+        )
+
+        # Act
+        result = cli_utils.catalog_snapshots(
+            catalog, "example.com/home", "ssh://root@example.com/opt/backups", "destination"
+        )
+        result_unknown = cli_utils.catalog_snapshots(
+            catalog, "example.com/home", "ssh://root@example.com/home", "source"
+        )
+
+    # Assert
+    assert result is not None
+    assert list(result) == ["alpha_manual"]
+    assert [str(x) for x in result["alpha_manual"].subvolumes_unescaped] == [".", "a"]
+    assert result["alpha_manual"].base_path == PurePath("/opt/backups")
+    assert result_unknown is None
+
+
 @pytest.mark.parametrize(
     ("format", "expect"),
     [
@@ -1,7 +1,7 @@
 import omegaconf.errors
 import pytest
 
-from b4_backup.config_schema import BaseConfig
+from b4_backup.config_schema import DEFAULT, BaseConfig, TargetIndex
 
 
 @pytest.mark.parametrize(
@@ -34,3 +34,78 @@ def test_post_init__error(
     # Act
     with pytest.raises(omegaconf.errors.ValidationError):
         config.__post_init__()
+
+
+TARGETS = ["host/pool/b", "_default", "host/pool/a", "host/other", "backup", "host/pool/a"]
+
+
+@pytest.mark.parametrize(
+    ("selectors", "expect"),
+    [
+        (["host/pool"], ["host/pool/b", "host/pool/a"]),
+        (["host/pool/a", "host"], ["host/pool/b", "host/pool/a", "host/other"]),
+        (["host/pool/a/"], ["host/pool/a"]),
+        (["."], ["host/pool/b", "host/pool/a", "host/other", "backup"]),
+        (["host/po", "_default", "missing"], []),
+        ([], []),
+    ],
+)
+def test_target_index_select(selectors: list[str], expect: list[str]):
+    # Arrange
+    target_index = TargetIndex(TARGETS)
+
+    # Act
+    result = target_index.select(selectors)
+
+    # Assert
+    assert result == expect
+
+
+def test_target_index_contains():
+    # Arrange
+    target_index = TargetIndex(TARGETS)
+
+    # Act / Assert
+    assert "host" in target_index
+    assert "host/pool/a" in target_index
+    assert "host/pool/a/sub" not in target_index
+    assert "host/po" not in target_index
+    assert "_default" not in target_index
+
+
+def test_target_index_prefixes():
+    # Arrange
+    target_index = TargetIndex(TARGETS)
+
+    # Act
+    result = target_index.prefixes()
+
+    # Assert
+    assert result == [
+        ".",
+        "backup",
+        "host",
+        "host/other",
+        "host/pool",
+        "host/pool/a",
+        "host/pool/b",
+    ]
+
+
+def test_target_index_of():
+    # Act
+    target_index = TargetIndex.of(dict.fromkeys(TARGETS))
+
+    # Assert
+    assert TargetIndex.of(iter(TARGETS[:-1])) is target_index
+    assert TargetIndex.of(target_index) is target_index
+    assert target_index.targets == ["host/pool/b", "host/pool/a", "host/other", "backup"]
+
+
+def test_target_index__config(config: BaseConfig):
+    # Act
+    result = config.target_index
+
+    # Assert
+    assert result is config.target_index
+    assert result.targets == [x for x in config.backup_targets if x != DEFAULT]
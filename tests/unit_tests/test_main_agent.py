@@ -0,0 +1,240 @@
+import contextlib
+import io
+import json
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import paramiko
+import pytest
+
+from b4_backup import exceptions
+from b4_backup.main import remote_agent
+from b4_backup.main.agent import RemoteAgent
+
+
+def _run_agent_inline(stdin, stdout):
+    # Skip the agent source, like the bootstrap command does
+    stdin.read(int(stdin.readline()))
+    remote_agent.main(stdin, stdout)
+
+
+@pytest.fixture(params=["process", "inline"])
+def agent(request: pytest.FixtureRequest):
+    if request.param == "process":
+        with subprocess.Popen(  # noqa: S603
+            ["sh", "-c", RemoteAgent.bootstrap_command],  # noqa: S607
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        ) as process:
+            assert process.stdin
+            assert process.stdout
+
+            agent = RemoteAgent(process.stdin, process.stdout, on_close=process.wait)
+            agent.bootstrap()
+
+            yield agent
+
+            agent.close()
+
+        return
+
+    request_read, request_write = os.pipe()
+    response_read, response_write = os.pipe()
+    with (
+        open(request_read, "rb") as agent_stdin,  # noqa: PTH123
+        open(response_write, "wb") as agent_stdout,  # noqa: PTH123
+    ):
+        thread = threading.Thread(target=_run_agent_inline, args=(agent_stdin, agent_stdout))
+        thread.start()
+
+        agent = RemoteAgent(
+            open(request_write, "wb"),  # noqa: PTH123, SIM115
+            open(response_read, "rb"),  # noqa: PTH123, SIM115
+            on_close=thread.join,
+        )
+        agent.bootstrap()
+
+        yield agent
+
+        agent.close()
+
+
+def test_request(agent: RemoteAgent, tmp_path: Path):
+    # Act
+    result = agent.request(
+        [
+            ("mkdir", str(tmp_path / "a/b"), True),
+            ("mkdir", str(tmp_path / "c")),
+            ("rename", str(tmp_path / "c"), str(tmp_path / "d")),
+            ("rmdir", str(tmp_path / "idontexist")),
+            ("iterdir", str(tmp_path)),
+            ("stat", str(tmp_path / "a")),
+            ("stat", str(tmp_path / "c")),
+            ("run", ["sh", "-c", "echo snickers; echo error >&2; exit 3"]),
+            ("run_all", [["echo", "alpha"], ["false"], ["echo", "bravo"]]),
+            ("run_all", [["true"]]),
+        ]
+    )
+
+    # Assert
+    assert result == [
+        None,
+        None,
+        None,
+        None,
+        ["a", "d"],
+        {"exists": True, "is_dir": True},
+        {"exists": False, "is_dir": False},
+        {"returncode": 3, "stdout": "snickers\n", "stderr": "error\n"},
+        [
+            {"returncode": 0, "stdout": "alpha\n", "stderr": ""},
+            {"returncode": 1, "stdout": "", "stderr": ""},
+        ],
+        [{"returncode": 0, "stdout": "", "stderr": ""}],
+    ]
+
+
+def test_request__threads(agent: RemoteAgent, tmp_path: Path):
+    # Arrange
+    for i in range(20):
+        (tmp_path / str(i)).mkdir()
+        (tmp_path / str(i) / f"item{i}").touch()
+
+    # Act
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(
+            executor.map(lambda i: agent.request([("iterdir", str(tmp_path / str(i)))]), range(20))
+        )
+
+    # Assert
+    assert results == [[[f"item{i}"]] for i in range(20)]
+
+
+def test_request__prune_empty_dirs(agent: RemoteAgent, tmp_path: Path):
+    # Arrange
+    for directory in ["a/b/c", "a/subvol", "d", "e"]:
+        (tmp_path / directory).mkdir(parents=True)
+
+    (tmp_path / "d/file.txt").touch()
+    (tmp_path / "e/link").symlink_to(tmp_path / "a")
+
+    # Act
+    result = agent.request(
+        [
+            ("prune_empty_dirs", str(tmp_path), [str(tmp_path / "a/subvol")]),
+            ("prune_empty_dirs", str(tmp_path / "d"), [str(tmp_path / "d")]),
+        ]
+    )
+
+    # Assert
+    assert result == [[str(tmp_path / "a/b/c"), str(tmp_path / "a/b")], []]
+    assert sorted(x.name for x in tmp_path.iterdir()) == ["a", "d", "e"]
+    assert (tmp_path / "a/subvol").exists()
+
+
+def test_request__empty(agent: RemoteAgent):
+    # Act
+    result = agent.request([])
+
+    # Assert
+    assert result == []
+
+
+def test_request__error(agent: RemoteAgent, tmp_path: Path):
+    # Act / Assert
+    with pytest.raises(exceptions.RemoteAgentError, match="FileNotFoundError"):
+        agent.request([("rename", str(tmp_path / "a"), str(tmp_path / "b"))])
+
+
+@pytest.mark.parametrize(
+    ("stdin", "stdout"),
+    [
+        (io.BytesIO(), io.BytesIO(b"")),
+        (io.BytesIO(), io.BytesIO(b"python3: command not found\n")),
+        (io.BytesIO(), io.BytesIO(b'{"agent": "b4", "version": 0}\n')),
+        (MagicMock(write=MagicMock(side_effect=OSError("Socket is closed"))), io.BytesIO()),
+    ],
+)
+def test_bootstrap__error(stdin, stdout):
+    # Arrange
+    agent = RemoteAgent(stdin, stdout)
+
+    # Act / Assert
+    with pytest.raises(exceptions.AgentUnavailableError):
+        agent.bootstrap()
+
+    agent.close()
+
+
+@pytest.mark.parametrize(
+    ("stdout", "expected_exception"),
+    [
+        (json.dumps({"agent": "b4", "version": remote_agent.VERSION}) + "\n", None),
+        ("", exceptions.AgentUnavailableError),
+    ],
+)
+def test_start(stdout: str, expected_exception: type[Exception] | None):
+    # Arrange
+    fake_ssh_client = MagicMock()
+    fake_channel = fake_ssh_client.get_transport().open_session()
+    stdin_stream = io.BytesIO()
+    fake_channel.makefile = MagicMock(side_effect=[stdin_stream, io.BytesIO(stdout.encode())])
+
+    # Act
+    with pytest.raises(expected_exception) if expected_exception else contextlib.nullcontext():
+        RemoteAgent.start(fake_ssh_client)
+
+    # Assert
+    fake_channel.exec_command.assert_called_once_with(RemoteAgent.bootstrap_command)
+    assert fake_channel.close.called is (expected_exception is not None)
+
+
+def test_remote_agent_main(tmp_path: Path):
+    # Arrange
+    stdin = io.BytesIO(json.dumps({"ops": [["stat", str(tmp_path)], ["unknown"]]}).encode() + b"\n")
+    stdout = io.BytesIO()
+
+    # Act
+    remote_agent.main(stdin, stdout)
+
+    # Assert
+    assert [json.loads(x) for x in stdout.getvalue().splitlines()] == [
+        {"agent": "b4", "version": remote_agent.VERSION},
+        {
+            "results": [
+                {"value": {"exists": True, "is_dir": True}},
+                {"error": "KeyError", "message": "'unknown'"},
+            ]
+        },
+    ]
+
+
+def test_start__no_session():
+    # Arrange
+    fake_ssh_client = MagicMock()
+    fake_ssh_client.get_transport().open_session = MagicMock(
+        side_effect=paramiko.ChannelException(2, "open failed")
+    )
+
+    # Act / Assert
+    with pytest.raises(exceptions.AgentUnavailableError):
+        RemoteAgent.start(fake_ssh_client)
+
+
+def test_request__unavailable():
+    # Arrange
+    on_close = MagicMock()
+    agent = RemoteAgent(io.BytesIO(), io.BytesIO(), on_close=on_close)
+
+    # Act
+    with pytest.raises(exceptions.AgentUnavailableError):
+        agent.request([("iterdir", "/")])
+    agent.close()
+
+    # Assert
+    assert agent.closed is True
+    on_close.assert_called_once()
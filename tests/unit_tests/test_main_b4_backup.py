@@ -1,3 +1,5 @@
+import dataclasses
+import textwrap
 from pathlib import PurePath
 from unittest.mock import MagicMock, call, patch
 
@@ -5,7 +7,14 @@ import arrow
 import pytest
 
 from b4_backup import exceptions
-from b4_backup.config_schema import TargetRestoreStrategy
+from b4_backup.config_schema import (
+    SubvolumeBackupStrategy,
+    SubvolumeFallbackStrategy,
+    SubvolumeUnchangedStrategy,
+    TargetRestoreStrategy,
+    TargetSubvolume,
+)
+from b4_backup.main import retention
 from b4_backup.main.b4_backup import B4Backup
 from b4_backup.main.backup_target_host import (
     BackupTargetHost,
@@ -20,8 +29,8 @@ from b4_backup.main.dataclass import (
 )
 
 
-def _parse_dates(dates: list[str]) -> list[arrow.Arrow]:
-    return [arrow.get(x.split("_")[0], B4Backup._timestamp_fmt) for x in dates]
+def _parse_dates(dates: list[str]) -> list[int]:
+    return [retention.parse_timestamp(x.split("_")[0]) for x in dates]
 
 
 @pytest.mark.parametrize(("use_dst_host"), [True, False])
@@ -33,13 +42,102 @@ def test_backup(use_dst_host: bool, monkeypatch: pytest.MonkeyPatch):
     monkeypatch.setattr(b4_backup, "clean", MagicMock())
 
     # Act
-    b4_backup.backup(fake_src_host, fake_dst_host if use_dst_host else None, "alpha_manual")
+    b4_backup.backup(
+        fake_src_host, fake_dst_host if use_dst_host else None, "2023-08-07-22-00-00_manual"
+    )
 
     # Assert
     assert fake_src_host.create_snapshot.called
     assert fake_src_host.send_snapshot.called is use_dst_host
 
 
+def test_backup__nothing_changed(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    b4_backup = B4Backup("UTC")
+    fake_src_host = MagicMock()
+    fake_src_host.create_snapshot.return_value = None
+    fake_clean = MagicMock()
+    monkeypatch.setattr(b4_backup, "clean", fake_clean)
+
+    # Act
+    b4_backup.backup(fake_src_host, MagicMock(), "2023-08-07-22-00-00_manual")
+
+    # Assert
+    assert fake_src_host.send_snapshot.called is False
+    assert fake_clean.called is True
+
+
+@pytest.mark.parametrize(
+    ("dst_snapshot_names", "expect_skipped"),
+    [
+        # The last snapshot containing /pictures survives the retention (all: "4")
+        (["2023-08-07-18-00-00_test", "2023-08-07-21-00-00_test"], True),
+        # The retention deletes it after the backup
+        (
+            [
+                "2023-08-07-18-00-00_test",
+                "2023-08-07-19-00-00_test",
+                "2023-08-07-20-00-00_test",
+                "2023-08-07-21-00-00_test",
+            ],
+            False,
+        ),
+    ],
+)
+def test_backup__skip_unchanged(
+    src_host: SourceBackupTargetHost,
+    dst_host: DestinationBackupTargetHost,
+    monkeypatch: pytest.MonkeyPatch,
+    dst_snapshot_names: list[str],
+    expect_skipped: bool,
+):
+    # Arrange
+    b4_backup = B4Backup("UTC")
+    monkeypatch.setattr(b4_backup, "clean", MagicMock())
+    monkeypatch.setattr(src_host, "send_snapshot", MagicMock())
+    monkeypatch.setattr(src_host.connection, "location", PurePath("/opt/home"))
+    src_host.target_config = dataclasses.replace(
+        src_host.target_config,
+        subvolume_rules={
+            "/pictures": TargetSubvolume(
+                backup_strategy=SubvolumeBackupStrategy.FULL,
+                fallback_strategy=SubvolumeFallbackStrategy.DROP,
+                unchanged_strategy=SubvolumeUnchangedStrategy.SKIP,
+            )
+        },
+    )
+    snapshot_dir = ".b4_backup/snapshots/localhost/home"
+    fake_run_process = MagicMock(
+        return_value=textwrap.dedent(
+            f"""
+            ID 256 gen 30 top level 5 parent_uuid - received_uuid - uuid L1 path home
+            ID 257 gen 12 top level 256 parent_uuid - received_uuid - uuid L2 path home/pictures
+            ID 300 gen 20 top level 5 parent_uuid L1 received_uuid - uuid S1 path {snapshot_dir}/2023-08-07-18-00-00_test/!
+            ID 301 gen 20 top level 5 parent_uuid L2 received_uuid - uuid S2 path {snapshot_dir}/2023-08-07-18-00-00_test/!pictures
+            ID 302 gen 25 top level 5 parent_uuid L1 received_uuid - uuid S3 path {snapshot_dir}/2023-08-07-21-00-00_test/!
+            """
+        )
+    )
+    monkeypatch.setattr(src_host.connection, "run_process", fake_run_process)
+    monkeypatch.setattr(
+        dst_host, "snapshots", MagicMock(return_value=dict.fromkeys(dst_snapshot_names))
+    )
+
+    # Act
+    b4_backup.backup(src_host, dst_host, "2023-08-07-22-00-00_test")
+
+    # Assert
+    snapshotted = [
+        x.args[0][-1]
+        for x in fake_run_process.call_args_list
+        if x.args[0][:3] == ["btrfs", "subvolume", "snapshot"]
+    ]
+    assert (f"/opt/{snapshot_dir}/2023-08-07-22-00-00_test/!pictures" not in snapshotted) is (
+        expect_skipped
+    )
+    assert f"/opt/{snapshot_dir}/2023-08-07-22-00-00_test/!" in snapshotted
+
+
 def test_restore__rollback():
     # Arrange
     b4_backup = B4Backup("UTC")
@@ -122,7 +220,32 @@ def test_sync(fake_clean: MagicMock):
 
     # Assert
     assert fake_clean.call_count == 2
-    assert fake_src_host.send_snapshot.call_count == 1
+    assert fake_src_host.send_snapshot.call_args_list == [
+        call(fake_dst_host, "alpha", parent_snapshot_name=None)
+    ]
+
+
+@pytest.mark.parametrize(
+    ("src_snapshots", "dst_snapshots", "expect"),
+    [
+        (["1", "2", "3"], [], [("1", None), ("2", "1"), ("3", "2")]),
+        (["3", "1", "4", "2"], ["1"], [("2", "1"), ("3", "2"), ("4", "3")]),
+        (["1", "2", "3", "4"], ["1", "3"], [("2", "1"), ("4", "3")]),
+        (["1", "2", "3"], ["3", "5"], [("1", "3"), ("2", "1")]),
+        (["1", "2"], ["1", "2"], []),
+    ],
+)
+def test_plan_sync(
+    src_snapshots: list[str], dst_snapshots: list[str], expect: list[tuple[str, str | None]]
+):
+    # Arrange
+    b4_backup = B4Backup("UTC")
+
+    # Act
+    result = b4_backup._plan_sync(src_snapshots, dst_snapshots)
+
+    # Assert
+    assert result == expect
 
 
 def test_clean(src_host: SourceBackupTargetHost, monkeypatch: pytest.MonkeyPatch):
@@ -140,6 +263,23 @@ def test_clean(src_host: SourceBackupTargetHost, monkeypatch: pytest.MonkeyPatch
     assert b4_backup._clean_replace.called is True  # type: ignore
 
 
+def test_clean__catalog(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    b4_backup = B4Backup("UTC")
+    monkeypatch.setattr(b4_backup, "_clean_target", MagicMock())
+    monkeypatch.setattr(b4_backup, "_clean_replace", MagicMock())
+    monkeypatch.setattr(b4_backup, "_clean_empty_dirs", MagicMock())
+    src_host = MagicMock()
+    dst_host = MagicMock()
+
+    # Act
+    b4_backup.clean(src_host, dst_host)
+
+    # Assert
+    src_host.update_catalog.assert_called_once_with()
+    dst_host.update_catalog.assert_called_once_with()
+
+
 def test_delete(src_host: SourceBackupTargetHost, monkeypatch: pytest.MonkeyPatch):
     # Arrange
     b4_backup = B4Backup("UTC")
@@ -185,8 +325,8 @@ def test_delete_all(src_host: SourceBackupTargetHost, monkeypatch: pytest.Monkey
     # Arrange
     retention_name_choice = ChoiceSelector(["test"])
     b4_backup = B4Backup("UTC")
-    fake_delete_snapshot = MagicMock()
-    monkeypatch.setattr(src_host, "delete_snapshot", fake_delete_snapshot)
+    fake_delete_snapshots = MagicMock()
+    monkeypatch.setattr(src_host, "delete_snapshots", fake_delete_snapshots)
     monkeypatch.setattr(
         src_host,
         "snapshots",
@@ -206,10 +346,13 @@ def test_delete_all(src_host: SourceBackupTargetHost, monkeypatch: pytest.Monkey
     b4_backup.delete_all(src_host, retention_name_choice)
 
     # Assert
-    print(fake_delete_snapshot.call_args_list)
-    assert [x.args[0].name for x in fake_delete_snapshot.call_args_list] == [
-        "alpha_test",
-        "beta_test",
+    fake_delete_snapshots.assert_called_once()
+    assert [
+        (snapshot.name, subvolumes)
+        for snapshot, subvolumes in fake_delete_snapshots.call_args.args[0]
+    ] == [
+        ("alpha_test", None),
+        ("beta_test", None),
     ]
 
 
@@ -545,14 +688,9 @@ def test_create_fallback_subvolume(
                         "subvolume",
                         "delete",
                         "/opt/.b4_backup/snapshots/localhost/home/2023-08-07-22-00-00_test_clean/!",
-                    ]
-                ),
-                call(
-                    [
-                        "btrfs",
-                        "subvolume",
-                        "delete",
                         "/opt/.b4_backup/snapshots/localhost/home/2023-08-07-22-00-00_test_clean/!test",
+                        "/opt/.b4_backup/snapshots/localhost/home/2023-08-07-21-00-00_test_clean/!test",
+                        "/opt/.b4_backup/snapshots/localhost/home/2023-08-07-22-15-00_test_clean/!test",
                     ]
                 ),
                 call(
@@ -561,22 +699,6 @@ def test_create_fallback_subvolume(
                         "/opt/.b4_backup/snapshots/localhost/home/2023-08-07-22-00-00_test_clean",
                     ]
                 ),
-                call(
-                    [
-                        "btrfs",
-                        "subvolume",
-                        "delete",
-                        "/opt/.b4_backup/snapshots/localhost/home/2023-08-07-21-00-00_test_clean/!test",
-                    ]
-                ),
-                call(
-                    [
-                        "btrfs",
-                        "subvolume",
-                        "delete",
-                        "/opt/.b4_backup/snapshots/localhost/home/2023-08-07-22-15-00_test_clean/!test",
-                    ]
-                ),
             ],
         ),
         (
@@ -595,14 +717,8 @@ def test_create_fallback_subvolume(
                         "subvolume",
                         "delete",
                         "/opt/.b4_backup/snapshots/localhost/home/2023-08-07-21-00-00_test_clean/!",
-                    ]
-                ),
-                call(
-                    [
-                        "btrfs",
-                        "subvolume",
-                        "delete",
                         "/opt/.b4_backup/snapshots/localhost/home/2023-08-07-21-00-00_test_clean/!test",
+                        "/opt/.b4_backup/snapshots/localhost/home/2023-08-07-21-15-00_test_clean/!test",
                     ]
                 ),
                 call(
@@ -611,14 +727,6 @@ def test_create_fallback_subvolume(
                         "/opt/.b4_backup/snapshots/localhost/home/2023-08-07-21-00-00_test_clean",
                     ]
                 ),
-                call(
-                    [
-                        "btrfs",
-                        "subvolume",
-                        "delete",
-                        "/opt/.b4_backup/snapshots/localhost/home/2023-08-07-21-15-00_test_clean/!test",
-                    ]
-                ),
             ],
             [],
         ),
@@ -729,7 +837,7 @@ def test_apply_retention(
         ),
     )
     fake_src_delete_snapshots = MagicMock()
-    monkeypatch.setattr(src_host, "delete_snapshot", fake_src_delete_snapshots)
+    monkeypatch.setattr(src_host, "delete_snapshots", fake_src_delete_snapshots)
 
     # Act
     b4_backup._apply_retention(
@@ -750,22 +858,23 @@ def test_apply_retention(
     )
 
     # Assert
-    print(fake_src_delete_snapshots.call_args_list)
-    assert fake_src_delete_snapshots.call_args_list == [
-        call(
+    fake_src_delete_snapshots.assert_called_once()
+    assert fake_src_delete_snapshots.call_args.args[0] == [
+        (
             Snapshot(
                 name="2023-08-07-20-00-00_auto",
                 subvolumes=[src_host.path("!"), src_host.path("!test")],
                 base_path=src_host.path("/opt/.b4_backup/snapshots/localhost/home"),
-            )
+            ),
+            None,
         ),
-        call(
+        (
             Snapshot(
                 name="2023-08-07-21-00-00_auto",
                 subvolumes=[src_host.path("!"), src_host.path("!test")],
                 base_path=src_host.path("/opt/.b4_backup/snapshots/localhost/home"),
             ),
-            subvolumes=[src_host.path("!test")],
+            [src_host.path("!test")],
         ),
     ]
 
@@ -805,7 +914,7 @@ def test_apply_retention__destination(
         ),
     )
     fake_src_delete_snapshots = MagicMock()
-    monkeypatch.setattr(dst_host, "delete_snapshot", fake_src_delete_snapshots)
+    monkeypatch.setattr(dst_host, "delete_snapshots", fake_src_delete_snapshots)
 
     # Act
     b4_backup._apply_retention(
@@ -820,30 +929,31 @@ def test_apply_retention__destination(
     )
 
     # Assert
-    print(fake_src_delete_snapshots.call_args_list)
-    assert fake_src_delete_snapshots.call_args_list == [
-        call(
+    fake_src_delete_snapshots.assert_called_once()
+    assert fake_src_delete_snapshots.call_args.args[0] == [
+        (
             Snapshot(
                 name="2023-08-07-20-00-00_auto",
                 subvolumes=[dst_host.path("!"), dst_host.path("!test")],
                 base_path=dst_host.path("/opt/.b4_backup/snapshots/localhost/home"),
-            )
+            ),
+            None,
         ),
-        call(
+        (
             Snapshot(
                 name="2023-08-07-21-00-00_auto",
                 subvolumes=[dst_host.path("!"), dst_host.path("!test")],
                 base_path=dst_host.path("/opt/.b4_backup/snapshots/localhost/home"),
             ),
-            subvolumes=[dst_host.path("!test")],
+            [dst_host.path("!test")],
         ),
-        call(
+        (
             Snapshot(
                 name="2023-08-07-22-00-00_auto",
                 subvolumes=[dst_host.path("!"), dst_host.path("!test")],
                 base_path=dst_host.path("/opt/.b4_backup/snapshots/localhost/home"),
             ),
-            subvolumes=[dst_host.path("!test")],
+            [dst_host.path("!test")],
         ),
     ]
 
@@ -932,7 +1042,9 @@ def test_clean_replace(
     b4_backup._clean_replace(src_host)
 
     # Assert
-    assert [str(x.args[1]) for x in fake_src_rem_repl_targets.call_args_list] == expect
+    assert [
+        str(target) for x in fake_src_rem_repl_targets.call_args_list for target in x.args[1]
+    ] == expect
 
 
 @pytest.mark.parametrize(("use_dst_host"), [True, False])
@@ -965,13 +1077,11 @@ def test_remove_replaced_targets(
     b4_backup = B4Backup("UTC")
 
     # Act
-    b4_backup._remove_replaced_targets(src_host, PurePath("/test"))
+    b4_backup._remove_replaced_targets(src_host, [PurePath("/test")])
 
     # Assert
     assert fake_src_run_proc.call_args_list == [
-        call(["btrfs", "subvolume", "delete", "/test/a/b"]),
-        call(["btrfs", "subvolume", "delete", "/test/b"]),
-        call(["btrfs", "subvolume", "delete", "/test/a"]),
+        call(["btrfs", "subvolume", "delete", "/test/a/b", "/test/b", "/test/a"]),
     ]
 
 
@@ -1132,39 +1242,90 @@ def test_apply_retention_rule(
     assert result == _parse_dates(expect)
 
 
+def _reference_retained_snapshots(
+    b4_backup: B4Backup, snapshot_names: list[str], rules: dict[str, str], now: arrow.Arrow
+) -> set[str]:
+    """The original arrow based retention implementation, used as golden reference."""
+    dates = [arrow.get(x.split("_")[0], B4Backup._timestamp_fmt) for x in snapshot_names]
+
+    remaining_backups: set[arrow.Arrow] = set()
+    for interval_str, duration_str in rules.items():
+        interval_size, interval_magnitude = retention.parse_timebox(interval_str, is_interval=True)
+        duration_size, duration_magnitude = retention.parse_timebox(duration_str, is_interval=False)
+
+        remaining: list[arrow.Arrow] = []
+        for date in sorted(dates, reverse=True):
+            if duration_magnitude != "forever" and (
+                (
+                    duration_magnitude is not None
+                    and date
+                    < now.to(b4_backup.timezone).shift(**{duration_magnitude: -duration_size})
+                )
+                or (duration_magnitude is None and len(remaining) >= duration_size)
+            ):
+                break
+
+            if not remaining or interval_magnitude == "all":
+                remaining.append(date)
+                continue
+
+            assert interval_magnitude is not None
+            min_box, max_box = (
+                remaining[-1]
+                .shift(**{interval_magnitude: 1 - interval_size})
+                .span(interval_magnitude, count=interval_size)  # type: ignore
+            )
+            if date < min_box or date >= max_box:
+                remaining.append(date)
+
+        remaining_backups.update(remaining)
+
+    return {x.format(B4Backup._timestamp_fmt) for x in remaining_backups}
+
+
+@pytest.mark.parametrize("timezone", ["UTC", "Europe/Berlin"])
 @pytest.mark.parametrize(
-    ("timebox", "is_interval", "expect"),
+    "rules",
     [
-        ("4days", True, (4, "days")),
-        ("4days", False, (4, "days")),
-        ("all", True, (0, "all")),
-        ("forever", False, (0, "forever")),
-        ("1year", False, (1, "years")),
-        ("5weeks", False, (5, "weeks")),
-        ("5", False, (5, None)),
+        {"all": "3"},
+        {"all": "36hours"},
+        {"1hour": "2days", "1day": "1month", "1week": "3months", "1month": "forever"},
+        {"3hours": "10days", "2days": "10weeks", "2weeks": "1year", "1year": "forever"},
+        {"1minute": "30minutes", "15minutes": "6hours", "3months": "2years"},
+        {"2months": "20", "1day": "0days", "30seconds": "45"},
     ],
 )
-def test_timebox_str_extract__success(
-    timebox: str, is_interval: bool, expect: tuple[int, str | None]
-):
+def test_retained_snapshots__golden(timezone: str, rules: dict[str, str]):
     # Arrange
-    b4_backup = B4Backup("UTC")
+    now = arrow.get("2024-03-31-01-30-00", B4Backup._timestamp_fmt)
+    b4_backup = B4Backup(timezone, now=now)
+    timestamp = now.shift(years=-3)
+    snapshot_names = []
+    step = 0
+    while timestamp < now:
+        snapshot_names.append(timestamp.format(B4Backup._timestamp_fmt))
+        step += 1
+        # Irregular steps between 17 seconds and 18 hours, much denser during the last two days
+        max_step = 64800 if timestamp < now.shift(days=-2) else 900
+        timestamp = timestamp.shift(seconds=17 + (step * 7919) % max_step)
 
     # Act
-    result = b4_backup._timebox_str_extract(timebox, is_interval=is_interval)
+    result = b4_backup._retained_snapshots(snapshot_names, rules)
 
     # Assert
-    assert result == expect
+    assert len(snapshot_names) > 1000
+    assert result == _reference_retained_snapshots(b4_backup, snapshot_names, rules, now)
 
 
-@pytest.mark.parametrize(
-    ("timebox", "is_interval"),
-    [("what4", True), ("all", False), ("forever", True)],
-)
-def test_timebox_str_extract__error(timebox: str, is_interval: bool):
+def test_retained_snapshots__fixed_clock(monkeypatch: pytest.MonkeyPatch):
     # Arrange
+    fake_utcnow = MagicMock(return_value=arrow.get("2023-08-07-23-59-37", B4Backup._timestamp_fmt))
+    monkeypatch.setattr(arrow, "utcnow", fake_utcnow)
     b4_backup = B4Backup("UTC")
 
-    # Act / Assert
-    with pytest.raises(exceptions.InvalidRetentionRuleError):
-        b4_backup._timebox_str_extract(timebox, is_interval=is_interval)
+    # Act
+    for _ in range(3):
+        b4_backup._retained_snapshots(["2023-08-07-22-59-37_auto"], {"1day": "1week"}, "auto")
+
+    # Assert
+    assert fake_utcnow.call_count == 1
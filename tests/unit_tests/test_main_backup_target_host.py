@@ -1,23 +1,43 @@
 import contextlib
+import dataclasses
+import logging
+import shlex
+import subprocess
 import tempfile
 import textwrap
+import threading
 from pathlib import Path, PurePath
-from unittest.mock import MagicMock, call
+from unittest.mock import ANY, MagicMock, call
 
+import paramiko
 import pytest
 
 from b4_backup import exceptions
-from b4_backup.config_schema import BaseConfig
+from b4_backup.config_schema import (
+    BaseConfig,
+    SubvolumeBackupStrategy,
+    SubvolumeFallbackStrategy,
+    SubvolumeUnchangedStrategy,
+    TargetSubvolume,
+    TransferCompression,
+    TransferMode,
+)
+from b4_backup.main import backup_target_host
 from b4_backup.main.backup_target_host import (
     BackupTargetHost,
     DestinationBackupTargetHost,
     SourceBackupTargetHost,
     _connection_sort_key,
+    _host_semaphores,
     _mark_keep_open,
     host_generator,
+    run_targets,
 )
 from b4_backup.main.connection import Connection, LocalConnection, SSHConnection
 from b4_backup.main.dataclass import ChoiceSelector, Snapshot
+from b4_backup.main.inventory import SubvolumeInfo
+from b4_backup.main.transfer import TransferStats
+from b4_backup.utils import PathMatcher
 
 
 class TestBackupTargetHost:
@@ -81,8 +101,8 @@ class TestBackupTargetHost:
         # Arrange
         mount_result = textwrap.dedent(
             """
-            /dev/sda1 on /boot type ext4 (rw,relatime)
-            /dev/sda3 on / type btrfs (rw,relatime,discard=async,space_cache=v2,subvolid=5,subvol=/)
+            22 1 0:21 / / rw,relatime shared:1 - btrfs /dev/sda3 rw,space_cache=v2,subvolid=5,subvol=/
+            23 22 8:1 / /boot rw,relatime shared:2 - ext4 /dev/sda1 rw
             """
         )
         monkeypatch.setattr(
@@ -94,6 +114,9 @@ class TestBackupTargetHost:
 
         # Assert
         assert result == PurePath("/")
+        dst_host.connection.run_process.assert_called_once_with(  # type: ignore
+            ["cat", "/proc/self/mountinfo"]
+        )
 
     def test_mount_point__error(
         self,
@@ -103,8 +126,8 @@ class TestBackupTargetHost:
         # Arrange
         mount_result = textwrap.dedent(
             """
-            /dev/sda1 on /boot type ext4 (rw,relatime)
-            /dev/sda3 on /idontexist type btrfs (rw,relatime,discard=async,space_cache=v2,subvolid=5,subvol=/)
+            22 1 8:1 / /boot rw,relatime shared:2 - ext4 /dev/sda1 rw
+            23 1 0:21 / /idontexist rw,relatime shared:1 - btrfs /dev/sda3 rw,subvolid=5,subvol=/
             """
         )
         monkeypatch.setattr(
@@ -145,13 +168,13 @@ class TestBackupTargetHost:
         # Arrange
         with tempfile.TemporaryDirectory() as _tmp_dir:
             tmp_dir = Path(_tmp_dir)
-            subvolumes = [tmp_dir / "a/subvol"]
+            subvolumes = [tmp_dir / "a/subvol", tmp_dir / "b/[sub]*vol"]
             monkeypatch.setattr(
                 src_host,
                 "subvolumes",
-                MagicMock(return_value=[src_host.path(x) for x in subvolumes]),
+                MagicMock(return_value=[src_host.path(x) for x in [Path("/other"), *subvolumes]]),
             )
-            for dir in ["a/", "a/subvol", "a/test"]:
+            for dir in ["a/", "a/subvol", "a/test", "a/test/c", "b", "b/[sub]*vol", "b/subvol"]:
                 (tmp_dir / dir).mkdir()
                 (tmp_dir / "file.txt").touch()
 
@@ -160,11 +183,56 @@ class TestBackupTargetHost:
             print(result)
 
             # Assert
-            assert result is False
+            assert sorted(result) == [tmp_dir / x for x in ["a/test", "a/test/c", "b/subvol"]]
+            assert result.index(tmp_dir / "a/test/c") < result.index(tmp_dir / "a/test")
             assert not (tmp_dir / "a/test").exists()
+            assert not (tmp_dir / "b/subvol").exists()
             assert (tmp_dir / "a/subvol").exists()
+            assert (tmp_dir / "b/[sub]*vol").exists()
             assert (tmp_dir / "file.txt").exists()
 
+    def test_update_catalog(
+        self,
+        src_host: BackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        # Arrange
+        src_host.catalog = MagicMock()
+        run_process_result = textwrap.dedent(
+            """
+            ID 256 gen 12 top level 5 parent_uuid 0b5a received_uuid - uuid 4d2f path .b4_backup/snapshots/localhost/home/alpha/!
+            ID 257 gen 13 top level 5 parent_uuid - received_uuid - uuid 7a3c path home
+            """
+        )
+        monkeypatch.setattr(
+            src_host.connection, "run_process", MagicMock(return_value=run_process_result)
+        )
+
+        # Act
+        src_host.update_catalog()
+
+        # Assert
+        src_host.catalog.reconcile.assert_called_once_with(
+            "localhost/home",
+            "source",
+            [("alpha", "!", SubvolumeInfo(id=256, generation=12, uuid="4d2f", parent_uuid="0b5a"))],
+        )
+
+    def test_update_catalog__disabled(
+        self,
+        src_host: BackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        # Arrange
+        fake_run_process = MagicMock()
+        monkeypatch.setattr(src_host.connection, "run_process", fake_run_process)
+
+        # Act
+        src_host.update_catalog()
+
+        # Assert
+        fake_run_process.assert_not_called()
+
     def test_group_subvolumes(self, src_host: BackupTargetHost):
         # Arrange
         subvolumes = [
@@ -262,13 +330,14 @@ class TestBackupTargetHost:
         print(fake_run_process.call_args_list)
         assert fake_run_process.call_args_list == [
             call(
-                ["btrfs", "subvolume", "delete", "/opt/.b4_backup/snapshots/localhost/home/alpha"]
-            ),
-            call(
-                ["btrfs", "subvolume", "delete", "/opt/.b4_backup/snapshots/localhost/home/alpha/a"]
-            ),
-            call(
-                ["btrfs", "subvolume", "delete", "/opt/.b4_backup/snapshots/localhost/home/alpha/b"]
+                [
+                    "btrfs",
+                    "subvolume",
+                    "delete",
+                    "/opt/.b4_backup/snapshots/localhost/home/alpha",
+                    "/opt/.b4_backup/snapshots/localhost/home/alpha/a",
+                    "/opt/.b4_backup/snapshots/localhost/home/alpha/b",
+                ]
             ),
             call(["rmdir", "/opt/.b4_backup/snapshots/localhost/home/alpha"]),
         ]
@@ -302,6 +371,117 @@ class TestBackupTargetHost:
             )
         ]
 
+    def test_delete_snapshot__error(
+        self,
+        src_host: BackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        # Arrange
+        snapshot = Snapshot(
+            name="alpha",
+            subvolumes=[src_host.path("."), src_host.path("a")],
+            base_path=src_host.path("/opt/.b4_backup/snapshots/localhost/home"),
+        )
+        monkeypatch.setattr(
+            src_host.connection,
+            "run_process",
+            MagicMock(side_effect=exceptions.FailedProcessError(["false"])),
+        )
+        fake_inventory = MagicMock()
+        monkeypatch.setattr(src_host, "inventory", MagicMock(return_value=fake_inventory))
+
+        # Act
+        with pytest.raises(exceptions.FailedProcessError):
+            src_host.delete_snapshot(snapshot)
+
+        # Assert
+        assert fake_inventory.invalidate.called is True
+        assert fake_inventory.remove.called is False
+
+    def test_delete_snapshots(
+        self,
+        src_host: BackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        # Arrange
+        snapshots = [
+            Snapshot(
+                name=x,
+                subvolumes=[src_host.path("."), src_host.path("a")],
+                base_path=src_host.path("/opt/.b4_backup/snapshots/localhost/home"),
+            )
+            for x in ["alpha", "beta", "gamma"]
+        ]
+        fake_run_process = MagicMock()
+        monkeypatch.setattr(src_host.connection, "run_process", fake_run_process)
+
+        # Act
+        src_host.delete_snapshots(
+            [
+                (snapshots[0], None),
+                (snapshots[1], [src_host.path("a")]),
+                (snapshots[2], None),
+            ]
+        )
+
+        # Assert
+        assert fake_run_process.call_args_list == [
+            call(
+                [
+                    "btrfs",
+                    "subvolume",
+                    "delete",
+                    "/opt/.b4_backup/snapshots/localhost/home/alpha",
+                    "/opt/.b4_backup/snapshots/localhost/home/alpha/a",
+                    "/opt/.b4_backup/snapshots/localhost/home/beta/a",
+                    "/opt/.b4_backup/snapshots/localhost/home/gamma",
+                    "/opt/.b4_backup/snapshots/localhost/home/gamma/a",
+                ]
+            ),
+            call(
+                [
+                    "rmdir",
+                    "/opt/.b4_backup/snapshots/localhost/home/alpha",
+                    "/opt/.b4_backup/snapshots/localhost/home/gamma",
+                ]
+            ),
+        ]
+
+    def test_delete_subvolumes(
+        self,
+        src_host: BackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        # Arrange
+        monkeypatch.setattr(backup_target_host, "_DELETE_CHUNK_SIZE", 2)
+        src_host.target_config.delete_commit_after = True
+        fake_run_process = MagicMock()
+        monkeypatch.setattr(src_host.connection, "run_process", fake_run_process)
+
+        # Act
+        src_host.delete_subvolumes([src_host.path(f"/opt/{x}") for x in "abc"])
+
+        # Assert
+        assert fake_run_process.call_args_list == [
+            call(["btrfs", "subvolume", "delete", "--commit-after", "/opt/a", "/opt/b"]),
+            call(["btrfs", "subvolume", "delete", "--commit-after", "/opt/c"]),
+        ]
+
+    def test_delete_subvolumes__empty(
+        self,
+        src_host: BackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        # Arrange
+        fake_run_process = MagicMock()
+        monkeypatch.setattr(src_host.connection, "run_process", fake_run_process)
+
+        # Act
+        src_host.delete_subvolumes([])
+
+        # Assert
+        assert fake_run_process.called is False
+
     @pytest.mark.parametrize(
         ("snapshot_name", "src_group_names", "dst_group_names", "expected_result"),
         [
@@ -365,7 +545,14 @@ class TestBackupTargetHost:
             src_host.path("/opt/bravo/a"),
             src_host.path("/opt/charlie"),
         ]
-        ignored_paths = [PurePath("alpha"), PurePath("bravo"), PurePath("charlie")]
+        rule_matcher = PathMatcher(
+            [
+                (PurePath("alpha"), True),
+                (PurePath("bravo"), True),
+                (PurePath("charlie"), True),
+                (PurePath("/opt/mad"), False),
+            ]
+        )
         expect = [
             src_host.path("/opt/alpha/a"),
             src_host.path("/opt/bravo/a"),
@@ -373,7 +560,7 @@ class TestBackupTargetHost:
         ]
 
         # Act
-        result = src_host._filter_subvolumes(subvolumes, ignored_paths)
+        result = src_host._filter_subvolumes(subvolumes, rule_matcher, bool)
 
         # Assert
         assert list(result) == expect
@@ -438,22 +625,25 @@ class TestBackupTargetHost:
                         [
                             "bash",
                             "-c",
-                            "btrfs send -p '/opt/.b4_backup/snapshots/localhost/home/alpha/!' '/opt/.b4_backup/snapshots/localhost/home/bravo/!' | btrfs receive /opt/b4/snapshots/localhost/home/bravo",
-                        ]
+                            "btrfs send -p '/opt/.b4_backup/snapshots/localhost/home/alpha/!' '/opt/.b4_backup/snapshots/localhost/home/bravo/!'",
+                        ],
+                        ["bash", "-c", "btrfs receive /opt/b4/snapshots/localhost/home/bravo"],
                     ),
                     call(
                         [
                             "bash",
                             "-c",
-                            "btrfs send -p '/opt/.b4_backup/snapshots/localhost/home/alpha/!b' '/opt/.b4_backup/snapshots/localhost/home/bravo/!b' | btrfs receive /opt/b4/snapshots/localhost/home/bravo",
-                        ]
+                            "btrfs send -p '/opt/.b4_backup/snapshots/localhost/home/alpha/!b' '/opt/.b4_backup/snapshots/localhost/home/bravo/!b'",
+                        ],
+                        ["bash", "-c", "btrfs receive /opt/b4/snapshots/localhost/home/bravo"],
                     ),
                     call(
                         [
                             "bash",
                             "-c",
-                            "btrfs send -p '/opt/.b4_backup/snapshots/localhost/home/alpha/!b!a' '/opt/.b4_backup/snapshots/localhost/home/bravo/!b!a' | btrfs receive /opt/b4/snapshots/localhost/home/bravo",
-                        ]
+                            "btrfs send -p '/opt/.b4_backup/snapshots/localhost/home/alpha/!b!a' '/opt/.b4_backup/snapshots/localhost/home/bravo/!b!a'",
+                        ],
+                        ["bash", "-c", "btrfs receive /opt/b4/snapshots/localhost/home/bravo"],
                     ),
                 ],
             ),
@@ -467,22 +657,25 @@ class TestBackupTargetHost:
                         [
                             "bash",
                             "-c",
-                            "btrfs send '/opt/.b4_backup/snapshots/localhost/home/bravo/!' | btrfs receive /opt/b4/snapshots/localhost/home/bravo",
-                        ]
+                            "btrfs send '/opt/.b4_backup/snapshots/localhost/home/bravo/!'",
+                        ],
+                        ["bash", "-c", "btrfs receive /opt/b4/snapshots/localhost/home/bravo"],
                     ),
                     call(
                         [
                             "bash",
                             "-c",
-                            "btrfs send '/opt/.b4_backup/snapshots/localhost/home/bravo/!b' | btrfs receive /opt/b4/snapshots/localhost/home/bravo",
-                        ]
+                            "btrfs send '/opt/.b4_backup/snapshots/localhost/home/bravo/!b'",
+                        ],
+                        ["bash", "-c", "btrfs receive /opt/b4/snapshots/localhost/home/bravo"],
                     ),
                     call(
                         [
                             "bash",
                             "-c",
-                            "btrfs send '/opt/.b4_backup/snapshots/localhost/home/bravo/!b!a' | btrfs receive /opt/b4/snapshots/localhost/home/bravo",
-                        ]
+                            "btrfs send '/opt/.b4_backup/snapshots/localhost/home/bravo/!b!a'",
+                        ],
+                        ["bash", "-c", "btrfs receive /opt/b4/snapshots/localhost/home/bravo"],
                     ),
                 ],
             ),
@@ -500,13 +693,15 @@ class TestBackupTargetHost:
         expect_send: list,
     ):
         # Arrange
+        monkeypatch.setattr(src_host, "_uuid_parent_subvolumes", MagicMock(return_value={}))
+        monkeypatch.setattr(src_host, "_clone_sources", MagicMock(return_value={}))
         send_con = LocalConnection(PurePath())
         fake_src_run_proc = MagicMock()
         fake_dst_run_proc = MagicMock()
-        fake_send_run_proc = MagicMock()
+        fake_pump = MagicMock(return_value=TransferStats(1, 1.0, 1.0, 1.0))
         monkeypatch.setattr(src_host.connection, "run_process", fake_src_run_proc)
         monkeypatch.setattr(dst_host.connection, "run_process", fake_dst_run_proc)
-        monkeypatch.setattr(send_con, "run_process", fake_send_run_proc)
+        monkeypatch.setattr(backup_target_host, "pump", fake_pump)
 
         monkeypatch.setattr(
             src_host,
@@ -551,127 +746,993 @@ class TestBackupTargetHost:
         # Assert
         print(fake_src_run_proc.call_args_list)
         print(fake_dst_run_proc.call_args_list)
-        print(fake_send_run_proc.call_args_list)
+        print(fake_pump.call_args_list)
         assert fake_src_run_proc.call_args_list == expect_src
         assert fake_dst_run_proc.call_args_list == expect_dst
-        assert fake_send_run_proc.call_args_list == expect_send
+        assert fake_pump.call_args_list == expect_send
 
-    def test_send_snapshot__error(
+    def test_send_snapshot__parent(
         self,
         src_host: BackupTargetHost,
         dst_host: BackupTargetHost,
         monkeypatch: pytest.MonkeyPatch,
     ):
         # Arrange
-        monkeypatch.setattr(src_host, "snapshots", MagicMock(return_value={}))
-        monkeypatch.setattr(dst_host, "snapshots", MagicMock(return_value={}))
-
-        # Act / Assert
-        with pytest.raises(exceptions.SnapshotNotFoundError):
-            src_host.send_snapshot(dst_host, "idontexist")
-
+        monkeypatch.setattr(src_host, "_uuid_parent_subvolumes", MagicMock(return_value={}))
+        monkeypatch.setattr(src_host, "_clone_sources", MagicMock(return_value={}))
+        send_con = LocalConnection(PurePath())
+        fake_pump = MagicMock(return_value=TransferStats(1, 1.0, 1.0, 1.0))
+        monkeypatch.setattr(dst_host.connection, "run_process", MagicMock())
+        monkeypatch.setattr(backup_target_host, "pump", fake_pump)
+        snapshots = {
+            x: Snapshot(
+                name=x,
+                subvolumes=[src_host.path("!")],
+                base_path=src_host.path("/opt/.b4_backup/snapshots/localhost/home"),
+            )
+            for x in ["alpha", "bravo", "charlie"]
+        }
+        monkeypatch.setattr(src_host, "snapshots", MagicMock(return_value=snapshots))
+        monkeypatch.setattr(
+            dst_host,
+            "snapshots",
+            MagicMock(return_value={k: v for k, v in snapshots.items() if k != "charlie"}),
+        )
 
-class TestSourceBackupTargetHost:
-    def test_type(self, src_host: SourceBackupTargetHost):
         # Act
-        result = src_host.type
+        src_host.send_snapshot(dst_host, "charlie", send_con=send_con, parent_snapshot_name="alpha")
 
         # Assert
-        assert result == "source"
+        assert fake_pump.call_args_list == [
+            call(
+                [
+                    "bash",
+                    "-c",
+                    "btrfs send -p '/opt/.b4_backup/snapshots/localhost/home/alpha/!' '/opt/.b4_backup/snapshots/localhost/home/charlie/!'",
+                ],
+                ["bash", "-c", "btrfs receive /opt/b4/snapshots/localhost/home/charlie"],
+            )
+        ]
 
-    def test_create_snapshot(
+    def test_send_snapshot__catalog(
         self,
-        src_host: SourceBackupTargetHost,
+        src_host: BackupTargetHost,
+        dst_host: BackupTargetHost,
         monkeypatch: pytest.MonkeyPatch,
     ):
         # Arrange
-        subvolumes = [
-            "/home",
-            "/home/test/.steam",
-            "/home/test/ignored/subvol",
-            "/home/test/pictures",
-        ]
-        fake_src_run_proc = MagicMock()
+        monkeypatch.setattr(src_host, "_uuid_parent_subvolumes", MagicMock(return_value={}))
+        monkeypatch.setattr(src_host, "_clone_sources", MagicMock(return_value={}))
+        src_host.catalog = MagicMock()
+        monkeypatch.setattr(dst_host.connection, "run_process", MagicMock())
         monkeypatch.setattr(
-            src_host, "subvolumes", MagicMock(return_value=[src_host.path(x) for x in subvolumes])
+            backup_target_host, "pump", MagicMock(return_value=TransferStats(42, 1.0, 1.0, 1.0))
+        )
+        snapshots = {
+            x: Snapshot(
+                name=x,
+                subvolumes=[src_host.path(y) for y in subvolumes],
+                base_path=src_host.path("/opt/.b4_backup/snapshots/localhost/home"),
+            )
+            for x, subvolumes in [("alpha", ["!"]), ("bravo", ["!", "!new"])]
+        }
+        monkeypatch.setattr(src_host, "snapshots", MagicMock(return_value=snapshots))
+        monkeypatch.setattr(
+            dst_host, "snapshots", MagicMock(return_value={"alpha": snapshots["alpha"]})
         )
-        monkeypatch.setattr(src_host.connection, "run_process", fake_src_run_proc)
 
         # Act
-        result = src_host.create_snapshot("1")
+        src_host.send_snapshot(dst_host, "bravo", send_con=LocalConnection(PurePath()))
 
         # Assert
-        assert fake_src_run_proc.call_args_list == [
-            call(["mkdir", "/opt/.b4_backup/snapshots/localhost/home/1", "-p"]),
-            call(
-                [
-                    "btrfs",
-                    "subvolume",
-                    "snapshot",
-                    "-r",
-                    "/home",
-                    "/opt/.b4_backup/snapshots/localhost/home/1/!",
-                ]
-            ),
-            call(
-                [
-                    "btrfs",
-                    "subvolume",
-                    "snapshot",
-                    "-r",
-                    "/home/test/.steam",
-                    "/opt/.b4_backup/snapshots/localhost/home/1/!test!.steam",
-                ]
-            ),
-            call(
-                [
-                    "btrfs",
-                    "subvolume",
-                    "snapshot",
-                    "-r",
-                    "/home/test/pictures",
-                    "/opt/.b4_backup/snapshots/localhost/home/1/!test!pictures",
-                ]
-            ),
+        assert src_host.catalog.add_transfer.call_args_list == [
+            call("localhost/home", "bravo", "!", "alpha", 42, ANY),
+            call("localhost/home", "bravo", "!new", None, 42, ANY),
         ]
-        assert result == Snapshot(
-            name="1",
-            subvolumes=[
-                src_host.path("!"),
-                src_host.path("!test!.steam"),
-                src_host.path("!test!pictures"),
-            ],
-            base_path=src_host.path("/opt/.b4_backup/snapshots/localhost/home"),
+
+    def test_uuid_parent_subvolumes(
+        self,
+        src_host: BackupTargetHost,
+        dst_host: BackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        # Arrange
+        snapshot_dir = ".b4_backup/snapshots/localhost/home"
+        run_process_result = textwrap.dedent(
+            f"""
+            ID 300 gen 10 top level 5 parent_uuid L1 received_uuid - uuid S1 path {snapshot_dir}/alpha/!a
+            ID 301 gen 20 top level 5 parent_uuid L1 received_uuid - uuid S2 path {snapshot_dir}/bravo/!a
+            ID 302 gen 25 top level 5 parent_uuid L1 received_uuid - uuid S3 path {snapshot_dir}/charlie/!b
+            ID 303 gen 26 top level 5 parent_uuid L2 received_uuid - uuid S4 path {snapshot_dir}/charlie/!c
+            ID 304 gen 5 top level 5 parent_uuid L2 received_uuid - uuid S5 path {snapshot_dir}/alpha/!c
+            ID 400 gen 3 top level 5 parent_uuid - received_uuid S1 uuid D1 path b4/snapshots/localhost/home/renamed/!a
+            ID 401 gen 4 top level 5 parent_uuid - received_uuid S2 uuid D2 path b4/snapshots/localhost/home/bravo/!a
+            """
+        )
+        # Source and destination share the same filesystem in this test
+        monkeypatch.setattr(
+            src_host.connection, "run_process", MagicMock(return_value=run_process_result)
         )
+        src_snapshots = src_host.snapshots()
 
-    def test_create_snapshot__error(
+        # Act
+        result = src_host._uuid_parent_subvolumes(dst_host, src_snapshots["charlie"], src_snapshots)
+
+        # Assert
+        assert result == {PurePath("!b"): PurePath(f"/opt/{snapshot_dir}/bravo/!a")}
+
+    def test_send_snapshot__transfer_slot(
         self,
-        src_host: SourceBackupTargetHost,
+        src_host: BackupTargetHost,
+        dst_host: BackupTargetHost,
         monkeypatch: pytest.MonkeyPatch,
     ):
         # Arrange
-        subvolumes = []
-        fake_src_run_proc = MagicMock()
+        events = []
+
+        def _slot(name):
+            slot = MagicMock()
+            slot.__enter__.side_effect = lambda *_args: events.append(f"enter {name}")
+            slot.__exit__.side_effect = lambda *_args: events.append(f"exit {name}")
+            return slot
+
+        monkeypatch.setattr(dst_host.connection, "run_process", MagicMock())
         monkeypatch.setattr(
-            src_host, "subvolumes", MagicMock(return_value=[src_host.path(x) for x in subvolumes])
+            src_host,
+            "_send_subvolumes",
+            MagicMock(side_effect=lambda *_args: events.append("send")),
         )
-        monkeypatch.setattr(src_host.connection, "run_process", fake_src_run_proc)
+        monkeypatch.setattr(src_host, "_uuid_parent_subvolumes", MagicMock(return_value={}))
+        monkeypatch.setattr(src_host, "_clone_sources", MagicMock(return_value={}))
+        snapshot = Snapshot(
+            name="alpha",
+            subvolumes=[src_host.path("!")],
+            base_path=src_host.path("/opt/.b4_backup/snapshots/localhost/home"),
+        )
+        monkeypatch.setattr(src_host, "snapshots", MagicMock(return_value={"alpha": snapshot}))
+        monkeypatch.setattr(dst_host, "snapshots", MagicMock(return_value={}))
+        src_host.transfer_slot = _slot("source")
+        dst_host.transfer_slot = _slot("destination")
 
         # Act
-        with pytest.raises(exceptions.BtrfsSubvolumeNotFoundError):
-            src_host.create_snapshot("1")
+        src_host.send_snapshot(dst_host, "alpha", send_con=LocalConnection(PurePath()))
 
+        # Assert
+        assert events == [
+            "enter source",
+            "enter destination",
+            "send",
+            "exit destination",
+            "exit source",
+        ]
+
+    def test_send_subvolumes__parallel(
+        self,
+        src_host: BackupTargetHost,
+        dst_host: BackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        # Arrange
+        fake_send_subvolume = MagicMock()
+        monkeypatch.setattr(src_host, "_send_subvolume", fake_send_subvolume)
+        monkeypatch.setattr(src_host.target_config, "send_parallelism", 4)
+        send_con = LocalConnection(PurePath())
+        parent = src_host.path("/opt/.b4_backup/snapshots/localhost/home/alpha/!")
+        subvolumes = [
+            (src_host.path("!"), parent, []),
+            (src_host.path("!a"), None, [parent]),
+            (src_host.path("!b"), None, []),
+        ]
 
-class TestDestinationBackupTargetHost:
-    def test_type(self, dst_host: DestinationBackupTargetHost):
         # Act
-        result = dst_host.type
+        src_host._send_subvolumes(dst_host, send_con, "bravo", subvolumes)
 
         # Assert
-        assert result == "destination"
+        assert sorted(fake_send_subvolume.call_args_list) == [
+            call(dst_host, send_con, "bravo", src_host.path("!"), parent, []),
+            call(dst_host, send_con, "bravo", src_host.path("!a"), None, [parent]),
+            call(dst_host, send_con, "bravo", src_host.path("!b"), None, []),
+        ]
 
+    def test_send_subvolumes__parallel_error(
+        self,
+        src_host: BackupTargetHost,
+        dst_host: BackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        # Arrange
+        def _send_subvolume(*args):
+            subvol = args[3]
+            if subvol.name != "!b":
+                raise exceptions.FailedProcessError(["btrfs", "send", str(subvol)])
 
-@pytest.mark.parametrize(
+        fake_send_subvolume = MagicMock(side_effect=_send_subvolume)
+        monkeypatch.setattr(src_host, "_send_subvolume", fake_send_subvolume)
+        monkeypatch.setattr(src_host.target_config, "send_parallelism", 2)
+        subvolumes = [(src_host.path(x), None, []) for x in ["!", "!a", "!b"]]
+
+        # Act
+        with pytest.raises(exceptions.SubvolumeSendError) as exc_info:
+            src_host._send_subvolumes(dst_host, LocalConnection(PurePath()), "bravo", subvolumes)
+
+        # Assert
+        # A failed send doesn't stop the remaining ones
+        assert fake_send_subvolume.call_count == 3
+        assert exc_info.value.snapshot_name == "bravo"
+        assert list(exc_info.value.errors) == ["!", "!a"]
+        assert "2 subvolumes of snapshot bravo failed to send" in str(exc_info.value)
+
+    def test_clone_sources(
+        self,
+        src_host: BackupTargetHost,
+        dst_host: BackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        # Arrange
+        snapshot_dir = ".b4_backup/snapshots/localhost/home"
+        run_process_result = textwrap.dedent(
+            f"""
+            ID 256 gen 30 top level 5 parent_uuid - received_uuid - uuid IMG path home/image
+            ID 257 gen 31 top level 5 parent_uuid IMG received_uuid - uuid C1 path home/container1
+            ID 258 gen 32 top level 5 parent_uuid IMG received_uuid - uuid C2 path home/container2
+            ID 259 gen 33 top level 5 parent_uuid - received_uuid - uuid OTHER path home/other
+            ID 300 gen 10 top level 5 parent_uuid C1 received_uuid - uuid S1 path {snapshot_dir}/alpha/!container1
+            ID 301 gen 11 top level 5 parent_uuid OTHER received_uuid - uuid S2 path {snapshot_dir}/alpha/!other
+            ID 302 gen 20 top level 5 parent_uuid OTHER received_uuid - uuid S3 path {snapshot_dir}/bravo/!other
+            ID 303 gen 21 top level 5 parent_uuid IMG received_uuid - uuid S4 path {snapshot_dir}/bravo/!image
+            ID 304 gen 25 top level 5 parent_uuid C2 received_uuid - uuid S5 path {snapshot_dir}/charlie/!container2
+            ID 305 gen 26 top level 5 parent_uuid - received_uuid - uuid S6 path {snapshot_dir}/charlie/!new
+            ID 400 gen 3 top level 5 parent_uuid - received_uuid S1 uuid D1 path b4/snapshots/localhost/home/alpha/!container1
+            ID 401 gen 3 top level 5 parent_uuid - received_uuid S2 uuid D2 path b4/snapshots/localhost/home/alpha/!other
+            ID 402 gen 4 top level 5 parent_uuid - received_uuid S3 uuid D3 path b4/snapshots/localhost/home/bravo/!other
+            ID 403 gen 4 top level 5 parent_uuid - received_uuid S4 uuid D4 path b4/snapshots/localhost/home/bravo/!image
+            """
+        )
+        # Source and destination share the same filesystem in this test
+        monkeypatch.setattr(
+            src_host.connection, "run_process", MagicMock(return_value=run_process_result)
+        )
+        src_snapshots = src_host.snapshots()
+
+        # Act
+        result = src_host._clone_sources(
+            dst_host,
+            src_snapshots["charlie"],
+            [src_host.path("!container2"), src_host.path("!new")],
+            src_snapshots,
+        )
+
+        # Assert
+        assert result == {
+            PurePath("!container2"): [
+                PurePath(f"/opt/{snapshot_dir}/bravo/!image"),
+                PurePath(f"/opt/{snapshot_dir}/alpha/!container1"),
+                PurePath(f"/opt/{snapshot_dir}/bravo/!other"),
+            ],
+            PurePath("!new"): [
+                PurePath(f"/opt/{snapshot_dir}/bravo/!image"),
+                PurePath(f"/opt/{snapshot_dir}/bravo/!other"),
+            ],
+        }
+
+    def test_clone_sources__nothing_sent(
+        self,
+        src_host: BackupTargetHost,
+        dst_host: BackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        # Arrange
+        monkeypatch.setattr(src_host, "_sent_subvolumes", MagicMock(return_value=[]))
+        monkeypatch.setattr(src_host.connection, "run_process", MagicMock(return_value=""))
+        snapshot = Snapshot(
+            name="alpha", subvolumes=[src_host.path("!")], base_path=src_host.path()
+        )
+
+        # Act
+        result = src_host._clone_sources(dst_host, snapshot, snapshot.subvolumes, {})
+        result_no_subvolumes = src_host._clone_sources(dst_host, snapshot, [], {})
+
+        # Assert
+        assert result == {}
+        assert result_no_subvolumes == {}
+
+    @pytest.mark.parametrize("level", [logging.INFO, logging.DEBUG])
+    def test_send_snapshot__clone_sources(
+        self,
+        src_host: BackupTargetHost,
+        dst_host: BackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+        caplog: pytest.LogCaptureFixture,
+        level: int,
+    ):
+        # Arrange
+        caplog.set_level(level)
+        fake_pump = MagicMock(return_value=TransferStats(1_000_000, 1.0, 1.0, 1.0))
+        fake_run_process = MagicMock(
+            return_value="     Total   Exclusive  Set shared  Filename\n  5000000  0  5000000  /opt\n"
+        )
+        monkeypatch.setattr(src_host.connection, "run_process", fake_run_process)
+        monkeypatch.setattr(dst_host.connection, "run_process", MagicMock())
+        monkeypatch.setattr(backup_target_host, "pump", fake_pump)
+        snapshot = Snapshot(
+            name="bravo",
+            subvolumes=[src_host.path("!")],
+            base_path=src_host.path("/opt/.b4_backup/snapshots/localhost/home"),
+        )
+        monkeypatch.setattr(src_host, "snapshots", MagicMock(return_value={"bravo": snapshot}))
+        monkeypatch.setattr(dst_host, "snapshots", MagicMock(return_value={}))
+        monkeypatch.setattr(src_host, "_uuid_parent_subvolumes", MagicMock(return_value={}))
+        monkeypatch.setattr(
+            src_host,
+            "_clone_sources",
+            MagicMock(
+                return_value={
+                    src_host.path("!"): [
+                        src_host.path("/opt/.b4_backup/snapshots/localhost/home/alpha/!a"),
+                        src_host.path("/opt/.b4_backup/snapshots/localhost/home/alpha/!b"),
+                    ]
+                }
+            ),
+        )
+
+        # Act
+        src_host.send_snapshot(dst_host, "bravo", send_con=LocalConnection(PurePath()))
+
+        # Assert
+        assert fake_pump.call_args_list[0].args[0] == [
+            "bash",
+            "-c",
+            "btrfs send -p '/opt/.b4_backup/snapshots/localhost/home/alpha/!a'"
+            " -c '/opt/.b4_backup/snapshots/localhost/home/alpha/!b'"
+            " '/opt/.b4_backup/snapshots/localhost/home/bravo/!'",
+        ]
+        # btrfs send can't choose a parent from the clone sources itself
+        for pump_call in fake_pump.call_args_list:
+            argv = shlex.split(pump_call.args[0][2])
+            assert "-c" not in argv or "-p" in argv
+        assert "Sent ! based on clone sources as 1.00 MB" in caplog.text
+        du_call = call(
+            [
+                "btrfs",
+                "filesystem",
+                "du",
+                "-s",
+                "--raw",
+                "/opt/.b4_backup/snapshots/localhost/home/bravo/!",
+            ]
+        )
+        # Only measured for debugging
+        assert (du_call in fake_run_process.call_args_list) is (level == logging.DEBUG)
+        assert ("Clone sources saved 4.00 MB" in caplog.text) is (level == logging.DEBUG)
+
+    def test_send_snapshot__uuid_parent(
+        self,
+        src_host: BackupTargetHost,
+        dst_host: BackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        # Arrange
+        fake_pump = MagicMock(return_value=TransferStats(1, 1.0, 1.0, 1.0))
+        monkeypatch.setattr(dst_host.connection, "run_process", MagicMock())
+        monkeypatch.setattr(backup_target_host, "pump", fake_pump)
+        snapshots = {
+            x: Snapshot(
+                name=x,
+                subvolumes=[src_host.path(subvolume)],
+                base_path=src_host.path("/opt/.b4_backup/snapshots/localhost/home"),
+            )
+            for x, subvolume in [("alpha", "!a"), ("bravo", "!b")]
+        }
+        monkeypatch.setattr(src_host, "snapshots", MagicMock(return_value=snapshots))
+        monkeypatch.setattr(
+            dst_host, "snapshots", MagicMock(return_value={"alpha": snapshots["alpha"]})
+        )
+        monkeypatch.setattr(
+            src_host,
+            "_uuid_parent_subvolumes",
+            MagicMock(
+                return_value={
+                    src_host.path("!b"): src_host.path(
+                        "/opt/.b4_backup/snapshots/localhost/home/alpha/!a"
+                    )
+                }
+            ),
+        )
+
+        # Act
+        src_host.send_snapshot(dst_host, "bravo", send_con=LocalConnection(PurePath()))
+
+        # Assert
+        assert fake_pump.call_args_list == [
+            call(
+                [
+                    "bash",
+                    "-c",
+                    "btrfs send -p '/opt/.b4_backup/snapshots/localhost/home/alpha/!a' '/opt/.b4_backup/snapshots/localhost/home/bravo/!b'",
+                ],
+                ["bash", "-c", "btrfs receive /opt/b4/snapshots/localhost/home/bravo"],
+            )
+        ]
+
+    def test_send_snapshot__chain(
+        self,
+        src_host: BackupTargetHost,
+        dst_host: BackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        # Arrange
+        fake_pump = MagicMock(return_value=TransferStats(1, 1.0, 1.0, 1.0))
+        monkeypatch.setattr(backup_target_host, "pump", fake_pump)
+        monkeypatch.setattr(dst_host, "mount_point", MagicMock(return_value=PurePath("/opt/b4")))
+        snapshot_dir = ".b4_backup/snapshots/localhost/home"
+        fake_src_run_proc = MagicMock(
+            return_value=textwrap.dedent(
+                f"""
+                ID 256 gen 10 top level 5 parent_uuid - received_uuid - uuid L1 path home
+                ID 300 gen 11 top level 5 parent_uuid L1 received_uuid - uuid SA path {snapshot_dir}/alpha/!
+                ID 301 gen 12 top level 5 parent_uuid L1 received_uuid - uuid SB path {snapshot_dir}/bravo/!
+                ID 302 gen 13 top level 5 parent_uuid L1 received_uuid - uuid SC path {snapshot_dir}/charlie/!
+                """
+            )
+        )
+        fake_dst_run_proc = MagicMock(
+            side_effect=lambda command: (
+                "ID 400 gen 5 top level 5 parent_uuid - received_uuid SA uuid DA"
+                " path snapshots/localhost/home/alpha/!"
+                if command[:3] == ["btrfs", "subvolume", "list"]
+                else ""
+            )
+        )
+        monkeypatch.setattr(src_host.connection, "run_process", fake_src_run_proc)
+        monkeypatch.setattr(dst_host.connection, "run_process", fake_dst_run_proc)
+        snapshots = {
+            x: Snapshot(
+                name=x,
+                subvolumes=[src_host.path("!")],
+                base_path=src_host.path("/opt/.b4_backup/snapshots/localhost/home"),
+            )
+            for x in ["alpha", "bravo", "charlie"]
+        }
+        monkeypatch.setattr(src_host, "snapshots", MagicMock(return_value=snapshots))
+        fake_dst_snapshots = MagicMock(return_value={"alpha": snapshots["alpha"]})
+        monkeypatch.setattr(dst_host, "snapshots", fake_dst_snapshots)
+
+        # Act
+        src_host.send_snapshot(dst_host, "bravo", send_con=LocalConnection(PurePath()))
+        fake_dst_snapshots.return_value = {x: snapshots[x] for x in ["alpha", "bravo"]}
+        src_host.send_snapshot(dst_host, "charlie", send_con=LocalConnection(PurePath()))
+
+        # Assert
+        assert [x.args[0][2] for x in fake_pump.call_args_list] == [
+            f"btrfs send -p '/opt/{snapshot_dir}/alpha/!' '/opt/{snapshot_dir}/bravo/!'",
+            f"btrfs send -p '/opt/{snapshot_dir}/bravo/!' '/opt/{snapshot_dir}/charlie/!'",
+        ]
+        # The destination is only listed once for the whole chain
+        assert fake_src_run_proc.call_count == 1
+        assert [x.args[0][:3] for x in fake_dst_run_proc.call_args_list].count(
+            ["btrfs", "subvolume", "list"]
+        ) == 1
+
+    def test_send_snapshot__direct(
+        self,
+        src_host: BackupTargetHost,
+        dst_host: BackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        # Arrange
+        monkeypatch.setattr(src_host, "_uuid_parent_subvolumes", MagicMock(return_value={}))
+        monkeypatch.setattr(src_host, "_clone_sources", MagicMock(return_value={}))
+        src_con = SSHConnection("src.example.com", PurePath("/home"))
+        src_con.connected = True
+        dst_con = SSHConnection("dst.example.com", PurePath("/opt/b4"))
+        fake_src_run_proc = MagicMock(return_value="")
+        monkeypatch.setattr(src_con, "run_process", fake_src_run_proc)
+        monkeypatch.setattr(dst_con, "run_process", MagicMock())
+        # The snapshot dir paths still use the original local connection
+        monkeypatch.setattr(dst_host.connection, "run_process", MagicMock())
+        monkeypatch.setattr(src_host, "connection", src_con)
+        monkeypatch.setattr(dst_host, "connection", dst_con)
+        monkeypatch.setattr(src_host.target_config, "transfer_mode", TransferMode.DIRECT)
+        snapshot = Snapshot(
+            name="alpha",
+            subvolumes=[src_host.path("!")],
+            base_path=src_host.path("/opt/.b4_backup/snapshots/localhost/home"),
+        )
+        monkeypatch.setattr(src_host, "snapshots", MagicMock(return_value={"alpha": snapshot}))
+        monkeypatch.setattr(dst_host, "snapshots", MagicMock(return_value={}))
+
+        # Act
+        src_host.send_snapshot(dst_host, "alpha")
+
+        # Assert
+        assert src_con.connected is True
+        assert fake_src_run_proc.call_args_list == [
+            call(
+                [
+                    "bash",
+                    "-c",
+                    "set -o pipefail; exec 4>&1 6>&2;"
+                    " { TIMEFORMAT='b4-stage send %R';"
+                    " time { { btrfs send '/opt/.b4_backup/snapshots/localhost/home/alpha/!' ; } 2>&1 >&5 | tee /dev/fd/4 >&6 ; } ; } 2>&4 5>&1"
+                    " | { TIMEFORMAT='b4-stage receive %R'; time { { ssh -p 22 root@dst.example.com 'btrfs receive /opt/b4/snapshots/localhost/home/alpha' ; } 2>&6 ; } ; } 2>&4",
+                ]
+            )
+        ]
+
+    @pytest.mark.parametrize(
+        ("compression", "level", "expected_result"),
+        [
+            (
+                TransferCompression.NONE,
+                9,
+                ("btrfs send /a", "ssh -p 22 root@dst.example.com 'btrfs receive /b'"),
+            ),
+            (
+                TransferCompression.LZ4,
+                None,
+                (
+                    "btrfs send /a | lz4 -c -v",
+                    "ssh -p 22 root@dst.example.com 'lz4 -d -c | btrfs receive /b'",
+                ),
+            ),
+            (
+                TransferCompression.ZSTD,
+                9,
+                (
+                    "btrfs send /a | zstd -c -v -T0 -9",
+                    "ssh -p 22 root@dst.example.com 'zstd -d -c | btrfs receive /b'",
+                ),
+            ),
+        ],
+    )
+    def test_transfer_commands(
+        self,
+        src_host: BackupTargetHost,
+        dst_host: BackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+        compression: TransferCompression,
+        level: int | None,
+        expected_result: tuple[str, str],
+    ):
+        # Arrange
+        monkeypatch.setattr(src_host.target_config, "transfer_compression", compression)
+        monkeypatch.setattr(src_host.target_config, "transfer_compression_level", level)
+        monkeypatch.setattr(
+            dst_host, "connection", SSHConnection("dst.example.com", PurePath("/opt/b4"))
+        )
+
+        # Act
+        result = src_host._transfer_commands(
+            dst_host, LocalConnection(PurePath()), "btrfs send /a", "btrfs receive /b"
+        )
+
+        # Assert
+        assert result == expected_result
+
+    def test_transfer_subvolume(
+        self,
+        src_host: BackupTargetHost,
+        dst_host: BackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+        caplog: pytest.LogCaptureFixture,
+    ):
+        # Arrange
+        fake_pump = MagicMock(
+            return_value=TransferStats(
+                size=50_000_000,
+                duration=2.0,
+                send_duration=1.5,
+                receive_duration=2.0,
+                send_stderr="Compressed 100000000 bytes into 50000000 bytes ==> 50.00%\n",
+            )
+        )
+        monkeypatch.setattr(backup_target_host, "pump", fake_pump)
+
+        # Act
+        with caplog.at_level("INFO", logger="b4_backup.main"):
+            src_host._transfer_subvolume(
+                dst_host, LocalConnection(PurePath()), "btrfs send /a", "btrfs receive /b"
+            )
+
+        # Assert
+        fake_pump.assert_called_once_with(
+            ["bash", "-c", "btrfs send /a"], ["bash", "-c", "btrfs receive /b"]
+        )
+        assert caplog.messages == [
+            "Transferred 50.00 MB in 2.00s (25.00 MB/s, send 1.50s, receive 2.00s)",
+            "Compression ratio: 50.00%",
+        ]
+
+    @pytest.mark.parametrize(
+        ("output", "expected_logs"),
+        [
+            ("", []),
+            (
+                "/*stdin*\\    :  35.89%   (   977 KiB =>    351 KiB, /*stdout*\\)\n"
+                "b4-stage send 12.500\n"
+                "b4-stage receive 12.750\n",
+                ["Transfer stages: send 12.50s, receive 12.75s", "Compression ratio: 35.89%"],
+            ),
+        ],
+    )
+    def test_transfer_subvolume__remote(
+        self,
+        src_host: BackupTargetHost,
+        dst_host: BackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+        caplog: pytest.LogCaptureFixture,
+        output: str,
+        expected_logs: list[str],
+    ):
+        # Arrange
+        monkeypatch.setattr(
+            src_host, "connection", SSHConnection("src.example.com", PurePath("/home"))
+        )
+        monkeypatch.setattr(
+            dst_host, "connection", SSHConnection("dst.example.com", PurePath("/opt/b4"))
+        )
+        relay_con = SSHConnection("relay.example.com", PurePath("/"))
+        relay_con.run_process = MagicMock(return_value=output)
+
+        # Act
+        with caplog.at_level("INFO", logger="b4_backup.main"):
+            src_host._transfer_subvolume(dst_host, relay_con, "btrfs send /a", "btrfs receive /b")
+
+        # Assert
+        assert caplog.messages == expected_logs
+
+    @pytest.mark.parametrize(
+        ("send_side", "receive_side", "expected_returncode", "expected_stderr"),
+        [
+            ("echo 'Compression ratio: 35.89%' >&2", "cat", 0, "Compression ratio: 35.89%\n"),
+            ("sh -c 'echo send failed >&2; exit 3'", "cat", 3, "send failed\n"),
+            ("echo data", "sh -c 'echo receive failed >&2; exit 4'", 4, "receive failed\n"),
+        ],
+    )
+    def test_transfer_subvolume__remote_stderr(
+        self,
+        src_host: BackupTargetHost,
+        dst_host: BackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+        send_side: str,
+        receive_side: str,
+        expected_returncode: int,
+        expected_stderr: str,
+    ):
+        # Arrange
+        monkeypatch.setattr(
+            src_host, "_transfer_commands", MagicMock(return_value=(send_side, receive_side))
+        )
+        relay_con = SSHConnection("relay.example.com", PurePath("/"))
+        relay_con.run_process = MagicMock(return_value="")
+
+        # Act
+        src_host._transfer_subvolume(dst_host, relay_con, "btrfs send /a", "btrfs receive /b")
+        result = subprocess.run(  # noqa: S603
+            relay_con.run_process.call_args.args[0], capture_output=True, text=True, check=False
+        )
+
+        # Assert
+        assert result.returncode == expected_returncode
+        assert result.stderr == expected_stderr
+        assert "b4-stage send" in result.stdout
+        assert "b4-stage receive" in result.stdout
+        assert "data" not in result.stdout
+
+    @pytest.mark.parametrize(
+        ("transfer_mode", "transfer_relay", "remote", "expected_host_id"),
+        [
+            (TransferMode.CONTROLLER, None, True, ("local",)),
+            (TransferMode.DIRECT, None, True, ("ssh", "src.example.com", 22, "root")),
+            (TransferMode.DIRECT, None, False, ("local",)),
+            (
+                TransferMode.RELAY,
+                "ssh://relay.example.com/",
+                True,
+                ("ssh", "relay.example.com", 22, "root"),
+            ),
+        ],
+    )
+    def test_transfer_connection(
+        self,
+        src_host: BackupTargetHost,
+        dst_host: BackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+        transfer_mode: TransferMode,
+        transfer_relay: str | None,
+        remote: bool,
+        expected_host_id: tuple,
+    ):
+        # Arrange
+        monkeypatch.setattr(src_host.target_config, "transfer_mode", transfer_mode)
+        monkeypatch.setattr(src_host.target_config, "transfer_relay", transfer_relay)
+        monkeypatch.setattr(
+            src_host, "connection", SSHConnection("src.example.com", PurePath("/home"))
+        )
+        if remote:
+            monkeypatch.setattr(
+                dst_host, "connection", SSHConnection("dst.example.com", PurePath("/opt/b4"))
+            )
+
+        # Act
+        result = src_host._transfer_connection(dst_host)
+
+        # Assert
+        assert result.host_id == expected_host_id
+        assert result.keep_open is False or result is src_host.connection
+
+    def test_transfer_connection__relay_missing(
+        self,
+        src_host: BackupTargetHost,
+        dst_host: BackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        # Arrange
+        monkeypatch.setattr(src_host.target_config, "transfer_mode", TransferMode.RELAY)
+        monkeypatch.setattr(src_host.target_config, "transfer_relay", None)
+
+        # Act / Assert
+        with pytest.raises(exceptions.InvalidConnectionUrlError):
+            src_host._transfer_connection(dst_host)
+
+    @pytest.mark.parametrize(
+        ("snapshot_name", "parent_snapshot_name"),
+        [("idontexist", None), ("alpha", "idontexist")],
+    )
+    def test_send_snapshot__error(
+        self,
+        src_host: BackupTargetHost,
+        dst_host: BackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+        snapshot_name: str,
+        parent_snapshot_name: str | None,
+    ):
+        # Arrange
+        snapshot = Snapshot(
+            name="alpha",
+            subvolumes=[src_host.path("!")],
+            base_path=src_host.path("/opt/.b4_backup/snapshots/localhost/home"),
+        )
+        monkeypatch.setattr(src_host, "snapshots", MagicMock(return_value={"alpha": snapshot}))
+        monkeypatch.setattr(dst_host, "snapshots", MagicMock(return_value={}))
+
+        # Act / Assert
+        with pytest.raises(exceptions.SnapshotNotFoundError):
+            src_host.send_snapshot(
+                dst_host, snapshot_name, parent_snapshot_name=parent_snapshot_name
+            )
+
+
+class TestSourceBackupTargetHost:
+    def test_type(self, src_host: SourceBackupTargetHost):
+        # Act
+        result = src_host.type
+
+        # Assert
+        assert result == "source"
+
+    def test_create_snapshot(
+        self,
+        src_host: SourceBackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        # Arrange
+        monkeypatch.setattr(src_host, "_unchanged_subvolumes", MagicMock(return_value=[]))
+        subvolumes = [
+            "/home",
+            "/home/test/.steam",
+            "/home/test/ignored/subvol",
+            "/home/test/pictures",
+        ]
+        fake_src_run_proc = MagicMock()
+        monkeypatch.setattr(
+            src_host, "subvolumes", MagicMock(return_value=[src_host.path(x) for x in subvolumes])
+        )
+        monkeypatch.setattr(src_host.connection, "run_process", fake_src_run_proc)
+
+        # Act
+        result = src_host.create_snapshot("1")
+
+        # Assert
+        assert fake_src_run_proc.call_args_list == [
+            call(["mkdir", "/opt/.b4_backup/snapshots/localhost/home/1", "-p"]),
+            call(
+                [
+                    "btrfs",
+                    "subvolume",
+                    "snapshot",
+                    "-r",
+                    "/home",
+                    "/opt/.b4_backup/snapshots/localhost/home/1/!",
+                ]
+            ),
+            call(
+                [
+                    "btrfs",
+                    "subvolume",
+                    "snapshot",
+                    "-r",
+                    "/home/test/.steam",
+                    "/opt/.b4_backup/snapshots/localhost/home/1/!test!.steam",
+                ]
+            ),
+            call(
+                [
+                    "btrfs",
+                    "subvolume",
+                    "snapshot",
+                    "-r",
+                    "/home/test/pictures",
+                    "/opt/.b4_backup/snapshots/localhost/home/1/!test!pictures",
+                ]
+            ),
+        ]
+        assert result == Snapshot(
+            name="1",
+            subvolumes=[
+                src_host.path("!"),
+                src_host.path("!test!.steam"),
+                src_host.path("!test!pictures"),
+            ],
+            base_path=src_host.path("/opt/.b4_backup/snapshots/localhost/home"),
+        )
+
+    def test_create_snapshot__error(
+        self,
+        src_host: SourceBackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        # Arrange
+        subvolumes = []
+        fake_src_run_proc = MagicMock()
+        monkeypatch.setattr(
+            src_host, "subvolumes", MagicMock(return_value=[src_host.path(x) for x in subvolumes])
+        )
+        monkeypatch.setattr(src_host.connection, "run_process", fake_src_run_proc)
+
+        # Act
+        with pytest.raises(exceptions.BtrfsSubvolumeNotFoundError):
+            src_host.create_snapshot("1")
+
+    @pytest.mark.parametrize(
+        ("unchanged_strategy", "retained_snapshots", "expect_snapshots"),
+        [
+            (SubvolumeUnchangedStrategy.INCREMENTAL, None, ["!", "!test!pictures"]),
+            (SubvolumeUnchangedStrategy.SKIP, None, ["!"]),
+            (SubvolumeUnchangedStrategy.SKIP, {"0", "1"}, ["!"]),
+            (SubvolumeUnchangedStrategy.SKIP, {"1"}, ["!", "!test!pictures"]),
+        ],
+    )
+    def test_create_snapshot__unchanged(
+        self,
+        src_host: SourceBackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+        unchanged_strategy: SubvolumeUnchangedStrategy,
+        retained_snapshots: set[str] | None,
+        expect_snapshots: list[str],
+    ):
+        # Arrange
+        monkeypatch.setattr(src_host.connection, "location", PurePath("/opt/home"))
+        src_host.target_config = dataclasses.replace(
+            src_host.target_config,
+            subvolume_rules={
+                "/test/pictures": TargetSubvolume(
+                    backup_strategy=SubvolumeBackupStrategy.FULL,
+                    fallback_strategy=SubvolumeFallbackStrategy.KEEP,
+                    unchanged_strategy=unchanged_strategy,
+                )
+            },
+        )
+        snapshot_dir = ".b4_backup/snapshots/localhost/home"
+        run_process_result = textwrap.dedent(
+            f"""
+            ID 256 gen 30 top level 5 parent_uuid - received_uuid - uuid L1 path home
+            ID 257 gen 12 top level 256 parent_uuid - received_uuid - uuid L2 path home/test/pictures
+            ID 300 gen 20 top level 5 parent_uuid L1 received_uuid - uuid S1 path {snapshot_dir}/0/!
+            ID 301 gen 20 top level 5 parent_uuid L2 received_uuid - uuid S2 path {snapshot_dir}/0/!test!pictures
+            """
+        )
+        monkeypatch.setattr(
+            src_host.connection, "run_process", MagicMock(return_value=run_process_result)
+        )
+
+        # Act
+        result = src_host.create_snapshot("1", retained_snapshots)
+
+        # Assert
+        assert result is not None
+        assert [str(x) for x in result.subvolumes] == expect_snapshots
+
+    def test_create_snapshot__nothing_changed(
+        self,
+        src_host: SourceBackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+    ):
+        # Arrange
+        src_host.target_config = dataclasses.replace(
+            src_host.target_config,
+            subvolume_rules={
+                "/": TargetSubvolume(
+                    backup_strategy=SubvolumeBackupStrategy.FULL,
+                    fallback_strategy=SubvolumeFallbackStrategy.DROP,
+                    unchanged_strategy=SubvolumeUnchangedStrategy.SKIP,
+                )
+            },
+        )
+        monkeypatch.setattr(
+            src_host,
+            "subvolumes",
+            MagicMock(return_value=[src_host.path("/home")]),
+        )
+        monkeypatch.setattr(
+            src_host, "_unchanged_subvolumes", MagicMock(return_value=[src_host.path("/")])
+        )
+        fake_run_process = MagicMock()
+        monkeypatch.setattr(src_host.connection, "run_process", fake_run_process)
+
+        # Act
+        result = src_host.create_snapshot("1")
+
+        # Assert
+        assert result is None
+        fake_run_process.assert_not_called()
+
+    @pytest.mark.parametrize(
+        ("snapshot_names", "expected_result"),
+        [
+            (None, [PurePath("/a")]),
+            ({"0", "1"}, [PurePath("/a")]),
+            # /a changed since snapshot 0
+            ({"0"}, []),
+        ],
+    )
+    def test_unchanged_subvolumes(
+        self,
+        src_host: SourceBackupTargetHost,
+        monkeypatch: pytest.MonkeyPatch,
+        snapshot_names: set[str] | None,
+        expected_result: list[PurePath],
+    ):
+        # Arrange
+        monkeypatch.setattr(src_host.connection, "location", PurePath("/opt/home"))
+        snapshot_dir = ".b4_backup/snapshots/localhost/home"
+        run_process_result = textwrap.dedent(
+            f"""
+            ID 256 gen 30 top level 5 parent_uuid - received_uuid - uuid L1 path home
+            ID 257 gen 12 top level 256 parent_uuid - received_uuid - uuid L2 path home/a
+            ID 258 gen 25 top level 256 parent_uuid - received_uuid - uuid L3 path home/b
+            ID 259 gen 3 top level 256 parent_uuid - received_uuid - uuid L4 path home/c
+            ID 300 gen 10 top level 5 parent_uuid L1 received_uuid - uuid S1 path {snapshot_dir}/0/!
+            ID 301 gen 10 top level 5 parent_uuid L2 received_uuid - uuid S2 path {snapshot_dir}/0/!a
+            ID 302 gen 20 top level 5 parent_uuid L1 received_uuid - uuid S3 path {snapshot_dir}/1/!
+            ID 303 gen 20 top level 5 parent_uuid L2 received_uuid - uuid S4 path {snapshot_dir}/1/!a
+            ID 304 gen 20 top level 5 parent_uuid L3 received_uuid - uuid S5 path {snapshot_dir}/1/!b
+            ID 305 gen 40 top level 5 parent_uuid L4 received_uuid - uuid S6 path other/!c
+            """
+        )
+        monkeypatch.setattr(
+            src_host.connection, "run_process", MagicMock(return_value=run_process_result)
+        )
+
+        # Act
+        result = src_host._unchanged_subvolumes(
+            [src_host.path(x) for x in ["/", "/a", "/b", "/c", "/d"]], snapshot_names
+        )
+
+        # Assert
+        assert result == expected_result
+
+
+class TestDestinationBackupTargetHost:
+    def test_type(self, dst_host: DestinationBackupTargetHost):
+        # Act
+        result = dst_host.type
+
+        # Assert
+        assert result == "destination"
+
+
+@pytest.mark.parametrize(
     ("pair", "expected_result"),
     [
         (("", contextlib.nullcontext(), LocalConnection(PurePath("/test"))), ((0,), (1,))),
@@ -751,3 +1812,86 @@ def test_host_generator__use_nothing(config: BaseConfig, monkeypatch: pytest.Mon
     assert len(result) == 1
     assert result[0][1] is None
     assert result[0][0] is None
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_run_targets(config: BaseConfig, monkeypatch: pytest.MonkeyPatch, max_workers: int):
+    # Arrange
+    monkeypatch.setattr(paramiko, "SSHClient", MagicMock())
+    monkeypatch.setattr(BackupTargetHost, "_mount_point", MagicMock(return_value=Path("/mnt")))
+    target_choice = ChoiceSelector(["localhost"])
+    errors = []
+
+    # Act
+    result = run_targets(
+        target_choice,
+        config.backup_targets,
+        lambda src_host, dst_host: (src_host.name, dst_host.name),
+        max_workers=max_workers,
+        on_error=errors.append,
+    )
+
+    # Assert
+    assert sorted(result) == [
+        ("localhost/home", "localhost/home"),
+        ("localhost/mnt", "localhost/mnt"),
+    ]
+    assert [type(x) for x in errors] == [exceptions.DestinationDirectoryNotFoundError]
+    assert SSHConnection.ssh_client_pool == {}
+
+
+def test_run_targets__raise(config: BaseConfig, monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    monkeypatch.setattr(BackupTargetHost, "_mount_point", MagicMock(return_value=Path("/mnt")))
+    target_choice = ChoiceSelector(["localhost/mnt"])
+
+    def _action(_src_host, _dst_host):
+        raise exceptions.SnapshotNotFoundError
+
+    # Act / Assert
+    with pytest.raises(exceptions.SnapshotNotFoundError):
+        run_targets(target_choice, config.backup_targets, _action, max_workers=2, use_source=False)
+
+
+def test_run_targets__pipelined(
+    config: BaseConfig, monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+):
+    # Arrange
+    monkeypatch.setattr(BackupTargetHost, "_mount_point", MagicMock(return_value=Path("/mnt")))
+    target_choice = ChoiceSelector(["localhost/root", "localhost/mnt"])
+    # Both targets share the local source host, which only allows one target at a time
+    barrier = threading.Barrier(2, timeout=5)
+
+    def _action(src_host, _dst_host):
+        barrier.wait()
+        with src_host.transfer_slot:
+            return src_host.name, type(src_host.transfer_slot)
+
+    # Act
+    result = run_targets(
+        target_choice, config.backup_targets, _action, use_destination=False, pipelined=True
+    )
+
+    # Assert
+    assert sorted(result) == [
+        ("localhost/mnt", threading.Semaphore),
+        ("localhost/root", threading.Semaphore),
+    ]
+    assert "Using 3 threads instead of max_workers 1" in caplog.text
+
+
+def test_host_semaphores():
+    # Act
+    result = _host_semaphores(
+        [
+            (SSHConnection("example.com", PurePath("/a")), 3),
+            (SSHConnection("example.com", PurePath("/b")), 2),
+            (LocalConnection(PurePath("/c")), 5),
+            (contextlib.nullcontext(), 1),
+        ]
+    )
+
+    # Assert
+    assert result.keys() == {("ssh", "example.com", 22, "root"), ("local",)}
+    assert result[("ssh", "example.com", 22, "root")]._value == 2  # type: ignore
+    assert result[("local",)]._value == 5  # type: ignore
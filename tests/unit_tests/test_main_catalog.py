@@ -0,0 +1,105 @@
+from pathlib import Path
+
+import pytest
+
+from b4_backup.main.catalog import SnapshotCatalog
+from b4_backup.main.inventory import SubvolumeInfo
+
+
+@pytest.fixture
+def catalog(tmp_path: Path):
+    with SnapshotCatalog.open(tmp_path / "catalog" / "b4.sqlite") as catalog:
+        yield catalog
+
+
+def test_reconcile(catalog: SnapshotCatalog):
+    # Arrange
+    info = SubvolumeInfo(id=256, generation=12, uuid="0b5a", received_uuid="9c1e")
+    catalog.reconcile(
+        "localhost/home",
+        "destination",
+        [
+            ("2023-08-01-00-00-00_manual", "!", info),
+            ("2023-08-02-00-00-00_manual", "!", None),
+            ("2023-08-02-00-00-00_manual", "!test", None),
+        ],
+    )
+
+    # Act
+    catalog.reconcile(
+        "localhost/home",
+        "destination",
+        [
+            ("2023-08-01-00-00-00_manual", "!", None),
+            ("2023-08-03-00-00-00_manual", "!", None),
+        ],
+    )
+
+    # Assert
+    assert catalog.snapshots("localhost/home", "destination") == {
+        "2023-08-01-00-00-00_manual": ["!"],
+        "2023-08-03-00-00-00_manual": ["!"],
+    }
+    assert catalog.snapshots("localhost/home", "source") == {}
+
+    subvolumes = catalog.subvolumes("localhost/home", "destination", include_deleted=True)
+    assert [(x.snapshot, x.subvolume, x.deleted_at is None) for x in subvolumes] == [
+        ("2023-08-01-00-00-00_manual", "!", True),
+        ("2023-08-02-00-00-00_manual", "!", False),
+        ("2023-08-02-00-00-00_manual", "!test", False),
+        ("2023-08-03-00-00-00_manual", "!", True),
+    ]
+    # Known subvolumes keep the metadata of the time they were recorded
+    assert subvolumes[0].info == info
+    assert subvolumes[3].info is None
+
+
+def test_reconcile__recreated(catalog: SnapshotCatalog):
+    # Arrange
+    catalog.reconcile("localhost/home", "source", [("2023-08-01-00-00-00_manual", "!", None)])
+    catalog.reconcile("localhost/home", "source", [])
+
+    # Act
+    catalog.reconcile("localhost/home", "source", [("2023-08-01-00-00-00_manual", "!", None)])
+
+    # Assert
+    subvolumes = catalog.subvolumes("localhost/home", "source", include_deleted=True)
+    assert len(subvolumes) == 1
+    assert subvolumes[0].deleted_at is None
+
+
+def test_transfers(catalog: SnapshotCatalog):
+    # Arrange
+    catalog.add_transfer("localhost/home", "2023-08-01-00-00-00_manual", "!", None, 1000, 1.5)
+    catalog.add_transfer(
+        "localhost/home",
+        "2023-08-02-00-00-00_manual",
+        "!",
+        "2023-08-01-00-00-00_manual",
+        None,
+        0.5,
+    )
+
+    # Act
+    result = catalog.transfers("localhost/home")
+    result_snapshot = catalog.transfers("localhost/home", "2023-08-02-00-00-00_manual")
+
+    # Assert
+    assert [(x.snapshot, x.parent, x.size, x.duration) for x in result] == [
+        ("2023-08-01-00-00-00_manual", None, 1000, 1.5),
+        ("2023-08-02-00-00-00_manual", "2023-08-01-00-00-00_manual", None, 0.5),
+    ]
+    assert result_snapshot == result[1:]
+
+
+def test_open__existing(tmp_path: Path):
+    # Arrange
+    with SnapshotCatalog.open(tmp_path / "b4.sqlite") as catalog:
+        catalog.reconcile("localhost/home", "source", [("2023-08-01-00-00-00_manual", "!", None)])
+
+    # Act
+    with SnapshotCatalog.open(tmp_path / "b4.sqlite") as catalog:
+        result = catalog.snapshots("localhost/home", "source")
+
+    # Assert
+    assert result == {"2023-08-01-00-00-00_manual": ["!"]}
@@ -1,4 +1,11 @@
 import contextlib
+import errno
+import io
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from unittest.mock import MagicMock, call
 
@@ -6,7 +13,7 @@ import paramiko
 import pytest
 
 from b4_backup import exceptions
-from b4_backup.main import connection
+from b4_backup.main import connection, remote_agent
 
 
 @pytest.mark.parametrize(
@@ -181,6 +188,29 @@ def test_open_ssh_connection__keep_open(monkeypatch: pytest.MonkeyPatch):
     )
 
 
+def test_close_ssh_connection__shared(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    monkeypatch.setattr(paramiko, "SSHClient", MagicMock())
+    fake_ssh = paramiko.SSHClient()
+    con1 = connection.SSHConnection(host="example.com", location=Path("/relay"))
+    con2 = connection.SSHConnection(host="example.com", location=Path("/test"))
+    con2.keep_open = True
+
+    # Act / Assert
+    with con2:
+        with con1:
+            ...
+
+        # Still used by con2
+        fake_ssh.close.assert_not_called()
+
+    with con1:
+        ...
+
+    fake_ssh.close.assert_called_once()
+    assert connection.SSHConnection.ssh_client_pool == {}
+
+
 @pytest.mark.parametrize(
     "connection_url",
     [
@@ -270,3 +300,821 @@ def test_build_command(con: connection.Connection, expected_result: str):
 
     # Assert
     assert result == expected_result
+
+
+def test_mount_points(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    con = connection.LocalConnection(Path("/"))
+    fake_run_process = MagicMock(
+        return_value=(
+            "22 1 0:21 / / rw,relatime shared:1 - btrfs /dev/sda3 rw,subvol=/\n"
+            "23 22 0:22 /data /mnt/my\\040data rw shared:2 - btrfs /dev/sdb1 rw,subvol=/data\n"
+        )
+    )
+    monkeypatch.setattr(con, "run_process", fake_run_process)
+
+    # Act
+    result = con.mount_points()
+    con.mount_points()
+
+    # Assert
+    assert result == [
+        connection.MountPoint(path=Path("/"), fs_type="btrfs", source="/dev/sda3"),
+        connection.MountPoint(path=Path("/mnt/my data"), fs_type="btrfs", source="/dev/sdb1"),
+    ]
+    fake_run_process.assert_called_once_with(["cat", "/proc/self/mountinfo"])
+
+
+def test_invalidate_mount_points(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    con = connection.LocalConnection(Path("/"))
+    fake_run_process = MagicMock(return_value="")
+    monkeypatch.setattr(con, "run_process", fake_run_process)
+    con.mount_points()
+
+    # Act
+    con.invalidate_mount_points()
+    con.mount_points()
+
+    # Assert
+    assert fake_run_process.call_count == 2
+
+
+def test_close_pool(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    monkeypatch.setattr(paramiko, "SSHClient", MagicMock())
+    con = connection.SSHConnection(host="example.com", location=Path("/test"))
+    con.keep_open = True
+    with con:
+        ...
+
+    # Act
+    connection.SSHConnection.close_pool()
+
+    # Assert
+    assert con.ssh_client_pool == {}
+    assert con._ssh_client.close.called is True  # type: ignore
+
+
+@pytest.mark.parametrize(
+    ("con", "origin", "expected_result"),
+    [
+        (
+            connection.SSHConnection(host="example.com", location=Path("/")),
+            connection.LocalConnection(Path("/")),
+            "ssh -p 22 root@example.com ",
+        ),
+        (
+            connection.SSHConnection(host="example.com", location=Path("/")),
+            connection.SSHConnection(host="example.com", location=Path("/opt")),
+            "",
+        ),
+        (
+            connection.SSHConnection(host="example.com", location=Path("/")),
+            connection.SSHConnection(host="example.org", location=Path("/")),
+            "ssh -p 22 root@example.com ",
+        ),
+        (connection.LocalConnection(Path("/")), connection.LocalConnection(Path("/opt")), ""),
+    ],
+)
+def test_exec_prefix_from(
+    con: connection.Connection, origin: connection.Connection, expected_result: str
+):
+    # Act
+    result = con.exec_prefix_from(origin)
+
+    # Assert
+    assert result == expected_result
+
+
+def test_exec_prefix_from__unreachable():
+    # Arrange
+    con = connection.LocalConnection(Path("/"))
+
+    # Act / Assert
+    with pytest.raises(exceptions.UnreachableHostError):
+        con.exec_prefix_from(connection.SSHConnection(host="example.com", location=Path("/")))
+
+
+@pytest.mark.parametrize(
+    ("origin", "expected_result"),
+    [
+        (
+            connection.LocalConnection(Path("/")),
+            "ssh -p 22 root@example.com 'btrfs send /a | zstd -c'",
+        ),
+        (
+            connection.SSHConnection(host="example.com", location=Path("/")),
+            "btrfs send /a | zstd -c",
+        ),
+    ],
+)
+def test_command_from(origin: connection.Connection, expected_result: str):
+    # Arrange
+    con = connection.SSHConnection(host="example.com", location=Path("/"))
+
+    # Act
+    result = con.command_from(origin, "btrfs send /a | zstd -c")
+
+    # Assert
+    assert result == expected_result
+
+
+class FakeShellChannel:
+    """Emulates a remote shell, answering every framed command with a scripted result."""
+
+    _command_pattern = re.compile(r"printf '\\n%s %d\\n' (\S+) ")
+
+    def __init__(self, results: list[tuple[int, bytes, bytes]], chunk_size: int = 3):
+        self.results = results
+        self.chunk_size = chunk_size
+        self.sent: list[str] = []
+        self.stdout = b""
+        self.stderr = b""
+        self.closed = False
+        self.terminated = False
+        self.waiting = False
+
+    def sendall(self, data: bytes):
+        command = data.decode()
+        self.sent.append(command)
+        if not self.results:
+            self.terminated = True
+            return
+
+        marker = self._command_pattern.search(command).group(1)  # type: ignore
+        exit_code, stdout, stderr = self.results.pop(0)
+        self.stdout += stdout + f"\n{marker} {exit_code}\n".encode()
+        self.stderr += stderr + f"\n{marker}\n".encode()
+        self.waiting = True
+
+    def recv_ready(self) -> bool:
+        return bool(self.stdout) and not self.waiting
+
+    def recv(self, _size: int) -> bytes:
+        chunk, self.stdout = self.stdout[: self.chunk_size], self.stdout[self.chunk_size :]
+        return chunk
+
+    def recv_stderr_ready(self) -> bool:
+        return bool(self.stderr) and not self.waiting
+
+    def wait(self):
+        self.waiting = False
+
+    def recv_stderr(self, _size: int) -> bytes:
+        chunk, self.stderr = self.stderr[: self.chunk_size], self.stderr[self.chunk_size :]
+        return chunk
+
+    def exit_status_ready(self) -> bool:
+        return self.terminated
+
+    def close(self):
+        self.closed = True
+
+
+def test_shell_session_open():
+    # Arrange
+    fake_ssh_client = MagicMock()
+
+    # Act
+    result = connection.ShellSession.open(fake_ssh_client)
+
+    # Assert
+    fake_channel = fake_ssh_client.get_transport().open_session()
+    fake_channel.exec_command.assert_called_once_with("sh")
+    assert result._channel is fake_channel
+
+
+def test_shell_session_run(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    channel = FakeShellChannel(
+        [
+            (0, b"snickers\n", b""),
+            (2, b"no newline", b"error\n"),
+        ]
+    )
+    fake_select = MagicMock(side_effect=lambda *_args: channel.wait())
+    monkeypatch.setattr(connection.select, "select", fake_select)
+    session = connection.ShellSession(channel)  # type: ignore
+
+    # Act
+    result1 = session.run("echo snickers")
+    result2 = session.run("printf 'no newline'; false")
+
+    # Assert
+    assert result1 == (0, "snickers\n", "")
+    assert result2 == (2, "no newline", "error\n")
+    assert channel.sent[0].startswith("{ echo snickers\n} </dev/null;")
+    assert session.closed is False
+    assert fake_select.call_count == 2
+
+
+def test_shell_session_run__terminated(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    monkeypatch.setattr(connection.select, "select", MagicMock())
+    session = connection.ShellSession(FakeShellChannel([]))  # type: ignore
+
+    # Act / Assert
+    with pytest.raises(exceptions.SessionClosedError):
+        session.run("exit")
+
+    assert session.closed is True
+
+
+def test_run_process__persistent_session(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    monkeypatch.setattr(paramiko, "SSHClient", MagicMock())
+    channels = [
+        FakeShellChannel([(0, b"snickers\n", b""), (1, b"", b"error\n")]),
+        FakeShellChannel([(0, b"mars\n", b"")]),
+    ]
+    monkeypatch.setattr(
+        connection.select, "select", MagicMock(side_effect=lambda x, *_args: x[0].wait())
+    )
+    monkeypatch.setattr(
+        connection.ShellSession,
+        "open",
+        MagicMock(side_effect=[connection.ShellSession(x) for x in channels]),  # type: ignore
+    )
+    con = connection.SSHConnection(host="example.com", location=Path("/test"))
+    con.persistent_session = True
+
+    # Act / Assert
+    with con:
+        assert con.run_process(["echo", "snickers"]) == "snickers\n"
+
+        with pytest.raises(exceptions.FailedProcessError):
+            con.run_process(["false"])
+
+        channels[0].terminated = True
+        assert con.run_process(["echo", "mars"]) == "mars\n"
+
+    assert channels[0].closed is True
+    assert channels[1].closed is True
+    assert con._ssh_client is None
+    paramiko.SSHClient().exec_command.assert_not_called()  # type: ignore
+
+
+def test_run_process__persistent_session_keep_open(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    monkeypatch.setattr(paramiko, "SSHClient", MagicMock())
+    monkeypatch.setattr(
+        connection.select, "select", MagicMock(side_effect=lambda x, *_args: x[0].wait())
+    )
+    channels = [FakeShellChannel([(0, b"snickers\n", b"")]) for _ in range(12)]
+    monkeypatch.setattr(
+        connection.ShellSession,
+        "open",
+        MagicMock(side_effect=[connection.ShellSession(x) for x in channels]),  # type: ignore
+    )
+
+    # Act
+    for _ in channels:
+        con = connection.SSHConnection(host="example.com", location=Path("/test"))
+        con.persistent_session = True
+        con.keep_open = True
+        with con:
+            con.run_process(["echo", "snickers"])
+
+    # Assert
+    assert all(x.closed for x in channels)
+    assert len(connection.SSHConnection.ssh_client_pool) == 1
+    paramiko.SSHClient().close.assert_not_called()  # type: ignore
+
+    connection.SSHConnection.close_pool()
+
+
+def test_run_process__persistent_session_unavailable(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    monkeypatch.setattr(paramiko, "SSHClient", MagicMock())
+    monkeypatch.setattr(
+        connection.ShellSession, "open", MagicMock(side_effect=paramiko.SSHException("nope"))
+    )
+    fake_ssh = paramiko.SSHClient()
+    fake_ssh.exec_command = MagicMock(return_value=(MagicMock(), MagicMock(), MagicMock()))
+    fake_ssh.exec_command()[1].read().decode = MagicMock(return_value="snickers\n")
+    fake_ssh.exec_command()[1].channel.recv_exit_status = MagicMock(return_value=0)
+    con = connection.SSHConnection(host="example.com", location=Path("/test"))
+    con.persistent_session = True
+
+    # Act
+    with con:
+        result = con.run_process(["echo", "snickers"])
+
+    # Assert
+    assert result == "snickers\n"
+    assert con.persistent_session is False
+
+
+@pytest.fixture
+def process_con(monkeypatch: pytest.MonkeyPatch) -> connection.Connection:
+    """A connection running all path operations as processes."""
+    con = connection.SSHConnection("example.com", Path("/"))
+    monkeypatch.setattr(con, "remote_agent", MagicMock(return_value=None))
+
+    return con
+
+
+@pytest.mark.parametrize(
+    ("method", "args", "stdout", "expected_result", "expected_command"),
+    [
+        ("exists", ["/a"], "/a\n", True, ["ls", "-d", "/a"]),
+        ("is_dir", ["/a"], "drwxr-xr-x 1 root root 0 /a\n", True, ["ls", "-dl", "/a"]),
+        ("is_dir", ["/a"], "-rw-r--r-- 1 root root 0 /a\n", False, ["ls", "-dl", "/a"]),
+        ("iterdir", ["/a"], "\n", [], ["ls", "/a"]),
+        ("iterdir", ["/a"], "d\nc\n", ["c", "d"], ["ls", "/a"]),
+        ("mkdir", ["/a"], "", None, ["mkdir", "/a"]),
+        ("mkdir", ["/a", True], "", None, ["mkdir", "/a", "-p"]),
+        ("rmdir", ["/a"], "", None, ["rmdir", "/a"]),
+        ("rename", ["/a", "/b"], "", None, ["mv", "/a", "/b"]),
+    ],
+)
+def test_path_operations(
+    process_con: connection.Connection,
+    monkeypatch: pytest.MonkeyPatch,
+    method: str,
+    args: list,
+    stdout: str,
+    expected_result,
+    expected_command: list[str],
+):
+    # Arrange
+    fake_run_process = MagicMock(return_value=stdout)
+    monkeypatch.setattr(process_con, "run_process", fake_run_process)
+
+    # Act
+    result = getattr(process_con, method)(*[Path(x) if isinstance(x, str) else x for x in args])
+
+    # Assert
+    assert result == expected_result
+    fake_run_process.assert_called_once_with(expected_command)
+
+
+@pytest.mark.parametrize(
+    ("stderr", "raises"),
+    [("ls: cannot access '/a': No such file or directory", False), ("Permission denied", True)],
+)
+def test_exists__failed(
+    process_con: connection.Connection, monkeypatch: pytest.MonkeyPatch, stderr: str, raises: bool
+):
+    # Arrange
+    monkeypatch.setattr(
+        process_con,
+        "run_process",
+        MagicMock(side_effect=exceptions.FailedProcessError(["ls", "-d", "/a"], stderr=stderr)),
+    )
+
+    # Act / Assert
+    with pytest.raises(exceptions.FailedProcessError) if raises else contextlib.nullcontext():
+        assert process_con.exists(Path("/a")) is False
+
+
+def test_local_stat(tmp_path: Path):
+    # Arrange
+    con = connection.LocalConnection(tmp_path)
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").touch()
+
+    # Act
+    result = con.stat([tmp_path / "a", tmp_path / "b", tmp_path / "c"])
+
+    # Assert
+    assert result == [
+        connection.PathStat(exists=True, is_dir=True),
+        connection.PathStat(exists=True, is_dir=False),
+        connection.PathStat(exists=False, is_dir=False),
+    ]
+
+
+def test_local_rmdirs(tmp_path: Path):
+    # Arrange
+    con = connection.LocalConnection(tmp_path)
+    (tmp_path / "a").mkdir()
+
+    # Act
+    con.rmdirs([tmp_path / "a", tmp_path / "b"])
+
+    # Assert
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_local_iterdir__error(tmp_path: Path):
+    # Arrange
+    con = connection.LocalConnection(tmp_path)
+
+    # Act / Assert
+    with pytest.raises(exceptions.PathOperationError, match="iterdir"):
+        con.iterdir(tmp_path / "idontexist")
+
+
+@pytest.mark.parametrize(
+    ("error", "expected_exception"),
+    [
+        (OSError(errno.EXDEV, "Invalid cross-device link"), None),
+        (OSError(errno.ENOENT, "No such file or directory"), exceptions.PathOperationError),
+    ],
+)
+def test_local_rename__error(
+    monkeypatch: pytest.MonkeyPatch,
+    error: OSError,
+    expected_exception: type[Exception] | None,
+):
+    # Arrange
+    con = connection.LocalConnection(Path("/"))
+    monkeypatch.setattr(connection.Path, "rename", MagicMock(side_effect=error))
+    fake_run_process = MagicMock()
+    monkeypatch.setattr(con, "run_process", fake_run_process)
+
+    # Act / Assert
+    with pytest.raises(expected_exception) if expected_exception else contextlib.nullcontext():
+        con.rename(Path("/a"), Path("/b"))
+
+    assert fake_run_process.called is (expected_exception is None)
+    if expected_exception is None:
+        fake_run_process.assert_called_once_with(["mv", "/a", "/b"])
+
+
+@pytest.mark.parametrize(
+    ("method", "args", "agent_result", "expected_result", "expected_operations"),
+    [
+        ("exists", ["/a"], [{"exists": True, "is_dir": False}], True, [("stat", "/a")]),
+        ("is_dir", ["/a"], [{"exists": True, "is_dir": False}], False, [("stat", "/a")]),
+        (
+            "stat",
+            [[Path("/a"), Path("/b")]],
+            [{"exists": True, "is_dir": True}, {"exists": False, "is_dir": False}],
+            [
+                connection.PathStat(exists=True, is_dir=True),
+                connection.PathStat(exists=False, is_dir=False),
+            ],
+            [("stat", "/a"), ("stat", "/b")],
+        ),
+        ("iterdir", ["/a"], [["b", "c"]], ["b", "c"], [("iterdir", "/a")]),
+        ("mkdir", ["/a"], [None], None, [("mkdir", "/a", False)]),
+        ("rmdir", ["/a"], [None], None, [("rmdir", "/a")]),
+        (
+            "rmdirs",
+            [[Path("/a"), Path("/b")]],
+            [None, None],
+            None,
+            [("rmdir", "/a"), ("rmdir", "/b")],
+        ),
+        ("rename", ["/a", "/b"], [None], None, [("rename", "/a", "/b")]),
+        (
+            "prune_empty_dirs",
+            ["/a", [Path("/a/b")]],
+            [["/a/c"]],
+            [Path("/a/c")],
+            [("prune_empty_dirs", "/a", ["/a/b"])],
+        ),
+        (
+            "run_processes",
+            [[["echo", "a"], ["echo", "b"]]],
+            [
+                [
+                    {"returncode": 0, "stdout": "a\n", "stderr": ""},
+                    {"returncode": 0, "stdout": "b\n", "stderr": ""},
+                ]
+            ],
+            ["a\n", "b\n"],
+            [("run_all", [["echo", "a"], ["echo", "b"]])],
+        ),
+    ],
+)
+def test_path_operations__agent(
+    monkeypatch: pytest.MonkeyPatch,
+    method: str,
+    args: list,
+    agent_result: list,
+    expected_result,
+    expected_operations: list,
+):
+    # Arrange
+    con = connection.SSHConnection("example.com", Path("/"))
+    fake_agent = MagicMock()
+    fake_agent.request = MagicMock(return_value=agent_result)
+    monkeypatch.setattr(con, "remote_agent", MagicMock(return_value=fake_agent))
+    fake_run_process = MagicMock()
+    monkeypatch.setattr(con, "run_process", fake_run_process)
+
+    # Act
+    result = getattr(con, method)(*[Path(x) if isinstance(x, str) else x for x in args])
+
+    # Assert
+    assert result == expected_result
+    fake_agent.request.assert_called_once_with(expected_operations)
+    fake_run_process.assert_not_called()
+
+
+def test_run_processes__agent_error(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    con = connection.SSHConnection("example.com", Path("/"))
+    fake_agent = MagicMock()
+    fake_agent.request = MagicMock(
+        return_value=[
+            [
+                {"returncode": 0, "stdout": "", "stderr": ""},
+                {"returncode": 1, "stdout": "", "stderr": "error"},
+            ]
+        ]
+    )
+    monkeypatch.setattr(con, "remote_agent", MagicMock(return_value=fake_agent))
+
+    # Act / Assert
+    with pytest.raises(exceptions.FailedProcessError) as exc_info:
+        con.run_processes([["true"], ["false"], ["true"]])
+
+    assert exc_info.value.cmd == ["false"]
+    assert exc_info.value.stderr == "error"
+
+
+@pytest.mark.parametrize(
+    ("stderr", "raises"),
+    [
+        (
+            "rmdir: failed to remove '/a': No such file or directory\n"
+            "rmdir: failed to remove '/b': No such file or directory\n",
+            False,
+        ),
+        (
+            "rmdir: failed to remove '/a': No such file or directory\n"
+            "rmdir: failed to remove '/b': Directory not empty\n",
+            True,
+        ),
+    ],
+)
+def test_rmdirs(
+    process_con: connection.Connection, monkeypatch: pytest.MonkeyPatch, stderr: str, raises: bool
+):
+    # Arrange
+    con = process_con
+    fake_run_process = MagicMock(
+        side_effect=exceptions.FailedProcessError(["rmdir", "/a", "/b"], stderr=stderr)
+    )
+    monkeypatch.setattr(con, "run_process", fake_run_process)
+
+    # Act
+    with pytest.raises(exceptions.FailedProcessError) if raises else contextlib.nullcontext():
+        con.rmdirs([Path("/a"), Path("/b")])
+
+    # Assert
+    fake_run_process.assert_called_once_with(["rmdir", "/a", "/b"])
+
+
+def test_prune_empty_dirs(process_con: connection.Connection, monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    con = process_con
+    fake_run_process = MagicMock(return_value="/a/c/d\0/a/c\0")
+    monkeypatch.setattr(con, "run_process", fake_run_process)
+
+    # Act
+    result = con.prune_empty_dirs(Path("/a"), [Path("/a/b"), Path("/a/[x]*")])
+
+    # Assert
+    assert result == [Path("/a/c/d"), Path("/a/c")]
+    fake_run_process.assert_called_once_with(
+        [
+            "find",
+            "/a",
+            "-xdev",
+            "-depth",
+            "-type",
+            "d",
+            "-empty",
+            "!",
+            "-path",
+            "/a/b",
+            "!",
+            "-path",
+            "/a/[[]x][*]",
+            "-delete",
+            "-print0",
+        ]
+    )
+
+
+def test_rmdirs__empty(process_con: connection.Connection, monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    con = process_con
+    fake_run_process = MagicMock()
+    monkeypatch.setattr(con, "run_process", fake_run_process)
+
+    # Act
+    con.rmdirs([])
+
+    # Assert
+    fake_run_process.assert_not_called()
+
+
+def test_run_processes(process_con: connection.Connection, monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    con = process_con
+    fake_run_process = MagicMock(side_effect=["a\n", "b\n"])
+    monkeypatch.setattr(con, "run_process", fake_run_process)
+
+    # Act
+    result = con.run_processes([["echo", "a"], ["echo", "b"]])
+
+    # Assert
+    assert result == ["a\n", "b\n"]
+    assert fake_run_process.call_args_list == [call(["echo", "a"]), call(["echo", "b"])]
+
+
+def test_stat(process_con: connection.Connection, monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    con = process_con
+    monkeypatch.setattr(con, "exists", MagicMock(side_effect=[True, True, False]))
+    monkeypatch.setattr(con, "is_dir", MagicMock(side_effect=[True, False]))
+
+    # Act
+    result = con.stat([Path("/a"), Path("/b"), Path("/c")])
+
+    # Assert
+    assert result == [
+        connection.PathStat(exists=True, is_dir=True),
+        connection.PathStat(exists=True, is_dir=False),
+        connection.PathStat(exists=False, is_dir=False),
+    ]
+
+
+def test_run_process__remote_agent(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    monkeypatch.setattr(paramiko, "SSHClient", MagicMock())
+    fake_agent = MagicMock(closed=False)
+    fake_agent.request = MagicMock(
+        side_effect=[
+            [{"returncode": 0, "stdout": "snickers\n", "stderr": ""}],
+            [{"returncode": 1, "stdout": "", "stderr": "error\n"}],
+        ]
+    )
+    fake_start = MagicMock(return_value=fake_agent)
+    monkeypatch.setattr(connection.RemoteAgent, "start", fake_start)
+    con = connection.SSHConnection(host="example.com", location=Path("/test"))
+    con.use_remote_agent = True
+
+    # Act / Assert
+    with con:
+        assert con.run_process(["echo", "snickers"]) == "snickers\n"
+
+        with pytest.raises(exceptions.FailedProcessError):
+            con.run_process(["false"])
+
+    assert fake_start.call_count == 1
+    assert fake_agent.close.called is True
+    assert con._agent is None
+
+
+def test_run_process__remote_agent_unavailable(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    monkeypatch.setattr(paramiko, "SSHClient", MagicMock())
+    monkeypatch.setattr(
+        connection.RemoteAgent,
+        "start",
+        MagicMock(side_effect=exceptions.AgentUnavailableError("python3: command not found")),
+    )
+    fake_ssh = paramiko.SSHClient()
+    fake_ssh.exec_command = MagicMock(return_value=(MagicMock(), MagicMock(), MagicMock()))
+    fake_ssh.exec_command()[1].read().decode = MagicMock(return_value="snickers\n")
+    fake_ssh.exec_command()[1].channel.recv_exit_status = MagicMock(return_value=0)
+    con = connection.SSHConnection(host="example.com", location=Path("/test"))
+    con.use_remote_agent = True
+
+    # Act
+    with con:
+        result = con.run_process(["echo", "snickers"])
+
+    # Assert
+    assert result == "snickers\n"
+    assert con.use_remote_agent is False
+
+
+def test_run_process__remote_agent_terminated(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    monkeypatch.setattr(paramiko, "SSHClient", MagicMock())
+    dead_agent = MagicMock(closed=False)
+
+    def _terminate(*_args):
+        dead_agent.closed = True
+        raise exceptions.AgentUnavailableError("The agent terminated")
+
+    dead_agent.request = MagicMock(side_effect=_terminate)
+    new_agent = MagicMock(closed=False)
+    new_agent.request = MagicMock(
+        return_value=[{"returncode": 0, "stdout": "snickers\n", "stderr": ""}]
+    )
+    fake_start = MagicMock(side_effect=[dead_agent, new_agent])
+    monkeypatch.setattr(connection.RemoteAgent, "start", fake_start)
+    con = connection.SSHConnection(host="example.com", location=Path("/test"))
+    con.use_remote_agent = True
+
+    # Act / Assert
+    with con:
+        with pytest.raises(exceptions.AgentUnavailableError):
+            con.run_process(["echo", "snickers"])
+
+        assert con.run_process(["echo", "snickers"]) == "snickers\n"
+
+    assert fake_start.call_count == 2
+
+
+class FakeTransport:
+    """Emulates the channel limit of an SSH server (MaxSessions)."""
+
+    max_sessions = 10
+
+    def __init__(self):
+        self.channels: list[MagicMock] = []
+
+    def open_session(self) -> MagicMock:
+        if len(self.channels) >= self.max_sessions:
+            raise paramiko.ChannelException(2, "open failed")
+
+        responses = [
+            {"agent": "b4", "version": remote_agent.VERSION},
+            {"results": [{"value": {"returncode": 0, "stdout": "snickers\n", "stderr": ""}}]},
+        ]
+        channel = MagicMock()
+        channel.makefile = MagicMock(
+            side_effect=[
+                io.BytesIO(),
+                io.BytesIO("".join(json.dumps(x) + "\n" for x in responses).encode()),
+            ]
+        )
+        channel.close = MagicMock(side_effect=lambda: self.channels.remove(channel))
+        self.channels.append(channel)
+
+        return channel
+
+
+def test_run_process__remote_agent_many_targets(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    monkeypatch.setattr(paramiko, "SSHClient", MagicMock())
+    transport = FakeTransport()
+    fake_ssh = paramiko.SSHClient()
+    fake_ssh.get_transport = MagicMock(return_value=transport)
+
+    # Act
+    results = []
+    for i in range(transport.max_sessions + 2):
+        con = connection.SSHConnection(host="example.com", location=Path(f"/test{i}"))
+        con.use_remote_agent = True
+        con.keep_open = True
+        with con:
+            results.append(con.run_process(["echo", "snickers"]))
+
+    # Assert
+    assert results == ["snickers\n"] * (transport.max_sessions + 2)
+    assert transport.channels == []
+    fake_ssh.exec_command.assert_not_called()
+    fake_ssh.close.assert_not_called()
+
+    connection.SSHConnection.close_pool()
+
+
+def test_run_process__remote_agent_no_session(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    monkeypatch.setattr(paramiko, "SSHClient", MagicMock())
+    transport = FakeTransport()
+    transport.max_sessions = 0
+    fake_ssh = paramiko.SSHClient()
+    fake_ssh.get_transport = MagicMock(return_value=transport)
+    fake_ssh.exec_command = MagicMock(return_value=(MagicMock(), MagicMock(), MagicMock()))
+    fake_ssh.exec_command()[1].read().decode = MagicMock(return_value="snickers\n")
+    fake_ssh.exec_command()[1].channel.recv_exit_status = MagicMock(return_value=0)
+    con = connection.SSHConnection(host="example.com", location=Path("/test"))
+    con.use_remote_agent = True
+
+    # Act
+    with con:
+        result = con.run_process(["echo", "snickers"])
+
+    # Assert
+    assert result == "snickers\n"
+    assert con.use_remote_agent is False
+
+
+def test_remote_agent__threads(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    monkeypatch.setattr(paramiko, "SSHClient", MagicMock())
+    barrier = threading.Barrier(4)
+
+    def _start(*_args):
+        time.sleep(0.05)
+        return MagicMock(closed=False)
+
+    fake_start = MagicMock(side_effect=_start)
+    monkeypatch.setattr(connection.RemoteAgent, "start", fake_start)
+    con = connection.SSHConnection(host="example.com", location=Path("/test"))
+    con.use_remote_agent = True
+
+    def _get_agent(_i):
+        barrier.wait()
+        return con.remote_agent()
+
+    # Act
+    with con, ThreadPoolExecutor(max_workers=4) as executor:
+        agents = list(executor.map(_get_agent, range(4)))
+
+    # Assert
+    assert fake_start.call_count == 1
+    assert all(x is agents[0] for x in agents)
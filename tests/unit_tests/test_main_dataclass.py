@@ -1,12 +1,12 @@
 import contextlib
-from pathlib import PurePath
+from pathlib import Path, PurePath
 from unittest.mock import MagicMock
 
 import pytest
 
 from b4_backup import exceptions
 from b4_backup.config_schema import BaseConfig
-from b4_backup.main.connection import Connection
+from b4_backup.main.connection import Connection, LocalConnection
 from b4_backup.main.dataclass import (
     BackupHostPath,
     ChoiceSelector,
@@ -32,149 +32,107 @@ class TestBackupHostPath:
         # Assert
         assert new_path == pure_path
 
-    @pytest.mark.parametrize(
-        "data",
-        [
-            None,
-            exceptions.FailedProcessError(["rmdir", "a/b/c"], stderr="No such file or directory"),
-        ],
-    )
-    def test_rmdir(self, data, monkeypatch: pytest.MonkeyPatch):
+    @pytest.mark.parametrize("create", [True, False])
+    def test_rmdir(self, create: bool, tmp_path: Path):
         # Arrange
-        connection = Connection.from_url("/opt")
-        assert not isinstance(connection, contextlib.nullcontext)
-        fake_run_process = MagicMock(side_effect=data)
-        monkeypatch.setattr(connection, "run_process", fake_run_process)
-        host_path = BackupHostPath("a/b/c", connection=connection)
+        host_path = BackupHostPath(tmp_path / "a", connection=LocalConnection(tmp_path))
+        if create:
+            (tmp_path / "a").mkdir()
 
         # Act
         host_path.rmdir()
 
         # Assert
-        print(fake_run_process.call_args_list)
-        fake_run_process.assert_called_once_with(["rmdir", "a/b/c"])
+        assert not (tmp_path / "a").exists()
 
-    def test_rmdir__error(self, monkeypatch: pytest.MonkeyPatch):
+    def test_rmdir__error(self, tmp_path: Path):
         # Arrange
-        connection = Connection.from_url("/opt")
-        assert not isinstance(connection, contextlib.nullcontext)
-        fake_run_process = MagicMock(
-            side_effect=exceptions.FailedProcessError(["rmdir", "bla"]),
-        )
-        monkeypatch.setattr(connection, "run_process", fake_run_process)
-        host_path = BackupHostPath("a/b/c", connection=connection)
+        (tmp_path / "a/b").mkdir(parents=True)
+        host_path = BackupHostPath(tmp_path / "a", connection=LocalConnection(tmp_path))
 
         # Act / Assert
-        with pytest.raises(exceptions.FailedProcessError):
+        with pytest.raises(exceptions.PathOperationError):
             host_path.rmdir()
 
-    @pytest.mark.parametrize(
-        "data",
-        [
-            None,
-            exceptions.FailedProcessError(
-                ["ls", "-d", "a/b/c"], stderr="No such file or directory"
-            ),
-        ],
-    )
-    def test_exists(self, data, monkeypatch: pytest.MonkeyPatch):
+    @pytest.mark.parametrize(("name", "expect"), [("a", True), ("b", False), ("link", True)])
+    def test_exists(self, name: str, expect: bool, tmp_path: Path):
         # Arrange
-        connection = Connection.from_url("/opt")
-        assert not isinstance(connection, contextlib.nullcontext)
-        fake_run_process = MagicMock(side_effect=data)
-        monkeypatch.setattr(connection, "run_process", fake_run_process)
-        host_path = BackupHostPath("a/b/c", connection=connection)
+        (tmp_path / "a").touch()
+        (tmp_path / "link").symlink_to(tmp_path / "idontexist")
+        host_path = BackupHostPath(tmp_path / name, connection=LocalConnection(tmp_path))
 
         # Act
-        host_path.exists()
+        result = host_path.exists()
 
         # Assert
-        print(fake_run_process.call_args_list)
-        fake_run_process.assert_called_once_with(["ls", "-d", "a/b/c"])
+        assert result == expect
 
-    def test_exists__error(self, monkeypatch: pytest.MonkeyPatch):
+    def test_exists__error(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
         # Arrange
-        connection = Connection.from_url("/opt")
-        assert not isinstance(connection, contextlib.nullcontext)
-        fake_run_process = MagicMock(
-            side_effect=exceptions.FailedProcessError(["ls", "-d", "bla"]),
-        )
-        monkeypatch.setattr(connection, "run_process", fake_run_process)
-        host_path = BackupHostPath("a/b/c", connection=connection)
+        monkeypatch.setattr(Path, "lstat", MagicMock(side_effect=PermissionError("nope")))
+        host_path = BackupHostPath(tmp_path / "a", connection=LocalConnection(tmp_path))
 
         # Act / Assert
-        with pytest.raises(exceptions.FailedProcessError):
+        with pytest.raises(exceptions.PathOperationError):
             host_path.exists()
 
-    def test_mkdir(self, monkeypatch: pytest.MonkeyPatch):
+    @pytest.mark.parametrize(("path", "parents"), [("a", False), ("a/b/c", True)])
+    def test_mkdir(self, path: str, parents: bool, tmp_path: Path):
         # Arrange
-        connection = Connection.from_url("/opt")
-        assert not isinstance(connection, contextlib.nullcontext)
-        fake_run_process = MagicMock()
-        monkeypatch.setattr(connection, "run_process", fake_run_process)
-        host_path = BackupHostPath("a/b/c", connection=connection)
+        host_path = BackupHostPath(tmp_path / path, connection=LocalConnection(tmp_path))
 
         # Act
-        host_path.mkdir()
+        host_path.mkdir(parents=parents)
 
         # Assert
-        print(fake_run_process.call_args_list)
-        fake_run_process.assert_called_once_with(["mkdir", "a/b/c"])
+        assert (tmp_path / path).is_dir()
 
-    def test_rename(self, monkeypatch: pytest.MonkeyPatch):
+    def test_mkdir__error(self, tmp_path: Path):
         # Arrange
-        connection = Connection.from_url("/opt")
-        assert not isinstance(connection, contextlib.nullcontext)
-        fake_run_process = MagicMock()
-        monkeypatch.setattr(connection, "run_process", fake_run_process)
-        host_path = BackupHostPath("a/b/c", connection=connection)
+        host_path = BackupHostPath(tmp_path / "a/b/c", connection=LocalConnection(tmp_path))
+
+        # Act / Assert
+        with pytest.raises(exceptions.PathOperationError):
+            host_path.mkdir()
+
+    def test_rename(self, tmp_path: Path):
+        # Arrange
+        (tmp_path / "a").mkdir()
+        host_path = BackupHostPath(tmp_path / "a", connection=LocalConnection(tmp_path))
 
         # Act
-        host_path.rename(PurePath("d/e"))
+        host_path.rename(tmp_path / "b")
 
         # Assert
-        print(fake_run_process.call_args_list)
-        fake_run_process.assert_called_once_with(["mv", "a/b/c", "d/e"])
+        assert not (tmp_path / "a").exists()
+        assert (tmp_path / "b").is_dir()
 
-    @pytest.mark.parametrize(
-        ("data", "expect"),
-        [
-            ("\n", []),
-            ("c\nd\n", [PurePath("a/b/c"), PurePath("a/b/d")]),
-        ],
-    )
-    def test_iterdir(self, data: str, expect: list[PurePath], monkeypatch: pytest.MonkeyPatch):
+    @pytest.mark.parametrize(("names", "expect"), [([], []), (["d", "c"], ["c", "d"])])
+    def test_iterdir(self, names: list[str], expect: list[str], tmp_path: Path):
         # Arrange
-        connection = Connection.from_url("/opt")
-        assert not isinstance(connection, contextlib.nullcontext)
-        fake_run_process = MagicMock(return_value=data)
-        monkeypatch.setattr(connection, "run_process", fake_run_process)
-        host_path = BackupHostPath("a/b", connection=connection)
+        for name in names:
+            (tmp_path / name).touch()
+
+        host_path = BackupHostPath(tmp_path, connection=LocalConnection(tmp_path))
 
         # Act
         result = host_path.iterdir()
 
         # Assert
-        print(fake_run_process.call_args_list)
-        fake_run_process.assert_called_once_with(["ls", "a/b"])
-
         assert all(isinstance(x, BackupHostPath) for x in result)
-        assert set(result) == set(expect)
+        assert result == [tmp_path / x for x in expect]
 
-    @pytest.mark.parametrize(("data", "expect"), [("dxxxxxxx", True), ("-xxxxxxxx", False)])
-    def test_is_dir(self, data: str, expect: bool, monkeypatch: pytest.MonkeyPatch):
+    @pytest.mark.parametrize(("name", "expect"), [("a", True), ("b", False), ("c", False)])
+    def test_is_dir(self, name: str, expect: bool, tmp_path: Path):
         # Arrange
-        connection = Connection.from_url("/opt")
-        assert not isinstance(connection, contextlib.nullcontext)
-        fake_run_process = MagicMock(return_value=data)
-        monkeypatch.setattr(connection, "run_process", fake_run_process)
-        host_path = BackupHostPath("a/b/c", connection=connection)
+        (tmp_path / "a").mkdir()
+        (tmp_path / "b").touch()
+        host_path = BackupHostPath(tmp_path / name, connection=LocalConnection(tmp_path))
 
         # Act
         result = host_path.is_dir()
 
         # Assert
-        print(fake_run_process.call_args_list)
         assert result == expect
 
 
@@ -300,6 +258,7 @@ class TestChoiceSelector:
             (["f"], []),
             (["a"], ["a/b", "a/c"]),
             (["."], ["a/b", "a/c", "b", "c", "d"]),
+            (["d", "a/c", "a"], ["a/b", "a/c", "d"]),
         ],
     )
     def test_choice_selector_resolve_target(self, data: list[str], expect: list[str]):
@@ -310,7 +269,7 @@ class TestChoiceSelector:
         result = selector.resolve_target(["a/b", "a/c", "b", "c", "d"])
 
         # Assert
-        assert set(result) == set(expect)
+        assert result == expect
 
     @pytest.mark.parametrize(
         ("data", "expect"),
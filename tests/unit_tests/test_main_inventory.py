@@ -0,0 +1,191 @@
+import textwrap
+from pathlib import PurePath
+from unittest.mock import MagicMock
+
+import pytest
+
+from b4_backup.main.connection import LocalConnection, SSHConnection
+from b4_backup.main.inventory import SubvolumeInfo, SubvolumeInventory
+
+SUBVOLUME_LIST = textwrap.dedent(
+    """
+    ID 256 gen 621187 top level 5 parent_uuid - received_uuid - uuid 0b5a path alpha
+    ID 257 gen 621188 top level 256 parent_uuid 0b5a received_uuid 9c1e uuid 4d2f path alpha/bravo
+    """
+)
+
+
+def test_from_connection():
+    # Act
+    inventory1 = SubvolumeInventory.from_connection(
+        SSHConnection("example.com", PurePath("/a")), PurePath("/opt")
+    )
+    inventory2 = SubvolumeInventory.from_connection(
+        SSHConnection("example.com", PurePath("/b")), PurePath("/opt")
+    )
+    inventory3 = SubvolumeInventory.from_connection(
+        SSHConnection("example.org", PurePath("/a")), PurePath("/opt")
+    )
+
+    # Assert
+    assert inventory1 is inventory2
+    assert inventory1 is not inventory3
+
+
+def test_subvolumes(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    con = LocalConnection(PurePath("/opt/alpha"))
+    fake_run_process = MagicMock(return_value=SUBVOLUME_LIST)
+    monkeypatch.setattr(con, "run_process", fake_run_process)
+    inventory = SubvolumeInventory.from_connection(con, PurePath("/opt"))
+
+    # Act
+    result = inventory.subvolumes(con)
+    inventory.subvolumes(con)
+
+    # Assert
+    assert result == [PurePath("/opt"), PurePath("/opt/alpha"), PurePath("/opt/alpha/bravo")]
+    assert all(x.connection is con for x in result)
+    fake_run_process.assert_called_once_with(
+        ["btrfs", "subvolume", "list", "-q", "-u", "-R", "/opt"]
+    )
+
+
+def test_update(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    con = LocalConnection(PurePath("/opt/alpha"))
+    fake_run_process = MagicMock(return_value=SUBVOLUME_LIST)
+    monkeypatch.setattr(con, "run_process", fake_run_process)
+    inventory = SubvolumeInventory.from_connection(con, PurePath("/opt"))
+    inventory.subvolumes(con)
+
+    # Act
+    inventory.add(PurePath("/opt/charlie"))
+    inventory.remove(PurePath("/opt/alpha/bravo"))
+    inventory.rename(PurePath("/opt/alpha"), PurePath("/opt/delta/alpha"))
+    result = inventory.subvolumes(con)
+
+    # Assert
+    assert result == [PurePath("/opt"), PurePath("/opt/charlie"), PurePath("/opt/delta/alpha")]
+    assert fake_run_process.call_count == 1
+
+
+def test_update__not_loaded():
+    # Arrange
+    inventory = SubvolumeInventory(mount_point=PurePath("/opt"))
+
+    # Act
+    inventory.add(PurePath("/opt/charlie"))
+    inventory.remove(PurePath("/opt/alpha"))
+    inventory.rename(PurePath("/opt/alpha"), PurePath("/opt/delta"))
+
+    # Assert
+    assert inventory.loaded is False
+
+
+def test_invalidate(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    con = LocalConnection(PurePath("/opt/alpha"))
+    fake_run_process = MagicMock(return_value=SUBVOLUME_LIST)
+    monkeypatch.setattr(con, "run_process", fake_run_process)
+    inventory = SubvolumeInventory.from_connection(con, PurePath("/opt"))
+    inventory.subvolumes(con)
+
+    # Act
+    inventory.invalidate()
+    inventory.subvolumes(con)
+
+    # Assert
+    assert fake_run_process.call_count == 2
+
+
+def test_info(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    con = LocalConnection(PurePath("/opt/alpha"))
+    fake_run_process = MagicMock(return_value=SUBVOLUME_LIST)
+    monkeypatch.setattr(con, "run_process", fake_run_process)
+    inventory = SubvolumeInventory.from_connection(con, PurePath("/opt"))
+
+    # Act
+    alpha = inventory.info(con, PurePath("/opt/alpha"))
+    bravo = inventory.info(con, PurePath("/opt/alpha/bravo"))
+    mount_point = inventory.info(con, PurePath("/opt"))
+
+    # Assert
+    assert alpha == SubvolumeInfo(id=256, generation=621187, uuid="0b5a")
+    assert bravo == SubvolumeInfo(
+        id=257, generation=621188, uuid="4d2f", parent_uuid="0b5a", received_uuid="9c1e"
+    )
+    assert mount_point is None
+    assert fake_run_process.call_count == 1
+
+
+def test_info__update(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    con = LocalConnection(PurePath("/opt/alpha"))
+    fake_run_process = MagicMock(return_value=SUBVOLUME_LIST)
+    monkeypatch.setattr(con, "run_process", fake_run_process)
+    inventory = SubvolumeInventory.from_connection(con, PurePath("/opt"))
+    inventory.subvolumes(con)
+
+    # Act
+    inventory.rename(PurePath("/opt/alpha"), PurePath("/opt/delta"))
+    renamed = inventory.info(con, PurePath("/opt/delta/bravo"))
+    inventory.remove(PurePath("/opt/delta"))
+    removed = inventory.info(con, PurePath("/opt/delta"))
+    calls_before_add = fake_run_process.call_count
+    inventory.add(PurePath("/opt/charlie"))
+    added = inventory.info(con, PurePath("/opt/charlie"))
+
+    # Assert
+    assert renamed is not None
+    assert renamed.uuid == "4d2f"
+    assert removed is None
+    assert calls_before_add == 1
+    # Unknown metadata of an added subvolume is read from the host again
+    assert added is None
+    assert fake_run_process.call_count == 2
+
+
+def test_infos(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    con = LocalConnection(PurePath("/opt/alpha"))
+    fake_run_process = MagicMock(return_value=SUBVOLUME_LIST)
+    monkeypatch.setattr(con, "run_process", fake_run_process)
+    inventory = SubvolumeInventory.from_connection(con, PurePath("/opt"))
+
+    # Act
+    result = inventory.infos(con)
+    inventory.infos(con)
+    inventory.add(PurePath("/opt/charlie"))
+    inventory.infos(con)
+
+    # Assert
+    assert sorted(result) == [PurePath("/opt/alpha"), PurePath("/opt/alpha/bravo")]
+    assert fake_run_process.call_count == 2
+
+
+def test_received_uuids(monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    con = LocalConnection(PurePath("/opt/alpha"))
+    fake_run_process = MagicMock(return_value=SUBVOLUME_LIST)
+    monkeypatch.setattr(con, "run_process", fake_run_process)
+    inventory = SubvolumeInventory.from_connection(con, PurePath("/opt"))
+
+    # Act
+    result = inventory.received_uuids(con)
+    inventory.add(PurePath("/opt/charlie"), "7f3a")
+    inventory.rename(PurePath("/opt/charlie"), PurePath("/opt/delta"))
+    received = inventory.received_uuids(con)
+    inventory.remove(PurePath("/opt/delta"))
+    removed = inventory.received_uuids(con)
+    calls_before_add = fake_run_process.call_count
+    inventory.add(PurePath("/opt/echo"))
+    inventory.received_uuids(con)
+
+    # Assert
+    assert result == {"9c1e"}
+    assert received == {"9c1e", "7f3a"}
+    assert removed == {"9c1e"}
+    assert calls_before_add == 1
+    assert fake_run_process.call_count == 2
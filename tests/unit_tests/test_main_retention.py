@@ -0,0 +1,111 @@
+import arrow
+import pytest
+
+from b4_backup import exceptions
+from b4_backup.main import retention
+
+_FMT = "YYYY-MM-DD-HH-mm-ss"
+
+
+@pytest.mark.parametrize(
+    ("timebox", "is_interval", "expect"),
+    [
+        ("4days", True, (4, "days")),
+        ("4days", False, (4, "days")),
+        ("all", True, (0, "all")),
+        ("forever", False, (0, "forever")),
+        ("1year", False, (1, "years")),
+        ("5weeks", False, (5, "weeks")),
+        ("5", False, (5, None)),
+    ],
+)
+def test_parse_timebox__success(timebox: str, is_interval: bool, expect: tuple[int, str | None]):
+    # Act
+    result = retention.parse_timebox(timebox, is_interval=is_interval)
+
+    # Assert
+    assert result == expect
+
+
+@pytest.mark.parametrize(
+    ("timebox", "is_interval"),
+    [("what4", True), ("all", False), ("forever", True)],
+)
+def test_parse_timebox__error(timebox: str, is_interval: bool):
+    # Act / Assert
+    with pytest.raises(exceptions.InvalidRetentionRuleError):
+        retention.parse_timebox(timebox, is_interval=is_interval)
+
+
+@pytest.mark.parametrize("timestamp", ["1970-01-01-00-00-00", "2024-02-29-23-59-59"])
+def test_parse_timestamp(timestamp: str):
+    # Act
+    result = retention.parse_timestamp(timestamp)
+
+    # Assert
+    assert result == arrow.get(timestamp, _FMT).int_timestamp
+    assert retention.format_timestamp(result) == timestamp
+
+
+@pytest.mark.parametrize("timestamp", ["2023-02-30-00-00-00", "2023-08-07", "manual"])
+def test_parse_timestamp__error(timestamp: str):
+    # Act / Assert
+    with pytest.raises(ValueError):  # noqa: PT011
+        retention.parse_timestamp(timestamp)
+
+
+@pytest.mark.parametrize(
+    ("now", "expect"),
+    [
+        ("2023-08-07T23:59:37+00:00", "2023-08-06-23-59-37"),
+        ("2023-08-07T23:59:37.000001+00:00", "2023-08-06-23-59-38"),
+    ],
+)
+def test_cutoff_timestamp(now: str, expect: str):
+    # Act
+    result = retention.cutoff_timestamp(arrow.get(now), 1, "days")
+
+    # Assert
+    assert retention.format_timestamp(result) == expect
+
+
+@pytest.mark.parametrize(
+    "magnitude", ["seconds", "minutes", "hours", "days", "weeks", "months", "years"]
+)
+@pytest.mark.parametrize("size", [1, 3])
+@pytest.mark.parametrize(
+    "timestamp", ["2023-08-07-22-59-37", "2024-03-31-00-00-00", "1969-12-31-12-00-00"]
+)
+def test_interval_start(timestamp: str, size: int, magnitude: str):
+    # Arrange
+    date = arrow.get(timestamp, _FMT)
+
+    # Act
+    result = retention.interval_start(date.int_timestamp, size, magnitude)
+
+    # Assert
+    expect = date.shift(**{magnitude: 1 - size}).span(magnitude[:-1], count=size)[0]  # type: ignore
+    assert result == expect.int_timestamp
+
+
+@pytest.mark.parametrize(
+    ("interval_size", "interval_magnitude", "start", "limit", "expect"),
+    [
+        (0, "all", 0, None, [50, 40, 30, 20, 10]),
+        (0, "all", 2, None, [50, 40, 30]),
+        (0, "all", 0, 2, [50, 40]),
+        (20, "seconds", 0, None, [50, 30, 10]),
+        (20, "seconds", 0, 2, [50, 30]),
+        (20, "seconds", 3, None, [50]),
+    ],
+)
+def test_retain(
+    interval_size: int, interval_magnitude: str, start: int, limit: int | None, expect: list[int]
+):
+    # Act
+    result = retention.retain(
+        [10, 20, 30, 40, 50], interval_size, interval_magnitude, start=start, limit=limit
+    )
+
+    # Assert
+    assert result == expect
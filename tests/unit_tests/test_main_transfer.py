@@ -0,0 +1,116 @@
+import os
+import tempfile
+
+import pytest
+
+from b4_backup import exceptions
+from b4_backup.main import transfer
+
+
+def test_pump():
+    # Act
+    result = transfer.pump(["bash", "-c", "head -c 3000000 /dev/zero; echo done >&2"], ["wc", "-c"])
+
+    # Assert
+    assert result.size == 3_000_000
+    assert result.send_stderr == "done\n"
+    assert result.receive_stderr == "3000000\n"
+    assert result.duration >= result.send_duration
+
+
+@pytest.mark.parametrize(
+    ("send_command", "receive_command", "expected_failed_command"),
+    [
+        (["bash", "-c", "echo error >&2; exit 3"], ["cat"], "send"),
+        (
+            ["head", "-c", "3000000", "/dev/zero"],
+            ["bash", "-c", "head -c 10 > /dev/null; echo error >&2; exit 2"],
+            "receive",
+        ),
+        (["bash", "-c", "yes; echo error >&2"], ["true"], "send"),
+    ],
+)
+def test_pump__error(send_command: list[str], receive_command: list[str], expected_failed_command):
+    # Act / Assert
+    with pytest.raises(exceptions.FailedProcessError) as exc_info:
+        transfer.pump(send_command, receive_command)
+
+    assert (
+        exc_info.value.cmd
+        == {"send": send_command, "receive": receive_command}[expected_failed_command]
+    )
+
+
+@pytest.mark.parametrize("splice", [True, False])
+def test_copy(monkeypatch: pytest.MonkeyPatch, splice: bool):
+    # Arrange
+    if not splice:
+        monkeypatch.delattr(os, "splice", raising=False)
+
+    src_read, src_write = os.pipe()
+    dst_read, dst_write = os.pipe()
+    os.write(src_write, b"snickers")
+    os.close(src_write)
+
+    # Act
+    result = transfer._copy(src_read, dst_write, 4)
+
+    # Assert
+    os.close(dst_write)
+    assert result == (8, True)
+    assert os.read(dst_read, 100) == b"snickers"
+
+    os.close(src_read)
+    os.close(dst_read)
+
+
+@pytest.mark.parametrize("splice", [True, False])
+def test_copy__broken_pipe(monkeypatch: pytest.MonkeyPatch, splice: bool):
+    # Arrange
+    if not splice:
+        monkeypatch.delattr(os, "splice", raising=False)
+
+    src_read, src_write = os.pipe()
+    dst_read, dst_write = os.pipe()
+    os.write(src_write, b"snickers")
+    os.close(src_write)
+    os.close(dst_read)
+
+    # Act
+    result = transfer._copy(src_read, dst_write, 4)
+
+    # Assert
+    assert result == (0, False)
+
+    os.close(src_read)
+    os.close(dst_write)
+
+
+def test_set_pipe_size__no_pipe():
+    # Arrange
+    with tempfile.TemporaryFile() as file:
+        # Act / Assert
+        transfer._set_pipe_size(file, 1024 * 1024)
+
+
+@pytest.mark.parametrize(
+    ("stats", "expected_result"),
+    [
+        (
+            transfer.TransferStats(
+                size=3_000_000, duration=2.0, send_duration=1.0, receive_duration=2.0
+            ),
+            "3.00 MB in 2.00s (1.50 MB/s, send 1.00s, receive 2.00s)",
+        ),
+        (
+            transfer.TransferStats(size=0, duration=0.0, send_duration=0.0, receive_duration=0.0),
+            "0.00 MB in 0.00s (0.00 MB/s, send 0.00s, receive 0.00s)",
+        ),
+    ],
+)
+def test_transfer_stats(stats: transfer.TransferStats, expected_result: str):
+    # Act
+    result = str(stats)
+
+    # Assert
+    assert result == expected_result
@@ -1,5 +1,7 @@
+import os
 import tempfile
 from pathlib import Path
+from unittest.mock import MagicMock
 
 import pytest
 from rich.logging import RichHandler
@@ -65,6 +67,178 @@ def test_load_config_existing(config_path: Path):
     }
 
 
+def test_load_config__cached(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    monkeypatch.setattr(utils, "CONFIG_CACHE_DIR", tmp_path / "cache")
+    config_path = tmp_path / "config.yml"
+    config_path.write_text("timezone: Europe/Berlin\n")
+    expected = utils.load_config(config_path, ["max_workers=2"])
+    monkeypatch.setattr(utils, "_load_config", MagicMock(side_effect=AssertionError))
+
+    # Act
+    result = utils.load_config(config_path, ["max_workers=2"])
+
+    # Assert
+    assert result == expected
+    assert result is not expected
+    assert len(list((tmp_path / "cache").iterdir())) == 1
+
+
+@pytest.mark.parametrize(
+    ("change", "overrides"),
+    [
+        ("config", ["max_workers=2"]),
+        ("from_file", ["max_workers=2"]),
+        ("touch", ["max_workers=2"]),
+        ("none", ["max_workers=3"]),
+    ],
+)
+def test_load_config__cache_invalidated(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, change: str, overrides: list[str]
+):
+    # Arrange
+    monkeypatch.setattr(utils, "CONFIG_CACHE_DIR", tmp_path / "cache")
+    config_path = tmp_path / "config.yml"
+    timezone_path = tmp_path / "timezone.txt"
+    timezone_path.write_text("Europe/Berlin")
+    config_path.write_text(f"timezone: ${{from_file:{timezone_path}}}\n")
+    utils.load_config(config_path, ["max_workers=2"])
+
+    if change == "config":
+        config_path.write_text(f"timezone: ${{from_file:{timezone_path}}}\nmax_workers: 4\n")
+    elif change == "from_file":
+        timezone_path.write_text("Europe/Vienna")
+    elif change == "touch":
+        # Same content with a new modification time is still cached
+        os.utime(timezone_path, ns=(0, 0))
+    fake_load_config = MagicMock(wraps=utils._load_config)
+    monkeypatch.setattr(utils, "_load_config", fake_load_config)
+
+    # Act
+    result = utils.load_config(config_path, overrides)
+
+    # Assert
+    assert fake_load_config.call_count == (0 if change == "touch" else 1)
+    assert result.timezone == ("Europe/Vienna" if change == "from_file" else "Europe/Berlin")
+
+
+@pytest.mark.parametrize(
+    ("content", "overrides"),
+    [
+        ("timezone: ${oc.env:B4_TEST_TIMEZONE}\n", []),
+        ("", ["timezone=${oc.env:B4_TEST_TIMEZONE}"]),
+    ],
+)
+def test_load_config__env_not_cached(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, content: str, overrides: list[str]
+):
+    # Arrange
+    monkeypatch.setattr(utils, "CONFIG_CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setenv("B4_TEST_TIMEZONE", "Europe/Berlin")
+    config_path = tmp_path / "config.yml"
+    config_path.write_text(content)
+
+    # Act
+    result = utils.load_config(config_path, overrides)
+
+    # Assert
+    assert result.timezone == "Europe/Berlin"
+    assert not (tmp_path / "cache").exists()
+
+
+@pytest.mark.parametrize("foreign", ["mode", "owner"])
+def test_load_config__cache_untrusted(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, foreign: str
+):
+    # Arrange
+    monkeypatch.setattr(utils, "CONFIG_CACHE_DIR", tmp_path / "cache")
+    config_path = tmp_path / "config.yml"
+    config_path.write_text("timezone: Europe/Berlin\n")
+    utils.load_config(config_path)
+    (cache_file,) = (tmp_path / "cache").iterdir()
+    if foreign == "mode":
+        cache_file.chmod(0o662)
+    else:
+        monkeypatch.setattr(os, "getuid", MagicMock(return_value=os.getuid() + 1))
+    fake_load_config = MagicMock(wraps=utils._load_config)
+    monkeypatch.setattr(utils, "_load_config", fake_load_config)
+
+    # Act
+    result = utils.load_config(config_path)
+
+    # Assert
+    assert result.timezone == "Europe/Berlin"
+    assert fake_load_config.call_count == 1
+
+
+def test_load_config__cache_permissions(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    monkeypatch.setattr(utils, "CONFIG_CACHE_DIR", tmp_path / "cache")
+    config_path = tmp_path / "config.yml"
+    config_path.write_text("timezone: Europe/Berlin\n")
+
+    # Act
+    utils.load_config(config_path)
+
+    # Assert
+    (cache_file,) = (tmp_path / "cache").iterdir()
+    assert (tmp_path / "cache").stat().st_mode & 0o777 == 0o700
+    assert cache_file.stat().st_mode & 0o777 == 0o600
+
+
+def test_load_config__cache_unreadable(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    monkeypatch.setattr(utils, "CONFIG_CACHE_DIR", tmp_path / "cache")
+    config_path = tmp_path / "config.yml"
+    config_path.write_text("timezone: Europe/Berlin\n")
+    utils.load_config(config_path)
+    for cache_file in (tmp_path / "cache").iterdir():
+        cache_file.write_bytes(b"garbage")
+
+    # Act
+    result = utils.load_config(config_path)
+
+    # Assert
+    assert result.timezone == "Europe/Berlin"
+
+
+def test_load_config__cache_not_writable(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    (tmp_path / "cache").write_text("not a directory")
+    monkeypatch.setattr(utils, "CONFIG_CACHE_DIR", tmp_path / "cache")
+    config_path = tmp_path / "config.yml"
+    config_path.write_text("timezone: Europe/Berlin\n")
+
+    # Act
+    result = utils.load_config(config_path)
+
+    # Assert
+    assert result.timezone == "Europe/Berlin"
+
+
+def test_config_input_changed(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # Arrange
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    (tmp_path / "a" / "value.txt").write_text("1")
+    (tmp_path / "b" / "value.txt").write_text("1")
+    monkeypatch.chdir(tmp_path / "a")
+    config_input = utils.ConfigInput.from_path("value.txt")
+
+    # Act
+    unchanged = config_input.changed()
+    monkeypatch.chdir(tmp_path / "b")
+    relative_moved = config_input.changed()
+    (tmp_path / "a" / "value.txt").unlink()
+    removed = utils.ConfigInput.from_path(str(tmp_path / "b" / "value.txt"))
+    (tmp_path / "b" / "value.txt").unlink()
+
+    # Assert
+    assert unchanged is False
+    assert relative_moved is True
+    assert removed.changed() is True
+
+
 @pytest.mark.parametrize(
     ("path", "subpath", "expected_result"),
     [
@@ -80,3 +254,37 @@ def test_contains_path(path: Path, subpath: Path, expected_result: bool):
 
     # Assert
     assert result == expected_result
+
+
+@pytest.mark.parametrize(
+    ("path", "expected_result"),
+    [
+        (Path("/home/test/.cache/pypoetry/virtualenvs"), ["root", "home", "cache"]),
+        (Path("/home/test/.cache/darktable/profile"), ["root", "home"]),
+        (Path("/home/test/test/.cache/pypoetry"), ["root", "home", "cache"]),
+        (Path("/test/pictures"), ["root", "pictures"]),
+        (Path("test/pictures"), ["pictures"]),
+        (Path("a/b/a/b/c"), ["b", "b", "a/b/c", "b/c"]),
+        (Path(), []),
+    ],
+)
+def test_path_matcher(path: Path, expected_result: list[str]):
+    # Arrange
+    matcher = utils.PathMatcher(
+        [
+            (Path("/"), "root"),
+            (Path("/home/test"), "home"),
+            (Path(".cache/pypoetry"), "cache"),
+            (Path("test/pictures"), "pictures"),
+            (Path("a/b/a/b/c"), "a/b/c"),
+            (Path("b/c"), "b/c"),
+            (Path("b"), "b"),
+            (Path(), "empty"),
+        ]
+    )
+
+    # Act
+    result = matcher.matches(path)
+
+    # Assert
+    assert result == expected_result